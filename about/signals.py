@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat.prompts import invalidate_system_prompt
+from .models import About
+
+
+@receiver(post_save, sender=About)
+@receiver(post_delete, sender=About)
+def invalidate_cached_system_prompt(sender, instance, **kwargs):
+    invalidate_system_prompt(instance.user_id)
@@ -0,0 +1,66 @@
+"""
+Sliding-window rate limits kept in the Django cache.
+
+SlidingWindow approximates a true sliding window with two fixed windows: the
+hits in the current window, plus the previous window's hits weighted by how
+much of it the sliding window still covers. Each hit is a single
+cache.incr(), which is atomic on Redis, Memcached and locmem. The database
+and file caches implement incr() as a read and a write, so under concurrent
+hits they may let a few extra through.
+"""
+import math
+import time
+
+from django.core.cache import caches
+
+
+class SlidingWindow:
+    """
+    At most `limit` hits per `window` seconds for each key. Rejected hits
+    count too, so a client that keeps retrying stays limited.
+    """
+
+    def __init__(self, prefix, limit, window, cache_alias="default"):
+        self.prefix = prefix
+        self.limit = limit
+        self.window = window
+        self.cache_alias = cache_alias
+
+    def _key(self, key, bucket):
+        return f"{self.prefix}:{key}:{bucket}"
+
+    def hit(self, key, now=None):
+        """
+        Count a hit for `key`. Returns (allowed, retry_after): whether the hit
+        is within the limit and, if not, seconds until the next one would be.
+        """
+        cache = caches[self.cache_alias]
+        now = time.time() if now is None else now
+        bucket, offset = divmod(now, self.window)
+        current_key = self._key(key, int(bucket))
+
+        # Windows live for two periods: their own, then as the previous window.
+        cache.add(current_key, 0, self.window * 2)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:  # expired between add() and incr()
+            cache.set(current_key, 1, self.window * 2)
+            current = 1
+        previous = cache.get(self._key(key, int(bucket) - 1), 0)
+
+        overlap = 1 - offset / self.window
+        if previous * overlap + current <= self.limit:
+            return True, 0
+        return False, self.retry_after(previous, current, offset)
+
+    def retry_after(self, previous, current, offset):
+        if current >= self.limit or not previous:
+            return max(1, math.ceil(self.window - offset))
+        # The previous window's weight has to drop to what the current one leaves.
+        overlap = (self.limit - current) / previous
+        return max(1, math.ceil((1 - overlap) * self.window - offset))
+
+    def reset(self, key, now=None):
+        now = time.time() if now is None else now
+        bucket = int(now // self.window)
+        caches[self.cache_alias].delete_many([self._key(key, bucket), self._key(key, bucket - 1)])
@@ -11,7 +11,10 @@ from users.views import (
 from chat.views import (
     ChatListCreateView, ChatDetailView,
     MessageListCreateView, MessageDetailView,
-    chat_with_assistant, ChatRespondAPIView
+    chat_with_assistant, ChatRespondAPIView, ChatRespondStreamAPIView
+)
+from chat.async_views import (
+    ChatRespondAsyncView, ChatRespondStreamAsyncView, chat_with_assistant_async,
 )
 
 # --- Plans
@@ -55,8 +58,14 @@ urlpatterns = [
 
     # 🤖 AI Chatbot
     path('chat-respond/', ChatRespondAPIView.as_view(), name='chat-respond'),
+    path('chat-respond/stream/', ChatRespondStreamAPIView.as_view(), name='chat-respond-stream'),
     path("bot/<int:chat_id>/", chat_with_assistant, name="chat-with-assistant"),
 
+    # 🤖 AI Chatbot, async (serve with ASGI, see myproject/asgi.py)
+    path('chat-respond/async/', ChatRespondAsyncView.as_view(), name='chat-respond-async'),
+    path('chat-respond/stream/async/', ChatRespondStreamAsyncView.as_view(), name='chat-respond-stream-async'),
+    path("bot/<int:chat_id>/async/", chat_with_assistant_async, name="chat-with-assistant-async"),
+
     # 📅 Plans
     path('plans/', PlanListCreateView.as_view(), name='plan-list-create'),
     path('plans/<int:pk>/', PlanDetailView.as_view(), name='plan-detail'),
@@ -1,3 +1,15 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 
-# Create your views here.
+from api.metrics import render_metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint for the in-process metrics in api/metrics.py.
+    If METRICS_TOKEN is set, scrapers must send it as a bearer token.
+    """
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -37,90 +37,297 @@
 #     return response, messages  # you can return chat log or whatever you want
 
 
-from django.utils import timezone
-from chat.models import Chat, Message
-from about.models import About
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
+from asgiref.sync import sync_to_async
 from langchain_core.output_parsers import StrOutputParser
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
-
-# LLM setup
-llm = ChatOllama(model="llama3.2:3b", 
-                 base_url="http://localhost:11434",
-                 temperature=0.7,
-                 top_k=40,
-                 top_p=0.9,
-                 repeat_penalty=1.1,
-                 num_ctx=4096)
+from chat.services import commit_chat_turn
+from chat.context import build_context_window, abuild_context_window
+from chat.limiter import LLMBusy, llm_slot, allm_slot
+from chat.response_cache import get_cached_response, store_response, aget_cached_response, astore_response
+from chat import semantic_cache
+from chat.prompts import get_profile, aget_profile, build_messages
+from chat.llm import get_llm, profile_for
+from chat.breaker import breaker_for
+from chat.fallback import reply_for_failure
+from chat.instrumentation import TurnTimings
+from chat.retrieval import retrieve, aretrieve
+
+# LLM setup: models come from settings.LLM_PROFILES (see chat/llm.py)
 output_parser = StrOutputParser()
 
-def generate_response_from_chat(chat, user, user_input): 
-    # 1. Get About info
-    try:
-        about = user.about
-    except About.DoesNotExist:
-        return "User profile missing. Please complete your About section.", ""
-
-    # 2. Build personalized system message
-    system_message = f"""
-    You are a concise, smart, and context-aware assistant who gives sharp, relevant replies only.
-    This user is a sports coach. They specialize in: **{about.sport_coach}**.
-    Here’s what the user said about themselves:
-    ---
-    {about.details}
-    ---
-    Use this info to personalize your tone, advice, examples, and especially team-specific responses.
-    If they ask about "my team", infer from the text above.
-    Do not give general explanations. Focus only on what they ask.
-    Keep answers short and inline unless explicitly asked for depth.
+PROFILE_MISSING_REPLY = "User profile missing. Please complete your About section."
+
+
+def assemble_chat_history(system_message, memory, messages, user, user_input, notes):
+    history = [(sender_id == user.id, content) for sender_id, content in messages]
+    # 4. Append retrieved notes and the current message
+    return build_messages(system_message, memory, history, user_input, notes)
+
+
+def build_chat_history(chat, user, user_input, timings):
     """
+    Build the typed LangChain message list for a chat turn.
+    Returns (chat_history, messages, profile), where `messages` are the
+    (sender_id, content) rows in the context window, or (None, None, None) if the user has no About profile.
+    """
+    with timings.stage("history"):
+        # 1-2. Get the cached profile and personalized system message
+        profile = get_profile(user)
+        if profile is None:
+            timings.outcome = "profile_missing"
+            return None, None, None
+        system_message = profile.system_message
+    with timings.stage("retrieval"):
+        # 3. Look up notes from the coach's plans and other chats (chat/retrieval.py)
+        notes = retrieve(user, chat, user_input.strip())
+    with timings.stage("history"):
+        # Collect the most recent chat history that fits the remaining token budget
+        messages, memory = build_context_window(chat, system_message, user_input.strip(), notes)
+    with timings.stage("prompt"):
+        chat_history = assemble_chat_history(system_message, memory, messages, user, user_input, notes)
+    return chat_history, messages, profile
+
 
-    # 3. Collect chat history
-    chat_history = [("system", system_message)]
-    messages = Message.objects.filter(chat=chat).order_by("timestamp")
-
-    for msg in messages:
-        role = "user" if msg.sender == user else "assistant"
-        chat_history.append((role, msg.content))
-
-    # 4. Append current message
-    chat_history.append(("user", user_input.strip()))
-
-    # 5. Generate response
-    prompt = ChatPromptTemplate.from_messages(chat_history)
-    chain = prompt | llm | output_parser
-    try:
-        response = chain.invoke({}).strip()
-    except Exception as e:
-        return f"[AI Error]: {str(e)}", ""
-
-    # 6. Save both messages
-    bot_user, _ = User.objects.get_or_create(username="chatbot")
-    chat.participants.add(bot_user)
-    Message.objects.create(chat=chat, sender=user, content=user_input.strip())
-    Message.objects.create(chat=chat, sender=bot_user, content=response)
-
-    # 7. Update chat duration
-    chat.total_chat_duration = timezone.now() - chat.created_at
-
-    # 8. Auto-summary
-    full_chat_text = "\n".join(
-        f"{'User' if msg.sender == user else 'Assistant'}: {msg.content}"
-        for msg in messages
+def build_chat_log(user, user_input, response, messages):
+    """Render the conversation so far, including the new turn, as plain text."""
+    return "\n".join(
+        f"{'User' if sender_id == user.id else 'Assistant'}: {content}"
+        for sender_id, content in messages
     ) + f"\nUser: {user_input.strip()}\nAssistant: {response}"
 
-    summary_prompt = ChatPromptTemplate.from_template(
-        "Summarize this conversation into a single paragraph. Focus on what the user asked, what they were interested in, and what the assistant provided:\n\n{chat}"
-    )
-    summary_chain = summary_prompt | llm | output_parser
-    try:
-        summary_text = summary_chain.invoke({"chat": full_chat_text}).strip()
-        chat.topic_summary = summary_text
-        chat.save()
-    except Exception:
-        pass  # Fail silently if summarization fails
-
-    return response, full_chat_text
\ No newline at end of file
+
+def find_cached_reply(llm, chat, profile, chat_history):
+    """
+    Look for a reusable reply: exact-match cache first, then the semantic cache.
+    Returns (reply or None, cache_state); pass cache_state on to remember_reply().
+    """
+    cache_key, response = get_cached_response(llm, chat_history, chat)
+    vector = None
+    if response is None:
+        vector, response = semantic_cache.lookup(profile, chat_history)
+    return response, (cache_key, vector)
+
+
+def remember_reply(profile, chat_history, response, cache_state):
+    cache_key, vector = cache_state
+    store_response(cache_key, response)
+    semantic_cache.store(profile, chat_history, response, vector)
+
+
+def llm_failed(timings, user_input, error):
+    """Record a failed LLM call on the turn and return the fallback reply."""
+    timings.outcome = "fallback"
+    timings.llm_failed(error)
+    return reply_for_failure(user_input, error)
+
+
+def generate_reply(chat, user, user_input, timings):
+    """
+    Produce the assistant reply for a turn without saving anything.
+    Returns (response, messages, ok); `ok` is False when `response` is an
+    error text rather than a reply. If the LLM is down, the reply comes from
+    chat.fallback. Stage timings are recorded on `timings` (a TurnTimings).
+    """
+    chat_history, messages, profile = build_chat_history(chat, user, user_input, timings)
+    if chat_history is None:
+        return PROFILE_MISSING_REPLY, None, False
+
+    # 5. Generate response (raises LLMBusy when the LLM queue is full)
+    llm_profile = timings.profile = profile_for(user)
+    llm = get_llm(llm_profile)
+    response, cache_state = find_cached_reply(llm, chat, profile, chat_history)
+    if response is not None:
+        timings.outcome = "cached"
+    else:
+        chain = llm | output_parser
+        try:
+            with llm_slot(), breaker_for(llm_profile).call():
+                response = chain.invoke(chat_history, config=timings.llm_config()).strip()
+        except LLMBusy:
+            raise
+        except Exception as e:
+            return llm_failed(timings, user_input, e), messages, True
+        remember_reply(profile, chat_history, response, cache_state)
+    return response, messages, True
+
+
+def generate_response_from_chat(chat, user, user_input): 
+    with TurnTimings(chat.id) as timings:
+        response, messages, ok = generate_reply(chat, user, user_input, timings)
+        if not ok:
+            return response, ""
+
+        # 6. Save both messages in one transaction
+        with timings.stage("persist"):
+            commit_chat_turn(chat, user, user_input, response)
+    return response, build_chat_log(user, user_input, response, messages)
+
+
+def stream_response_from_chat(chat, user, user_input):
+    """
+    Streaming variant of generate_response_from_chat.
+    Yields ("token", text) as the model produces it, then ("done", bot_message)
+    once the full reply has been saved, or ("error", text) if generation fails.
+    Raises LLMBusy from the first next() if no LLM slot is available.
+    """
+    with TurnTimings(chat.id) as timings:
+        chat_history, messages, profile = build_chat_history(chat, user, user_input, timings)
+        if chat_history is None:
+            timings.finish()
+            yield "error", PROFILE_MISSING_REPLY
+            return
+
+        # 5. Stream response (raises LLMBusy when the LLM queue is full)
+        llm_profile = timings.profile = profile_for(user)
+        llm = get_llm(llm_profile)
+        response, cache_state = find_cached_reply(llm, chat, profile, chat_history)
+        if response is not None:
+            timings.outcome = "cached"
+            yield "token", response
+        else:
+            chain = llm | output_parser
+            chunks = []
+            try:
+                with llm_slot(), breaker_for(llm_profile).call() as call:
+                    for token in chain.stream(chat_history, config=timings.llm_config()):
+                        call.first_token()
+                        chunks.append(token)
+                        yield "token", token
+            except LLMBusy:
+                raise
+            except Exception as e:
+                if chunks:
+                    timings.outcome = "error"
+                    timings.llm_failed(e)
+                    timings.finish()
+                    yield "error", f"[AI Error]: {str(e)}"
+                    return
+                # Nothing sent yet: answer from the fallback responder instead
+                response = llm_failed(timings, user_input, e)
+                yield "token", response
+            else:
+                response = "".join(chunks).strip()
+                remember_reply(profile, chat_history, response, cache_state)
+
+        with timings.stage("persist"):
+            _, bot_msg = commit_chat_turn(chat, user, user_input, response)
+        # Report before the last event: the consumer may close the stream after it
+        timings.finish()
+        yield "done", bot_msg
+
+
+# Async pipeline, served by the views in chat/async_views.py under ASGI.
+# The LLM call is awaited with ainvoke/astream, so a worker is not blocked while
+# Ollama is generating.
+
+async def abuild_chat_history(chat, user, user_input, timings):
+    """Async version of build_chat_history."""
+    with timings.stage("history"):
+        profile = await aget_profile(user)
+        if profile is None:
+            timings.outcome = "profile_missing"
+            return None, None, None
+
+        system_message = profile.system_message
+    with timings.stage("retrieval"):
+        notes = await aretrieve(user, chat, user_input.strip())
+    with timings.stage("history"):
+        messages, memory = await abuild_context_window(chat, system_message, user_input.strip(), notes)
+    with timings.stage("prompt"):
+        chat_history = assemble_chat_history(system_message, memory, messages, user, user_input, notes)
+    return chat_history, messages, profile
+
+
+async def acommit_chat_turn(chat, user, user_input, response):
+    """Async version of commit_chat_turn."""
+    return await sync_to_async(commit_chat_turn)(chat, user, user_input, response)
+
+
+async def afind_cached_reply(llm, chat, profile, chat_history):
+    """Async version of find_cached_reply."""
+    cache_key, response = await aget_cached_response(llm, chat_history, chat)
+    vector = None
+    if response is None:
+        vector, response = await semantic_cache.alookup(profile, chat_history)
+    return response, (cache_key, vector)
+
+
+async def aremember_reply(profile, chat_history, response, cache_state):
+    cache_key, vector = cache_state
+    await astore_response(cache_key, response)
+    await semantic_cache.astore(profile, chat_history, response, vector)
+
+
+async def agenerate_response_from_chat(chat, user, user_input):
+    """Async version of generate_response_from_chat."""
+    with TurnTimings(chat.id) as timings:
+        chat_history, messages, profile = await abuild_chat_history(chat, user, user_input, timings)
+        if chat_history is None:
+            return PROFILE_MISSING_REPLY, ""
+
+        llm_profile = timings.profile = profile_for(user)
+        llm = get_llm(llm_profile)
+        response, cache_state = await afind_cached_reply(llm, chat, profile, chat_history)
+        if response is not None:
+            timings.outcome = "cached"
+        else:
+            chain = llm | output_parser
+            try:
+                async with allm_slot():
+                    with breaker_for(llm_profile).call():
+                        response = (await chain.ainvoke(chat_history, config=timings.llm_config())).strip()
+            except LLMBusy:
+                raise
+            except Exception as e:
+                response = llm_failed(timings, user_input, e)
+            else:
+                await aremember_reply(profile, chat_history, response, cache_state)
+
+        with timings.stage("persist"):
+            await acommit_chat_turn(chat, user, user_input, response)
+    return response, build_chat_log(user, user_input, response, messages)
+
+
+async def astream_response_from_chat(chat, user, user_input):
+    """Async version of stream_response_from_chat; yields the same events."""
+    with TurnTimings(chat.id) as timings:
+        chat_history, messages, profile = await abuild_chat_history(chat, user, user_input, timings)
+        if chat_history is None:
+            timings.finish()
+            yield "error", PROFILE_MISSING_REPLY
+            return
+
+        llm_profile = timings.profile = profile_for(user)
+        llm = get_llm(llm_profile)
+        response, cache_state = await afind_cached_reply(llm, chat, profile, chat_history)
+        if response is not None:
+            timings.outcome = "cached"
+            yield "token", response
+        else:
+            chain = llm | output_parser
+            chunks = []
+            try:
+                async with allm_slot():
+                    with breaker_for(llm_profile).call() as call:
+                        async for token in chain.astream(chat_history, config=timings.llm_config()):
+                            call.first_token()
+                            chunks.append(token)
+                            yield "token", token
+            except LLMBusy:
+                raise
+            except Exception as e:
+                if chunks:
+                    timings.outcome = "error"
+                    timings.llm_failed(e)
+                    timings.finish()
+                    yield "error", f"[AI Error]: {str(e)}"
+                    return
+                response = llm_failed(timings, user_input, e)
+                yield "token", response
+            else:
+                response = "".join(chunks).strip()
+                await aremember_reply(profile, chat_history, response, cache_state)
+
+        with timings.stage("persist"):
+            _, bot_msg = await acommit_chat_turn(chat, user, user_input, response)
+        timings.finish()
+        yield "done", bot_msg
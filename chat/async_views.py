@@ -0,0 +1,219 @@
+"""
+Async counterparts of the chatbot endpoints, for running under ASGI.
+
+DRF views are synchronous and hold a worker thread for the whole LLM call.
+These are plain Django async views: the LLM call is awaited, so one event
+loop can serve many conversations at once. Authentication uses the same
+SimpleJWT access tokens as the rest of the API.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from chat.ai_logic import acommit_chat_turn, agenerate_response_from_chat, astream_response_from_chat
+from chat.limiter import LLMBusy
+from chat.models import Chat
+from chat.turns import TurnInProgress, turn_lock
+from chat.views import ChatRespondSerializer, replayed_events, respond_payload, sse_event, sse_response
+from users.authentication import StatelessJWTAuthentication
+
+jwt_authentication = StatelessJWTAuthentication()
+
+NOT_AUTHENTICATED = {"detail": "Authentication credentials were not provided."}
+
+
+async def aauthenticate(request):
+    """Return the user for the request's JWT access token, or None."""
+    try:
+        result = await sync_to_async(jwt_authentication.authenticate)(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def busy_response(exc):
+    response = JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+    response["Retry-After"] = str(int(exc.wait))
+    return response
+
+
+async def aprime_events(events):
+    """Async version of prime_events: surface LLMBusy before the response starts."""
+    try:
+        first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def chained():
+        if first is not None:
+            yield first
+        async for item in events:
+            yield item
+
+    return chained()
+
+
+def parse_body(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return {}
+    return request.POST
+
+
+async def arespond_context(request):
+    """
+    Authenticate and validate a chat-respond request.
+    Returns (user, chat, message, lock, None) on success, or (None, None, None, None, error_response).
+    `lock` is the chat's TurnLock for this submission, not yet claimed.
+    """
+    user = await aauthenticate(request)
+    if user is None:
+        return None, None, None, None, JsonResponse(NOT_AUTHENTICATED, status=401)
+
+    data = parse_body(request)
+    serializer = ChatRespondSerializer(data=data)
+    if not serializer.is_valid():
+        return None, None, None, None, JsonResponse(serializer.errors, status=400)
+
+    try:
+        chat = await Chat.objects.aget(id=serializer.validated_data['chat_id'], participants=user)
+    except Chat.DoesNotExist:
+        return None, None, None, None, JsonResponse({"error": "Chat not found."}, status=404)
+
+    message = serializer.validated_data['message']
+    return user, chat, message, turn_lock(request, data, chat, "respond", user, message), None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatRespondAsyncView(View):
+    """
+    Async version of ChatRespondAPIView; same request and response shape.
+    As there, a turn that can't be answered (no About profile, a failed
+    generation) saves the error text as the reply and still returns 200.
+    """
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        user, chat, message, lock, error = await arespond_context(request)
+        if error:
+            return error
+
+        try:
+            replayed = await lock.aclaim()
+        except TurnInProgress as exc:
+            return busy_response(exc)
+        if replayed is not None:
+            return JsonResponse(replayed, status=200)
+
+        try:
+            bot_msg = await self.respond(chat, user, message)
+            data = respond_payload(user, message, bot_msg)
+            await lock.afinish(data)
+            return JsonResponse(data, status=200)
+        except LLMBusy as exc:
+            return busy_response(exc)
+        finally:
+            await lock.arelease()
+
+    async def respond(self, chat, user, message):
+        bot_msg = error_text = None
+        try:
+            events = await aprime_events(astream_response_from_chat(chat, user, message))
+            async for event, payload in events:
+                if event == "error":
+                    error_text = payload  # the stream ends here, with nothing saved
+                elif event == "done":
+                    bot_msg = payload
+        except LLMBusy:
+            raise
+        except Exception as e:
+            error_text = f"[Error generating response]: {e}"
+        if bot_msg is None:
+            _, bot_msg = await acommit_chat_turn(chat, user, message, error_text or "")
+        return bot_msg
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatRespondStreamAsyncView(View):
+    """Async version of ChatRespondStreamAPIView; same Server-Sent Events."""
+    http_method_names = ['post']
+
+    async def post(self, request, *args, **kwargs):
+        user, chat, message, lock, error = await arespond_context(request)
+        if error:
+            return error
+
+        try:
+            replayed = await lock.aclaim()
+        except TurnInProgress as exc:
+            return busy_response(exc)
+        if replayed is not None:
+            return sse_response(replayed_events(replayed))
+
+        try:
+            events = await aprime_events(astream_response_from_chat(chat, user, message))
+        except LLMBusy as exc:
+            await lock.arelease()
+            return busy_response(exc)
+        except BaseException:
+            await lock.arelease()
+            raise
+
+        async def event_stream():
+            try:
+                async for event, payload in events:
+                    if event == "token":
+                        yield sse_event("token", {"token": payload})
+                    elif event == "done":
+                        data = respond_payload(user, message, payload)
+                        await lock.afinish(data)
+                        yield sse_event("done", data)
+                    else:
+                        yield sse_event("error", {"error": payload})
+            finally:
+                await lock.arelease()
+
+        return sse_response(event_stream())
+
+
+@csrf_exempt
+@require_POST
+async def chat_with_assistant_async(request, chat_id):
+    """Async version of chat_with_assistant."""
+    user = await aauthenticate(request)
+    if user is None:
+        return JsonResponse(NOT_AUTHENTICATED, status=401)
+
+    body = parse_body(request)
+    user_input = body.get("message")
+    if not user_input:
+        return JsonResponse({"error": "No message provided."}, status=400)
+
+    try:
+        chat = await Chat.objects.aget(id=chat_id, participants=user)
+    except Chat.DoesNotExist:
+        return JsonResponse({"detail": "No Chat matches the given query."}, status=404)
+
+    async def respond():
+        reply, chat_log = await agenerate_response_from_chat(chat, user, user_input)
+        return {
+            "reply": reply,
+            "chat_log": chat_log,
+        }
+
+    lock = turn_lock(request, body, chat, "bot", user, user_input)
+    try:
+        return JsonResponse(await lock.arun(respond), status=200)
+    except (LLMBusy, TurnInProgress) as exc:
+        return busy_response(exc)
+    except Exception as e:
+        return JsonResponse({"error": f"AI logic error: {str(e)}"}, status=500)
@@ -0,0 +1,172 @@
+"""
+Circuit breaker for LLM calls.
+
+When Ollama is down, every chat turn used to wait for a connection timeout
+before failing, which tied up workers for the whole outage. Each LLM profile
+now has a breaker that opens after LLM_BREAKER_FAILURES consecutive failures.
+A call slower than LLM_BREAKER_SLOW_CALL_SECONDS counts as a failure. Only the
+LLM's own time counts: callers take their llm_slot() first and enter the
+breaker inside it, so time spent queueing for a slot doesn't, and streaming
+calls mark their first token, so time the client takes to read the stream
+doesn't either.
+
+While the breaker is open, calls fail at once with CircuitOpen and callers
+answer from chat.fallback instead. After LLM_BREAKER_RESET_SECONDS, up to
+LLM_BREAKER_HALF_OPEN_PROBES calls are let through as probes. A successful
+probe closes the circuit; a failed one opens it again.
+
+Breakers are per process, like the concurrency limiter.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from api.metrics import counter, gauge
+from chat.limiter import LLMBusy
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+llm_circuit_state = gauge("llm_circuit_state", "LLM circuit breaker state (0 closed, 1 half-open, 2 open).")
+llm_circuit_opened_total = counter("llm_circuit_opened_total", "Times an LLM circuit breaker opened.")
+llm_circuit_rejected_total = counter("llm_circuit_rejected_total", "LLM calls failed fast by an open circuit.")
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"LLM circuit '{name}' is open (retry in {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class BreakerCall:
+    """Handed out by CircuitBreaker.call(); streaming callers mark their first token on it."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token_at = None
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def elapsed(self):
+        """Seconds to the first token for streams, else for the whole call."""
+        return (self.first_token_at or time.monotonic()) - self.started
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, slow_call_seconds=60, half_open_probes=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.slow_call_seconds = slow_call_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._lock = threading.Lock()
+        llm_circuit_state.set(STATE_VALUES[CLOSED], profile=name)
+
+    def _set_state(self, state):
+        self.state = state
+        llm_circuit_state.set(STATE_VALUES[state], profile=self.name)
+
+    def _trip(self):
+        self._set_state(OPEN)
+        self.opened_at = time.monotonic()
+        llm_circuit_opened_total.inc(profile=self.name)
+        logger.warning("LLM circuit '%s' opened after %d failed or slow calls", self.name, self.failures)
+
+    def _before_call(self):
+        """Admit a call or raise CircuitOpen. Returns True if the call is a half-open probe."""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    llm_circuit_rejected_total.inc(profile=self.name)
+                    raise CircuitOpen(self.name, remaining)
+                self._set_state(HALF_OPEN)
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    llm_circuit_rejected_total.inc(profile=self.name)
+                    raise CircuitOpen(self.name, self.reset_timeout)
+                self.probes += 1
+                return True
+            return False
+
+    def _after_call(self, probe, failed):
+        with self._lock:
+            if probe:
+                self.probes -= 1
+            if failed is None:
+                return  # abandoned: neither success nor failure
+            if not failed:
+                self.failures = 0
+                if self.state == HALF_OPEN:
+                    self._set_state(CLOSED)
+                    logger.info("LLM circuit '%s' closed", self.name)
+                return
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._trip()
+
+    @contextmanager
+    def call(self):
+        """
+        Guard one LLM call. Raises CircuitOpen instead of running the block
+        while the circuit is open. LLMBusy and cancellations don't count as failures.
+        Yields a BreakerCall; call its first_token() when streaming.
+        """
+        probe = self._before_call()
+        call = BreakerCall()
+        try:
+            yield call
+        except LLMBusy:
+            self._after_call(probe, None)
+            raise
+        except Exception:
+            self._after_call(probe, True)
+            raise
+        except BaseException:
+            self._after_call(probe, None)
+            raise
+        self._after_call(probe, call.elapsed() > self.slow_call_seconds)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(profile):
+    """The shared CircuitBreaker for an LLM profile."""
+    breaker = _breakers.get(profile)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(profile)
+            if breaker is None:
+                breaker = _breakers[profile] = CircuitBreaker(
+                    profile,
+                    failure_threshold=settings.LLM_BREAKER_FAILURES,
+                    reset_timeout=settings.LLM_BREAKER_RESET_SECONDS,
+                    slow_call_seconds=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+                    half_open_probes=settings.LLM_BREAKER_HALF_OPEN_PROBES,
+                )
+    return breaker
+
+
+def _reset_breakers(setting, **kwargs):
+    if setting.startswith("LLM_BREAKER_") or setting in ("LLM_PROFILES", "LLM_DEFAULT_PROFILE"):
+        with _breakers_lock:
+            _breakers.clear()
+
+
+setting_changed.connect(_reset_breakers)
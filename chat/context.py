@@ -0,0 +1,103 @@
+"""
+Token-budgeted context window for chat prompts.
+
+ChatOllama runs with num_ctx=4096, so sending the whole chat history overflows
+the context on long chats. build_context_window() keeps the newest turns that
+fit in CHAT_CONTEXT_TOKEN_BUDGET after the system prompt and the new user
+input, and loads only that tail from the database. When older turns are
+dropped, the chat's topic_summary stands in for them.
+
+Ollama reuses its KV cache for the longest prompt prefix shared with the
+previous request. A window that slides by one message every turn changes the
+prefix right after the system prompt, so the whole history is re-evaluated.
+Once turns are dropped, the window therefore starts at the first message
+after the summary checkpoint (Chat.last_summarized_message_id). The prompt
+prefix then stays byte-identical until the next summary refresh.
+"""
+from django.conf import settings
+
+from chat.models import Chat, Message
+
+DEFAULT_TOPIC_SUMMARY = Chat._meta.get_field("topic_summary").default
+
+# Rough tokens per message for role markers and separators in the chat template.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    """
+    Estimate the token count of `text`.
+    Llama-style tokenizers average about 4 characters per token on English text.
+    This is a cheap estimate that needs no tokenizer download.
+    """
+    if not text:
+        return 0
+    return -(-len(text) // settings.CHAT_CONTEXT_CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summary_memory(chat):
+    """Return the chat summary as a compressed-memory note, or None if there isn't one."""
+    summary = (chat.topic_summary or "").strip()
+    if not settings.CHAT_CONTEXT_INCLUDE_SUMMARY or not summary or summary == DEFAULT_TOPIC_SUMMARY:
+        return None
+    return f"Summary of the earlier conversation:\n{summary}"
+
+
+def _window_budget(chat, system_message, user_input, notes):
+    budget = settings.CHAT_CONTEXT_TOKEN_BUDGET - count_tokens(system_message) - count_tokens(user_input)
+    budget -= count_tokens(notes)
+    memory = summary_memory(chat)
+    if memory:
+        budget -= count_tokens(memory)
+    return budget, memory
+
+
+def _tail_queryset(chat):
+    # Newest first; fetch one extra row to learn whether older turns exist.
+    # Only (id, sender_id, content) is needed, so no Message or User rows are built.
+    return (
+        Message.objects.filter(chat=chat)
+        .order_by("-id")
+        .values_list("id", "sender_id", "content")[:settings.CHAT_CONTEXT_MAX_MESSAGES + 1]
+    )
+
+
+def _select_window(tail, budget, memory, checkpoint):
+    limit = settings.CHAT_CONTEXT_MAX_MESSAGES
+    truncated = len(tail) > limit
+
+    window = []
+    for row in tail[:limit]:
+        cost = count_tokens(row[2])
+        if cost > budget:
+            truncated = True
+            break
+        budget -= cost
+        window.append(row)
+
+    if truncated and memory and checkpoint:
+        # The summary covers everything up to the checkpoint: start right after
+        # it, so the window only grows (at the end) until the next summary.
+        window = [row for row in window if row[0] > checkpoint]
+    window.reverse()
+
+    return [(sender_id, content) for _, sender_id, content in window], memory if truncated else None
+
+
+def build_context_window(chat, system_message, user_input, notes=None):
+    """
+    Pick the chat history that fits the token budget, after the system message,
+    the user input and any retrieved `notes` (see chat/retrieval.py).
+    Returns (messages, memory): `messages` holds (sender_id, content) rows for the
+    newest messages that fit (after the summary checkpoint), oldest first. `memory` is the summary note to insert ahead of them, or None
+    when the window already reaches the start of the chat.
+    """
+    budget, memory = _window_budget(chat, system_message, user_input, notes)
+    return _select_window(list(_tail_queryset(chat)), budget, memory, chat.last_summarized_message_id)
+
+
+async def abuild_context_window(chat, system_message, user_input, notes=None):
+    """Async version of build_context_window using the async ORM."""
+    budget, memory = _window_budget(chat, system_message, user_input, notes)
+    tail = [row async for row in _tail_queryset(chat)]
+    return _select_window(tail, budget, memory, chat.last_summarized_message_id)
@@ -0,0 +1,216 @@
+"""
+A stand-in for the Ollama HTTP API, for benchmarks and tests without a GPU.
+
+FakeOllama serves /api/chat and /api/generate the way Ollama does: streamed
+as NDJSON (the default), or as one JSON object with "stream": false. It also
+serves /api/tags. Every reply is the configured text, split into word tokens.
+The final chunk carries Ollama's timing and token fields, so the
+ollama_* and chat_turn_* metrics behave as they do in production.
+
+The knobs:
+- latency: seconds before the first token (prompt evaluation plus queueing);
+- tokens_per_second: generation rate (0 = send everything at once);
+- failure_rate: fraction of requests answered with failure_status instead.
+
+Like Ollama, the server keeps the previous prompt per model and counts only
+the part after the shared prefix in prompt_eval_count. This mimics its
+KV-cache reuse.
+
+Run it with `manage.py fake_ollama`, or in-process:
+
+    with FakeOllama(latency=0.2, tokens_per_second=40) as server:
+        ...  # point an LLM_PROFILES entry's BASE_URL at server.url
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = (
+    "Start with ten minutes of light jogging, then dynamic stretches: leg swings, "
+    "walking lunges and high knees. Finish with three short accelerations."
+)
+CHARS_PER_TOKEN = 4
+
+
+def count_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def split_tokens(text):
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class FakeOllama:
+    def __init__(self, host="127.0.0.1", port=0, reply=DEFAULT_REPLY, latency=0.0,
+                 tokens_per_second=0.0, failure_rate=0.0, failure_status=500, seed=None):
+        self.reply = reply
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self._last_prompts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        handler = type("FakeOllamaHandler", (_Handler,), {"fake": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread; returns self."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def admit(self):
+        """Count a request; returns False if it should fail."""
+        with self._lock:
+            self.requests += 1
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        return not failed
+
+    def prompt_eval_count(self, model, prompt):
+        """Tokens of `prompt` after the prefix it shares with the model's previous prompt."""
+        with self._lock:
+            shared = len(os.path.commonprefix([self._last_prompts.get(model, ""), prompt]))
+            self._last_prompts[model] = prompt
+        return max(1, count_tokens(prompt[shared:]))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def write_chunk(self, payload):
+        line = json.dumps(payload).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/tags":
+            self.send_json(200, {"models": []})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "invalid JSON"})
+            return
+
+        if self.path == "/api/chat":
+            prompt = "".join(f"{m.get('role')}: {m.get('content')}\n" for m in request.get("messages", []))
+            self.respond(request, prompt, "message")
+        elif self.path == "/api/generate":
+            self.respond(request, request.get("prompt") or "", "response")
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def chunk(self, request, field, text, **extra):
+        payload = {
+            "model": request.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": False,
+            **extra,
+        }
+        payload[field] = {"role": "assistant", "content": text} if field == "message" else text
+        return payload
+
+    def respond(self, request, prompt, field):
+        fake = self.fake
+        started = time.perf_counter()
+        if not fake.admit():
+            self.send_json(fake.failure_status, {"error": "injected failure"})
+            return
+
+        model = request.get("model", "")
+        if field == "response" and not prompt:
+            # A generate request without a prompt just loads the model.
+            self.send_json(200, self.chunk(request, field, "", done=True, done_reason="load"))
+            return
+
+        prompt_tokens = fake.prompt_eval_count(model, prompt)
+        time.sleep(fake.latency)
+        first_token = time.perf_counter()
+        tokens = split_tokens(fake.reply)
+        delay = 1 / fake.tokens_per_second if fake.tokens_per_second > 0 else 0
+
+        streaming = request.get("stream", True)
+        if streaming:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            if streaming:
+                self.write_chunk(self.chunk(request, field, token))
+
+        done = time.perf_counter()
+        final = self.chunk(
+            request, field, "" if streaming else fake.reply,
+            done=True,
+            done_reason="stop",
+            total_duration=int((done - started) * 1e9),
+            load_duration=0,
+            prompt_eval_count=prompt_tokens,
+            prompt_eval_duration=int((first_token - started) * 1e9),
+            eval_count=len(tokens),
+            eval_duration=int((done - first_token) * 1e9),
+        )
+        if streaming:
+            self.write_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_json(200, final)
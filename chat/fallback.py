@@ -0,0 +1,61 @@
+"""
+Canned replies for when the LLM backend is unavailable.
+
+Used while the LLM circuit breaker is open, or after an LLM call fails, so the
+coach gets an immediate, on-topic answer instead of a timeout. A tip is picked
+by keyword from a small table; nothing here touches the network or the DB.
+"""
+import logging
+
+from api.metrics import counter
+from chat.breaker import CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+llm_fallback_replies_total = counter(
+    "llm_fallback_replies_total", "Chat replies served by the fallback responder, by reason."
+)
+
+TIPS = [
+    (("warm", "stretch", "mobility"),
+     "Keep warm-ups to 10-15 minutes: light jogging, then dynamic stretches (leg swings, "
+     "lunges, high knees) and a few short accelerations."),
+    (("injur", "pain", "sprain", "hurt"),
+     "Stop the activity and rest the injured area. Use ice and compression for the first "
+     "48 hours, and have a medical professional check anything that doesn't improve."),
+    (("eat", "food", "diet", "nutrition", "hydrat", "water"),
+     "Have a carbohydrate-rich meal 2-3 hours before training, drink water throughout, and "
+     "get protein plus carbs within an hour afterwards."),
+    (("recover", "rest", "sleep", "tired", "fatigue"),
+     "Plan at least one full rest day a week, keep easy sessions genuinely easy, and make "
+     "sure players get enough sleep."),
+    (("motivat", "confiden", "morale", "mindset"),
+     "Set one small, specific goal per session and praise effort out loud; players respond "
+     "to progress they can see."),
+    (("match", "game day", "week", "schedule", "season"),
+     "Plan the week around the match: harder sessions early, lighter work the day before, "
+     "recovery the day after."),
+    (("drill", "practice", "session", "training", "exercise"),
+     "Structure the session as warm-up, one technical drill, a small-sided game that uses "
+     "that skill, then a short cool-down. Keep explanations short and players moving."),
+]
+
+GENERIC_REPLY = "I can't give you a personalized answer right now."
+LIMITED_MODE_NOTE = "The assistant is running in limited mode; ask again in a minute for a tailored answer."
+
+
+def generate_response(user_input):
+    """Return a canned coaching reply for `user_input`."""
+    text = user_input.lower()
+    for keywords, tip in TIPS:
+        if any(keyword in text for keyword in keywords):
+            return f"{tip}\n\n({LIMITED_MODE_NOTE})"
+    return f"{GENERIC_REPLY} {LIMITED_MODE_NOTE}"
+
+
+def reply_for_failure(user_input, error):
+    """Log why the LLM couldn't answer and return the fallback reply."""
+    reason = "circuit_open" if isinstance(error, CircuitOpen) else "llm_error"
+    llm_fallback_replies_total.inc(reason=reason)
+    logger.warning("LLM call failed (%s): %s; answering from the fallback responder", reason, error)
+    return generate_response(user_input)
@@ -0,0 +1,169 @@
+"""
+Per-turn instrumentation for the chatbot pipeline.
+
+A TurnTimings follows one chat turn and reports it when the turn ends, as one
+log line on this module's logger and as metrics on /metrics:
+
+- chat_turn_stage_seconds{stage, profile}, where stage is one of
+  history (About profile and context window loaded from the DB), retrieval
+  (notes from the coach's plans and other chats), prompt (message list
+  assembly), llm_ttft (LLM request to first token), llm (the whole LLM
+  call) and persist (saving the turn). The background topic
+  summary is reported under stage "summary", on its own, since it runs after
+  the turn has been answered.
+- chat_turn_seconds{outcome} for the whole turn, plus chat_turn_outcomes_total.
+- chat_turn_tokens{kind, profile}: prompt and completion tokens, taken from
+  the model's usage metadata (Ollama's prompt_eval_count and eval_count).
+- llm_errors_total{profile, error} for LLM calls that failed.
+
+LLM timings and token counts are captured by a callback passed with the
+call, so time spent waiting for an LLM slot is not counted as LLM time (see
+llm_queue_wait_seconds for that).
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from api.metrics import counter, histogram
+from chat.limiter import LLMBusy
+from chat.llm import TOKEN_BUCKETS
+from chat.turns import TurnInProgress
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("history", "retrieval", "prompt", "llm_ttft", "llm", "persist")
+
+chat_turn_stage_seconds = histogram("chat_turn_stage_seconds", "Time spent in each stage of a chat turn.")
+chat_turn_seconds = histogram("chat_turn_seconds", "Total time of a chat turn, by outcome.")
+chat_turn_outcomes_total = counter(
+    "chat_turn_outcomes_total", "Chat turns by outcome (ok, cached, fallback, profile_missing, busy, error, cancelled)."
+)
+chat_turn_tokens = histogram("chat_turn_tokens", "Prompt and completion tokens per LLM call.", TOKEN_BUCKETS)
+llm_errors_total = counter("llm_errors_total", "Failed LLM calls, by profile and exception type.")
+
+
+class LLMCallTimer(BaseCallbackHandler):
+    """Times an LLM call and reads its token usage into a TurnTimings."""
+
+    run_inline = True
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.started = None
+        self.first_token = None
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.started = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.started = time.perf_counter()
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def _stop(self):
+        if self.started is None:
+            return
+        now = time.perf_counter()
+        # Backends that don't stream deliver the first token with the last one.
+        self.timings.add("llm_ttft", (self.first_token or now) - self.started)
+        self.timings.add("llm", now - self.started)
+        self.started = None
+
+    def on_llm_end(self, response, **kwargs):
+        self._stop()
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.timings.prompt_tokens = usage.get("input_tokens")
+                    self.timings.completion_tokens = usage.get("output_tokens")
+
+    def on_llm_error(self, error, **kwargs):
+        self._stop()
+
+
+class TurnTimings:
+    """
+    Stage timings, token counts and outcome of one chat turn.
+    Use as a context manager around the turn; it is reported on exit.
+    """
+
+    def __init__(self, chat_id=None):
+        self.chat_id = chat_id
+        self.profile = ""
+        self.outcome = "ok"
+        self.stages = {}
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def llm_config(self):
+        """RunnableConfig for the turn's LLM call: adds the timing callback."""
+        return {"callbacks": [LLMCallTimer(self)]}
+
+    def llm_failed(self, error):
+        llm_errors_total.inc(profile=self.profile, error=type(error).__name__)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            if issubclass(exc_type, (LLMBusy, TurnInProgress)):
+                self.outcome = "busy"
+            elif issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+                self.outcome = "cancelled"
+            else:
+                self.outcome = "error"
+        self.finish()
+        return False
+
+    def finish(self):
+        """Record the turn's metrics and log it (once)."""
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self.started
+
+        chat_turn_seconds.observe(total, outcome=self.outcome)
+        chat_turn_outcomes_total.inc(outcome=self.outcome)
+        for stage, seconds in self.stages.items():
+            chat_turn_stage_seconds.observe(seconds, stage=stage, profile=self.profile)
+        if self.prompt_tokens is not None:
+            chat_turn_tokens.observe(self.prompt_tokens, kind="prompt", profile=self.profile)
+        if self.completion_tokens is not None:
+            chat_turn_tokens.observe(self.completion_tokens, kind="completion", profile=self.profile)
+
+        stages = " ".join(
+            f"{stage}={self.stages[stage]:.3f}s" for stage in STAGES if stage in self.stages
+        )
+        tokens = ""
+        if self.prompt_tokens is not None or self.completion_tokens is not None:
+            tokens = f" tokens={self.prompt_tokens or 0}/{self.completion_tokens or 0}"
+        logger.info(
+            "chat turn chat=%s profile=%s outcome=%s total=%.3fs %s%s",
+            self.chat_id, self.profile or "-", self.outcome, total, stages, tokens,
+        )
+
+
+def record_summary(chat_id, profile, seconds):
+    """Report the duration of a background topic-summary LLM call."""
+    chat_turn_stage_seconds.observe(seconds, stage="summary", profile=profile)
+    logger.info("chat summary chat=%s profile=%s summary=%.3fs", chat_id, profile, seconds)
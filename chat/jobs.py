@@ -0,0 +1,327 @@
+"""
+Batched background AI jobs.
+
+Some LLM work doesn't belong to a chat turn:
+- refreshing topic summaries of chats whose summary never came due;
+- rebuilding all summaries after the summary prompt changes;
+- titling plans from their chat;
+- embedding plans and chat summaries for context retrieval.
+
+run_job() works through such a job in batches of AI_JOBS_BATCH_SIZE items.
+
+- Only items whose content changed since they were last processed are
+  selected. For summaries, that means messages after
+  Chat.last_summarized_message_id; for titles, chat plans without a title.
+  When a job's prompt changes, its next run reprocesses every item
+  (rebuilds summaries from the first message, retitles generated titles).
+- Each batch runs on AI_JOBS_CONCURRENCY threads. LLM calls are spaced to at
+  most AI_JOBS_RATE per second, on top of the LLM limiter and circuit
+  breaker that chat turns use.
+- Progress is checkpointed after every batch in AI_JOBS_STATE_DIR/<job>.json.
+  An interrupted run, or one cut short with `limit`, resumes after the last
+  finished batch. If the LLM circuit opens, the run stops at the checkpoint.
+
+Run them with `manage.py ai_jobs`.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from django.db.models import F, Max, Q
+from langchain_core.prompts import ChatPromptTemplate
+
+from api.metrics import counter
+from chat.breaker import CircuitOpen, breaker_for
+from chat.limiter import llm_slot
+from chat.llm import get_llm
+from chat.models import Chat, ContextSnippet, Message
+from chat.retrieval import embedder_version, index_user, schedule_index
+from chat.services import BOT_USERNAME
+from chat.summarizer import DEFAULT_TOPIC_SUMMARY, ROLLING_SUMMARY_PROMPT, SUMMARY_PROMPT, fold_summary
+from plans.models import Plan
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+TITLE_PROMPT = ChatPromptTemplate.from_template(
+    "Write a short title (at most six words) for a sports coaching plan, based on this conversation. "
+    "Reply with the title only:\n\n{chat}"
+)
+TITLE_MAX_LENGTH = Plan._meta.get_field("title").max_length
+TITLE_CONTEXT_MESSAGES = 10
+
+ai_job_items_total = counter("ai_job_items_total", "Items processed by background AI jobs, by job and outcome.")
+
+
+def prompt_version(*prompts):
+    """A short hash of the prompt templates; a new value means the job's output is stale."""
+    text = "\n".join(prompt.pretty_repr() for prompt in prompts)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class RateLimit:
+    """Spaces out calls, across threads, to at most `rate` per second (0 = unlimited)."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(at - now)
+
+
+class SummaryJob:
+    name = "summaries"
+    version = prompt_version(SUMMARY_PROMPT, ROLLING_SUMMARY_PROMPT)
+
+    def select(self, rebuild):
+        """Ids of the chats to process, in id order."""
+        chats = Chat.objects.annotate(latest_message_id=Max("messages__id")).filter(latest_message_id__isnull=False)
+        if not rebuild:
+            chats = chats.filter(
+                Q(last_summarized_message_id__isnull=True)
+                | Q(latest_message_id__gt=F("last_summarized_message_id"))
+            )
+        return chats.order_by("id").values_list("id", flat=True)
+
+    def process(self, chat_id, rebuild, rate, llm_profile):
+        # Long chats take several rolling folds to catch up.
+        while True:
+            rate.wait()
+            folded = fold_summary(chat_id, rebuild=rebuild, llm_profile=llm_profile)
+            rebuild = False
+            if folded < settings.CHAT_SUMMARY_MAX_NEW_MESSAGES:
+                return
+
+
+def clean_title(text):
+    """First line of the model's answer, without quotes, markup or a 'Title:' prefix."""
+    line = next((line for line in text.strip().splitlines() if line.strip()), "")
+    line = re.sub(r"^\W*title\s*:\s*", "", line.strip(), flags=re.IGNORECASE)
+    line = " ".join(line.strip(" \"'`*#.“”").split())
+    return line[:TITLE_MAX_LENGTH].rstrip()
+
+
+class TitleJob:
+    name = "titles"
+    version = prompt_version(TITLE_PROMPT)
+
+    def select(self, rebuild):
+        """Ids of the chat plans to title: untitled ones, plus generated titles on a rebuild."""
+        untitled = Q(title="")
+        if rebuild:
+            untitled |= Q(auto_title_message_id__isnull=False)
+        plans = (
+            Plan.objects.filter(untitled, chat__isnull=False)
+            .annotate(latest_message_id=Max("chat__messages__id"))
+            .filter(latest_message_id__isnull=False)
+        )
+        return plans.order_by("id").values_list("id", flat=True)
+
+    def process(self, plan_id, rebuild, rate, llm_profile):
+        from chat.ai_logic import output_parser
+
+        plan = Plan.objects.select_related("chat").only(
+            "title", "chat__topic_summary"
+        ).get(id=plan_id)
+        rows = list(
+            Message.objects.filter(chat_id=plan.chat_id)
+            .order_by("id")
+            .values_list("id", "sender__username", "content")[:TITLE_CONTEXT_MESSAGES]
+        )
+        if not rows:
+            return
+        conversation = "\n".join(
+            f"{'Assistant' if username == 'chatbot' else 'User'}: {content}"
+            for _, username, content in rows
+        )
+        summary = plan.chat.topic_summary
+        if summary and summary != DEFAULT_TOPIC_SUMMARY:
+            conversation = f"Summary: {summary}\n\n{conversation}"
+
+        rate.wait()
+        chain = TITLE_PROMPT | get_llm(llm_profile) | output_parser
+        with llm_slot(), breaker_for(llm_profile).call():
+            title = clean_title(chain.invoke({"chat": conversation}))
+        if not title:
+            raise ValueError("the model returned an empty title")
+
+        latest = Message.objects.filter(chat_id=plan.chat_id).order_by("-id").values_list("id", flat=True).first()
+        # Don't overwrite a title the user set in the meantime.
+        Plan.objects.filter(id=plan_id, title=plan.title).update(title=title, auto_title_message_id=latest)
+        schedule_index("plan", plan_id)
+
+
+class ContextIndexJob:
+    """Backfills the retrieval index (see chat/retrieval.py), one user at a time."""
+
+    name = "context"
+
+    @property
+    def version(self):
+        return embedder_version()
+
+    def select(self, rebuild):
+        """Ids of the users with plans or chats: all of them on a rebuild, else those not indexed yet."""
+        users = User.objects.filter(Q(plans__isnull=False) | Q(chats__isnull=False)).exclude(username=BOT_USERNAME)
+        if not rebuild:
+            users = users.exclude(id__in=ContextSnippet.objects.values("user_id"))
+        return users.distinct().order_by("id").values_list("id", flat=True)
+
+    def process(self, user_id, rebuild, rate, llm_profile):
+        rate.wait()
+        index_user(user_id)
+
+
+JOBS = {job.name: job for job in (SummaryJob(), TitleJob(), ContextIndexJob())}
+
+
+def state_path(name):
+    return os.path.join(settings.AI_JOBS_STATE_DIR, f"{name}.json")
+
+
+def load_state(name):
+    try:
+        with open(state_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(name, state):
+    path = state_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _process(job, item_id, rebuild, rate, llm_profile):
+    # Pool threads hold their own DB connections; keep them from going stale.
+    close_old_connections()
+    try:
+        job.process(item_id, rebuild, rate, llm_profile)
+        return None
+    except (Chat.DoesNotExist, Plan.DoesNotExist):
+        return None  # deleted since it was selected
+    except Exception as e:
+        return e
+    finally:
+        close_old_connections()
+
+
+def pending(name, full=False):
+    """How many items the next run of `name` would process (ignoring retries)."""
+    job = JOBS[name]
+    state = load_state(name)
+    run = None if full else state.get("run")
+    if run is None:
+        rebuild = full or state.get("version", job.version) != job.version
+        return job.select(rebuild).count()
+    return job.select(run["rebuild"]).filter(id__gt=run["cursor"]).count()
+
+
+def run_job(name, concurrency=None, rate=None, batch_size=None, limit=None,
+            full=False, restart=False, llm_profile=None):
+    """
+    Run, or resume, the job `name`. `full` reprocesses every item; `restart`
+    drops an unfinished run's checkpoint. Returns a summary dict.
+    """
+    job = JOBS[name]
+    concurrency = concurrency or settings.AI_JOBS_CONCURRENCY
+    batch_size = batch_size or settings.AI_JOBS_BATCH_SIZE
+    rate = RateLimit(settings.AI_JOBS_RATE if rate is None else rate)
+    llm_profile = (
+        llm_profile or settings.AI_JOBS_LLM_PROFILE
+        or settings.CHAT_SUMMARY_LLM_PROFILE or settings.LLM_DEFAULT_PROFILE
+    )
+
+    state = load_state(name)
+    run = None if restart or full else state.get("run")
+    resumed = run is not None
+    if run is None:
+        # A job that has never run treats existing output as current.
+        rebuild = full or state.get("version", job.version) != job.version
+        run = {
+            "version": job.version,
+            "rebuild": rebuild,
+            "cursor": 0,
+            "retry": [] if rebuild else state.get("retry", []),  # failed items of an earlier rebuild
+            "failed": [],
+            "processed": 0,
+        }
+
+    def batches():
+        retry = run["retry"]
+        while retry:
+            yield retry[:batch_size], False
+            retry = retry[batch_size:]
+        selected = job.select(run["rebuild"])
+        while True:
+            batch = list(selected.filter(id__gt=run["cursor"])[:batch_size])
+            if not batch:
+                return
+            yield batch, True
+
+    processed = failed = 0
+    stopped = None
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"ai-job-{name}") as pool:
+        for batch, advances in batches():
+            if limit is not None:
+                batch = batch[:max(0, limit - processed - failed)]
+                if not batch:
+                    stopped = "limit"
+                    break
+            rebuild = run["rebuild"] or not advances
+            errors = list(pool.map(lambda item: _process(job, item, rebuild, rate, llm_profile), batch))
+            if any(isinstance(error, CircuitOpen) for error in errors):
+                # Redo the whole batch once the LLM is back.
+                stopped = "circuit_open"
+                break
+
+            for item_id, error in zip(batch, errors):
+                if error is None:
+                    processed += 1
+                    run["processed"] += 1
+                    ai_job_items_total.inc(job=name, outcome="ok")
+                else:
+                    failed += 1
+                    run["failed"].append(item_id)
+                    ai_job_items_total.inc(job=name, outcome="failed")
+                    # _process hands back the exception, so pass it for the traceback.
+                    logger.error("AI job %s: item %s failed", name, item_id, exc_info=error)
+            if advances:
+                run["cursor"] = batch[-1]
+            else:
+                run["retry"] = run["retry"][len(batch):]
+            save_state(name, {**state, "run": run})
+
+    if stopped is None:
+        # Rebuild failures are retried next time; other failures are still
+        # "changed" and get selected again anyway.
+        retry = run["failed"] if run["rebuild"] else []
+        save_state(name, {"version": run["version"], "retry": retry, "run": None})
+
+    return {
+        "processed": processed,
+        "failed": failed,
+        "rebuild": run["rebuild"],
+        "resumed": resumed,
+        "stopped": stopped,
+    }
@@ -0,0 +1,248 @@
+"""
+Bounded concurrency for LLM calls.
+
+There is a single Ollama behind every chat turn. Without a cap, a burst of
+requests piles up inside Ollama until they all time out together. At most
+LLM_MAX_IN_FLIGHT calls run at once per process. Up to LLM_MAX_QUEUE more
+wait in FIFO order for up to LLM_QUEUE_TIMEOUT seconds. Anything beyond that
+is rejected straight away with LLMBusy, which the API returns as a 503 with a
+Retry-After header.
+
+Set LLM_LIMIT_LOCK_DIR to also share the in-flight cap between worker
+processes on one host, using one flock()ed slot file per allowed call.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.metrics import counter, gauge, histogram
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock()
+    fcntl = None
+
+llm_in_flight = gauge("llm_in_flight", "LLM calls currently running in this process.")
+llm_queue_depth = gauge("llm_queue_depth", "Requests waiting for an LLM slot.")
+llm_queue_wait_seconds = histogram("llm_queue_wait_seconds", "Time spent waiting for an LLM slot.")
+llm_rejected_total = counter("llm_rejected_total", "LLM calls rejected because the queue was full or the wait timed out.")
+
+
+class LLMBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The assistant is busy right now. Please retry shortly."
+    default_code = "llm_busy"
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        # DRF's exception handler turns `wait` into a Retry-After header.
+        self.wait = wait if wait is not None else settings.LLM_RETRY_AFTER_SECONDS
+
+
+class _Waiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, loop=None, future=None):
+        self.granted = False
+        self.event = None if future else threading.Event()
+        self.loop = loop
+        self.future = future
+
+    def grant(self):
+        self.granted = True
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    FIFO slot limiter usable from both threads (slot) and coroutines (aslot).
+    A released slot is handed directly to the oldest waiter.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()
+
+    def _acquire_or_enqueue(self, waiter):
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                llm_in_flight.set(self._in_flight)
+                return True
+            if len(self._waiters) >= self.max_queue:
+                llm_rejected_total.inc(reason="queue_full")
+                raise LLMBusy()
+            self._waiters.append(waiter)
+            llm_queue_depth.set(len(self._waiters))
+            return False
+
+    def _abandon(self, waiter):
+        """Leave the queue after a timeout. Returns True if a slot was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            llm_queue_depth.set(len(self._waiters))
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().grant()
+                llm_queue_depth.set(len(self._waiters))
+                return
+            self._in_flight -= 1
+            llm_in_flight.set(self._in_flight)
+
+    def acquire(self):
+        waiter = _Waiter()
+        started = time.monotonic()
+        if not self._acquire_or_enqueue(waiter):
+            waiter.event.wait(self.queue_timeout)
+            if not self._abandon(waiter):
+                llm_rejected_total.inc(reason="timeout")
+                raise LLMBusy()
+        llm_queue_wait_seconds.observe(time.monotonic() - started)
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        started = time.monotonic()
+        if not self._acquire_or_enqueue(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    llm_rejected_total.inc(reason="timeout")
+                    raise LLMBusy()
+            except asyncio.CancelledError:
+                # Client went away; give the slot back if it already arrived.
+                if self._abandon(waiter):
+                    self.release()
+                raise
+        llm_queue_wait_seconds.observe(time.monotonic() - started)
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            with _host_slot(self.queue_timeout):
+                yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            async with _ahost_slot(self.queue_timeout):
+                yield
+        finally:
+            self.release()
+
+
+def _try_host_slot():
+    """Lock the first free slot file in LLM_LIMIT_LOCK_DIR; returns its fd or None."""
+    lock_dir = settings.LLM_LIMIT_LOCK_DIR
+    os.makedirs(lock_dir, exist_ok=True)
+    for index in range(settings.LLM_MAX_IN_FLIGHT):
+        fd = os.open(os.path.join(lock_dir, f"llm-slot-{index}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+    return None
+
+
+def _release_host_slot(fd):
+    if fd is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _host_slots_enabled():
+    return bool(settings.LLM_LIMIT_LOCK_DIR) and fcntl is not None
+
+
+@contextmanager
+def _host_slot(timeout):
+    if not _host_slots_enabled():
+        yield
+        return
+    deadline = time.monotonic() + timeout
+    fd = _try_host_slot()
+    while fd is None:
+        if time.monotonic() >= deadline:
+            llm_rejected_total.inc(reason="host_timeout")
+            raise LLMBusy()
+        time.sleep(0.05)
+        fd = _try_host_slot()
+    try:
+        yield
+    finally:
+        _release_host_slot(fd)
+
+
+@asynccontextmanager
+async def _ahost_slot(timeout):
+    if not _host_slots_enabled():
+        yield
+        return
+    deadline = time.monotonic() + timeout
+    fd = _try_host_slot()
+    while fd is None:
+        if time.monotonic() >= deadline:
+            llm_rejected_total.inc(reason="host_timeout")
+            raise LLMBusy()
+        await asyncio.sleep(0.05)
+        fd = _try_host_slot()
+    try:
+        yield
+    finally:
+        _release_host_slot(fd)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = ConcurrencyLimiter(
+                max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+                max_queue=settings.LLM_MAX_QUEUE,
+                queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+            )
+        return _limiter
+
+
+def llm_slot():
+    """Context manager holding one LLM slot for the duration of a call."""
+    return get_limiter().slot()
+
+
+def allm_slot():
+    """Async context manager holding one LLM slot for the duration of a call."""
+    return get_limiter().aslot()
@@ -0,0 +1,248 @@
+"""
+Settings-driven LLM backends.
+
+LLM_PROFILES maps a profile name to a backend class, a model and HTTP options,
+in the same shape as CACHES. Each profile's chat model is built on first use
+and then reused by the whole process. Its HTTP client therefore keeps a small
+pool of keep-alive connections to the model server, instead of opening a new
+connection for every turn.
+
+Chat turns use the user's User.llm_profile, falling back to
+LLM_DEFAULT_PROFILE. A heavy user can be moved to a faster model from the
+admin without a deploy.
+
+Ollama keeps the model loaded for `keep_alive` after each request (see
+OLLAMA_OPTIONS). warm_up() loads a model ahead of the first turn: run it
+with `manage.py llm_warmup`, or at server start and periodically via
+LLM_WARMUP_ON_START and LLM_WARMUP_INTERVAL. Every Ollama call records load,
+prompt-eval and eval time. A low ollama_prompt_eval_tokens count on follow-up
+turns shows the prompt prefix is being served from Ollama's KV cache.
+"""
+import logging
+import threading
+import time
+
+import httpx
+import ollama
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_ollama import ChatOllama
+from langchain_openai import ChatOpenAI
+
+from api.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BUCKETS = (8, 32, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+ollama_load_seconds = histogram("ollama_load_seconds", "Time Ollama spent loading the model for a call.")
+ollama_prompt_eval_seconds = histogram("ollama_prompt_eval_seconds", "Time Ollama spent evaluating the prompt.")
+ollama_prompt_eval_tokens = histogram(
+    "ollama_prompt_eval_tokens", "Prompt tokens Ollama evaluated (KV-cache hits are not counted).", TOKEN_BUCKETS
+)
+ollama_eval_seconds = histogram("ollama_eval_seconds", "Time Ollama spent generating the reply.")
+
+_models = {}
+_backends = {}
+_lock = threading.Lock()
+
+
+class OllamaTimings(BaseCallbackHandler):
+    """Record the timings Ollama returns with each completed call."""
+
+    run_inline = True
+
+    def __init__(self, profile):
+        self.profile = profile
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if "prompt_eval_duration" in info or "eval_duration" in info:
+                    record_ollama_timings(self.profile, info)
+
+
+def record_ollama_timings(profile, info):
+    """Record one Ollama response's durations (reported in nanoseconds) and token counts."""
+    load = info.get("load_duration", 0) / 1e9
+    prompt_eval = info.get("prompt_eval_duration", 0) / 1e9
+    prompt_tokens = info.get("prompt_eval_count", 0)
+    generate = info.get("eval_duration", 0) / 1e9
+    ollama_load_seconds.observe(load, profile=profile)
+    ollama_prompt_eval_seconds.observe(prompt_eval, profile=profile)
+    ollama_prompt_eval_tokens.observe(prompt_tokens, profile=profile)
+    ollama_eval_seconds.observe(generate, profile=profile)
+    logger.info(
+        "Ollama %s: load %.2fs, prompt eval %d tokens in %.2fs, eval %d tokens in %.2fs",
+        profile, load, prompt_tokens, prompt_eval, info.get("eval_count", 0), generate,
+    )
+
+
+class BaseBackend:
+    """
+    Builds the LangChain chat model for one LLM_PROFILES entry.
+    Recognised keys: BACKEND, MODEL, BASE_URL, TIMEOUT, CONNECT_TIMEOUT,
+    MAX_CONNECTIONS and OPTIONS (keyword arguments for the chat model).
+    """
+
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.model = params.get("MODEL")
+        self.base_url = params.get("BASE_URL")
+        self.timeout = params.get("TIMEOUT", 120)
+        self.connect_timeout = params.get("CONNECT_TIMEOUT", 5)
+        self.max_connections = params.get("MAX_CONNECTIONS", settings.LLM_MAX_IN_FLIGHT)
+        self.options = params.get("OPTIONS", {})
+
+    def http_options(self):
+        """httpx.Client arguments: per-profile timeouts and a bounded keep-alive pool."""
+        return {
+            "timeout": httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        }
+
+    def build(self):
+        raise NotImplementedError
+
+    def warmup(self):
+        """Load the model ahead of the first request. Returns False if there is nothing to load."""
+        return False
+
+
+class OllamaBackend(BaseBackend):
+    _warmup_client = None
+
+    def build(self):
+        return ChatOllama(
+            model=self.model,
+            base_url=self.base_url,
+            client_kwargs=self.http_options(),
+            callbacks=[OllamaTimings(self.name)],
+            **self.options,
+        )
+
+    def warmup(self):
+        # A generate request without a prompt only loads the model (and resets keep_alive).
+        # Backends live as long as their profile, so periodic warm-ups share one client.
+        if self._warmup_client is None:
+            self._warmup_client = ollama.Client(host=self.base_url, **self.http_options())
+        self._warmup_client.generate(model=self.model, keep_alive=self.options.get("keep_alive"))
+        return True
+
+
+class OpenAIBackend(BaseBackend):
+    """Any OpenAI-compatible chat completions endpoint (OpenAI, vLLM, LM Studio...)."""
+
+    def build(self):
+        return ChatOpenAI(
+            model=self.model,
+            base_url=self.base_url,
+            api_key=self.params.get("API_KEY"),
+            timeout=self.timeout,
+            http_client=httpx.Client(**self.http_options()),
+            http_async_client=httpx.AsyncClient(**self.http_options()),
+            **self.options,
+        )
+
+
+class FakeBackend(BaseBackend):
+    """In-process model for tests and offline runs; replies with RESPONSES in turn."""
+
+    def build(self):
+        return FakeListChatModel(responses=self.params.get("RESPONSES", ["OK"]), **self.options)
+
+
+def get_backend(profile=None):
+    """Return the backend for an LLM_PROFILES entry (default profile if None)."""
+    name = profile or settings.LLM_DEFAULT_PROFILE
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                params = settings.LLM_PROFILES[name]
+                backend = _backends[name] = import_string(params["BACKEND"])(name, params)
+    return backend
+
+
+def get_llm(profile=None):
+    """Return the shared chat model for an LLM_PROFILES entry (default profile if None)."""
+    name = profile or settings.LLM_DEFAULT_PROFILE
+    model = _models.get(name)
+    if model is None:
+        backend = get_backend(name)
+        with _lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = backend.build()
+    return model
+
+
+def profile_for(user):
+    """The LLM profile a user's chat turns run on."""
+    name = getattr(user, "llm_profile", None) or settings.LLM_DEFAULT_PROFILE
+    if name not in settings.LLM_PROFILES:
+        logger.warning("Unknown LLM profile %r for user %s; using the default.", name, user.id)
+        name = settings.LLM_DEFAULT_PROFILE
+    return name
+
+
+def llm_for(user):
+    return get_llm(profile_for(user))
+
+
+def warm_up(profiles=None):
+    """
+    Load the models of `profiles` (default: LLM_WARMUP_PROFILES) into memory.
+    Returns {profile: error or None}; profiles with nothing to load are skipped.
+    """
+    results = {}
+    for name in profiles or settings.LLM_WARMUP_PROFILES:
+        try:
+            if get_backend(name).warmup():
+                results[name] = None
+        except Exception as e:
+            logger.exception("Warming up LLM profile %r failed", name)
+            results[name] = e
+    return results
+
+
+_warmup_thread = None
+
+
+def start_warmup():
+    """
+    Warm up the models in a background thread, per LLM_WARMUP_ON_START and
+    LLM_WARMUP_INTERVAL (seconds, 0 = once). Called from the WSGI/ASGI entry points.
+    """
+    global _warmup_thread
+    if not settings.LLM_WARMUP_ON_START or _warmup_thread is not None:
+        return
+    interval = settings.LLM_WARMUP_INTERVAL
+
+    def run():
+        warm_up()
+        while interval > 0:
+            time.sleep(interval)
+            warm_up()
+
+    _warmup_thread = threading.Thread(target=run, name="llm-warmup", daemon=True)
+    _warmup_thread.start()
+
+
+def _reset_models(setting, **kwargs):
+    if setting in ("LLM_PROFILES", "LLM_DEFAULT_PROFILE"):
+        with _lock:
+            _models.clear()
+            _backends.clear()
+
+
+setting_changed.connect(_reset_models)
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.jobs import JOBS, pending, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Run batched background AI jobs: refresh chat summaries that changed "
+        "(rebuilding all of them after a prompt change) and title untitled chat plans. "
+        "Runs are checkpointed and resume where an interrupted run stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("jobs", nargs="*", help=f"Jobs to run: {', '.join(sorted(JOBS))} (default: all).")
+        parser.add_argument("--concurrency", type=int, help="Parallel LLM calls (default: AI_JOBS_CONCURRENCY).")
+        parser.add_argument("--rate", type=float, help="Max LLM calls per second (default: AI_JOBS_RATE).")
+        parser.add_argument("--batch-size", type=int, help="Items per checkpoint (default: AI_JOBS_BATCH_SIZE).")
+        parser.add_argument("--limit", type=int, help="Stop after this many items; the next run resumes.")
+        parser.add_argument("--profile", help="LLM_PROFILES entry to use (default: AI_JOBS_LLM_PROFILE).")
+        parser.add_argument("--full", action="store_true", help="Reprocess every item, not just changed ones.")
+        parser.add_argument("--restart", action="store_true", help="Discard an unfinished run's checkpoint.")
+        parser.add_argument("--dry-run", action="store_true", help="Only show how many items would be processed.")
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options["jobs"] if name not in JOBS]
+        if unknown:
+            raise CommandError(f"Unknown job(s): {', '.join(unknown)}")
+        if options["profile"] and options["profile"] not in settings.LLM_PROFILES:
+            raise CommandError(f"Unknown LLM profile: {options['profile']}")
+
+        for name in options["jobs"] or sorted(JOBS):
+            if options["dry_run"]:
+                self.stdout.write(f"{name}: {pending(name, full=options['full'])} to process")
+                continue
+
+            result = run_job(
+                name,
+                concurrency=options["concurrency"],
+                rate=options["rate"],
+                batch_size=options["batch_size"],
+                limit=options["limit"],
+                full=options["full"],
+                restart=options["restart"],
+                llm_profile=options["profile"],
+            )
+            mode = "rebuild" if result["rebuild"] else "changed only"
+            if result["resumed"]:
+                mode += ", resumed"
+            line = f"{name} ({mode}): {result['processed']} processed, {result['failed']} failed"
+            if result["stopped"] == "circuit_open":
+                self.stdout.write(self.style.ERROR(f"{line}; stopped, the LLM circuit is open"))
+            elif result["stopped"] == "limit":
+                self.stdout.write(self.style.WARNING(f"{line}; limit reached, the next run resumes"))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
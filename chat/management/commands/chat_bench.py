@@ -0,0 +1,191 @@
+import queue
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from about.models import About
+from chat.fake_ollama import FakeOllama
+from chat.management.commands.chat_loadtest import percentile
+from chat.models import Chat
+from plans.models import Plan
+
+User = get_user_model()
+
+ENDPOINTS = {
+    "respond": "/api/chat-respond/",
+    "bot": "/api/bot/<chat_id>/",
+    "plan": "/api/plans/<plan_id>/messages/",
+}
+
+
+def post_turn(client, endpoint, chat, plan, message):
+    """Send one chat turn to `endpoint`; returns (response, expected status)."""
+    if endpoint == "respond":
+        return client.post(ENDPOINTS[endpoint], {"chat_id": chat.id, "message": message}, format="json"), 200
+    if endpoint == "bot":
+        return client.post(f"/api/bot/{chat.id}/", {"message": message}, format="json"), 200
+    return client.post(
+        f"/api/plans/{plan.id}/messages/", {"chat": chat.id, "content": message}, format="json"
+    ), 201
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the chat hot path end to end, in-process, against a fake Ollama "
+        "server. Drives the chat-respond, bot and plan-message endpoints at a target "
+        "concurrency and reports latency percentiles, throughput and DB queries per turn. "
+        "Uses (and then deletes) a throwaway user in the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoint", action="append", dest="endpoints", choices=sorted(ENDPOINTS),
+            help="Endpoint to drive (repeatable; default: all).",
+        )
+        parser.add_argument("--requests", type=int, default=50, help="Turns per endpoint.")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--message", default="Give me a 30 minute warmup.")
+        parser.add_argument("--ollama-url", help="Use this Ollama (or fake_ollama) server instead of starting one.")
+        parser.add_argument("--model", default=settings.AI_MODEL_NAME)
+        parser.add_argument("--latency", type=float, default=0.05, help="Fake server: seconds before the first token.")
+        parser.add_argument("--tokens-per-second", type=float, default=200, help="Fake server: generation rate.")
+        parser.add_argument("--failure-rate", type=float, default=0, help="Fake server: fraction of failed calls.")
+        parser.add_argument("--max-p95", type=float, help="Fail if an endpoint's p95 latency exceeds this (seconds).")
+        parser.add_argument("--max-queries", type=int, help="Fail if a turn runs more DB queries than this.")
+
+    def handle(self, *args, **options):
+        endpoints = options["endpoints"] or list(ENDPOINTS)
+        server = None
+        url = options["ollama_url"]
+        if not url:
+            server = FakeOllama(
+                latency=options["latency"],
+                tokens_per_second=options["tokens_per_second"],
+                failure_rate=options["failure_rate"],
+            ).start()
+            url = server.url
+
+        profiles = {
+            "bench": {
+                "BACKEND": "chat.llm.OllamaBackend",
+                "MODEL": options["model"],
+                "BASE_URL": url,
+                "MAX_CONNECTIONS": options["concurrency"],
+                "OPTIONS": settings.OLLAMA_OPTIONS,
+            },
+        }
+        # Replies must come from the model, not the reply caches.
+        bench_settings = override_settings(
+            LLM_PROFILES=profiles,
+            LLM_DEFAULT_PROFILE="bench",
+            CHAT_RESPONSE_CACHE_ENABLED=False,
+            CHAT_SEMANTIC_CACHE_ENABLED=False,
+        )
+        user, chats = self.create_fixtures(options["concurrency"])
+        failures = []
+        try:
+            with bench_settings:
+                for endpoint in endpoints:
+                    stats = self.run_endpoint(endpoint, user, chats, options)
+                    failures += self.report(endpoint, stats, options)
+        finally:
+            self.delete_fixtures(user, chats)
+            if server is not None:
+                server.stop()
+                self.stdout.write(f"Fake Ollama served {server.requests} requests ({server.failures} failed)")
+
+        if failures:
+            raise CommandError("; ".join(failures))
+
+    def create_fixtures(self, count):
+        """A throwaway coach with one chat (and plan) per concurrent worker."""
+        name = f"chat-bench-{uuid.uuid4().hex[:8]}"
+        user = User.objects.create_user(email=f"{name}@example.invalid", username=name, password=None)
+        About.objects.create(user=user, sport_coach="Football", details="I coach an U12 team.")
+        chats = []
+        for i in range(count):
+            chat = Chat.objects.create()
+            chat.participants.add(user)
+            plan = Plan.objects.create(user=user, chat=chat, title=f"Bench plan {i + 1}")
+            chats.append((chat, plan))
+        return user, chats
+
+    def delete_fixtures(self, user, chats):
+        Chat.objects.filter(id__in=[chat.id for chat, _ in chats]).delete()
+        user.delete()
+
+    def run_endpoint(self, endpoint, user, chats, options):
+        # Each worker owns one chat, so turns never wait on another turn's lock.
+        jobs = queue.Queue()
+        for i in range(options["requests"]):
+            jobs.put(i)
+        latencies, queries, errors = [], [], []
+        lock = threading.Lock()
+
+        def worker(chat, plan):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                while True:
+                    try:
+                        i = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    # A distinct message per turn, so resubmission coalescing doesn't kick in.
+                    message = f"{options['message']} (#{i + 1})"
+                    started = time.perf_counter()
+                    with CaptureQueriesContext(connection) as captured:
+                        response, expected = post_turn(client, endpoint, chat, plan, message)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        if response.status_code == expected:
+                            latencies.append(elapsed)
+                            queries.append(len(captured))
+                        else:
+                            errors.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=pair) for pair in chats]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {"latencies": latencies, "queries": queries, "errors": errors, "elapsed": elapsed}
+
+    def report(self, endpoint, stats, options):
+        """Print the endpoint's results; returns the thresholds it broke."""
+        latencies, queries = stats["latencies"], stats["queries"]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{endpoint} ({ENDPOINTS[endpoint]})"))
+        self.stdout.write(f"  ok: {len(latencies)}  errors: {len(stats['errors'])}  wall: {stats['elapsed']:.2f}s")
+        if stats["errors"]:
+            self.stdout.write(f"  error statuses: {sorted(set(stats['errors']))}")
+        if not latencies:
+            return [f"{endpoint}: no successful turns"]
+
+        p95 = percentile(latencies, 95)
+        self.stdout.write(
+            f"  throughput: {len(latencies) / stats['elapsed']:.2f} turns/s  "
+            f"p50: {percentile(latencies, 50):.3f}s  "
+            f"p95: {p95:.3f}s  "
+            f"p99: {percentile(latencies, 99):.3f}s  "
+            f"max: {max(latencies):.3f}s"
+        )
+        self.stdout.write(f"  DB queries per turn: mean {statistics.mean(queries):.1f}  max {max(queries)}")
+
+        failures = []
+        if options["max_p95"] is not None and p95 > options["max_p95"]:
+            failures.append(f"{endpoint}: p95 {p95:.3f}s > {options['max_p95']}s")
+        if options["max_queries"] is not None and max(queries) > options["max_queries"]:
+            failures.append(f"{endpoint}: {max(queries)} queries per turn > {options['max_queries']}")
+        return failures
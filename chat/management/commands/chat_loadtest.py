@@ -0,0 +1,123 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from users.views import CustomTokenObtainPairSerializer
+
+User = get_user_model()
+
+ENDPOINTS = {
+    "sync": "/api/chat-respond/",
+    "async": "/api/chat-respond/async/",
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chatbot endpoints of a running server, comparing the sync "
+        "(/api/chat-respond/) and async (/api/chat-respond/async/) pipelines. "
+        "Creates (and then deletes) one chat per concurrent worker through the API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--email", help="Mint an access token for this user.")
+        parser.add_argument("--token", help="Use this JWT access token instead of --email.")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--timeout", type=float, default=120.0)
+        parser.add_argument("--message", default="Give me a 30 minute warmup.")
+        parser.add_argument("--mode", choices=["sync", "async", "both"], default="both")
+
+    def handle(self, *args, **options):
+        token = options["token"]
+        if not token:
+            if not options["email"]:
+                raise CommandError("Pass --email or --token.")
+            try:
+                user = User.objects.get(email=options["email"])
+            except User.DoesNotExist:
+                raise CommandError(f"No user with email {options['email']}.")
+            token = str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+
+        modes = ["sync", "async"] if options["mode"] == "both" else [options["mode"]]
+        for mode in modes:
+            stats = asyncio.run(self.run_mode(mode, token, options))
+            self.report(mode, stats)
+
+    async def run_mode(self, mode, token, options):
+        base_url = options["base_url"].rstrip("/")
+        url = base_url + ENDPOINTS[mode]
+        headers = {"Authorization": f"JWT {token}"}
+        latencies, errors = [], []
+        jobs = asyncio.Queue()
+        for i in range(options["requests"]):
+            jobs.put_nowait(i)
+
+        limits = httpx.Limits(max_connections=options["concurrency"])
+        async with httpx.AsyncClient(headers=headers, timeout=options["timeout"], limits=limits) as client:
+            # Each worker owns one chat, so turns never wait on another turn's lock.
+            chat_ids = await self.create_chats(client, base_url, options["concurrency"])
+
+            async def worker(chat_id):
+                while not jobs.empty():
+                    i = jobs.get_nowait()
+                    # A distinct message and key per turn, so resubmission coalescing doesn't kick in.
+                    payload = {"chat_id": chat_id, "message": f"{options['message']} (#{i + 1})"}
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(url, json=payload, headers={"Idempotency-Key": uuid.uuid4().hex})
+                        if response.status_code == 200:
+                            latencies.append(time.perf_counter() - started)
+                        else:
+                            errors.append(response.status_code)
+                    except httpx.HTTPError as e:
+                        errors.append(type(e).__name__)
+
+            try:
+                started = time.perf_counter()
+                await asyncio.gather(*(worker(chat_id) for chat_id in chat_ids))
+                elapsed = time.perf_counter() - started
+            finally:
+                for chat_id in chat_ids:
+                    await client.delete(f"{base_url}/api/chats/{chat_id}/")
+
+        return {"latencies": latencies, "errors": errors, "elapsed": elapsed}
+
+    async def create_chats(self, client, base_url, count):
+        chat_ids = []
+        for _ in range(count):
+            response = await client.post(f"{base_url}/api/chats/", json={"participant_ids": []})
+            if response.status_code != 201:
+                for chat_id in chat_ids:
+                    await client.delete(f"{base_url}/api/chats/{chat_id}/")
+                raise CommandError(f"Creating a chat failed with {response.status_code}: {response.text[:200]}")
+            chat_ids.append(response.json()["id"])
+        return chat_ids
+
+    def report(self, mode, stats):
+        latencies = stats["latencies"]
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{mode} ({ENDPOINTS[mode]})"))
+        self.stdout.write(f"  ok: {len(latencies)}  errors: {len(stats['errors'])}  wall: {stats['elapsed']:.2f}s")
+        if stats["errors"]:
+            self.stdout.write(f"  error kinds: {sorted(set(map(str, stats['errors'])))}")
+        if latencies:
+            self.stdout.write(
+                f"  throughput: {len(latencies) / stats['elapsed']:.2f} req/s  "
+                f"mean: {statistics.mean(latencies):.3f}s  "
+                f"p50: {percentile(latencies, 50):.3f}s  "
+                f"p95: {percentile(latencies, 95):.3f}s  "
+                f"p99: {percentile(latencies, 99):.3f}s  "
+                f"max: {max(latencies):.3f}s"
+            )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from chat.fake_ollama import DEFAULT_REPLY, FakeOllama
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a fake Ollama server (/api/chat, /api/generate) with configurable "
+        "latency, token rate and failure injection, for benchmarks without a GPU."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=11434)
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token.")
+        parser.add_argument("--tokens-per-second", type=float, default=40, help="Generation rate (0 = instant).")
+        parser.add_argument("--failure-rate", type=float, default=0, help="Fraction of requests to fail (0-1).")
+        parser.add_argument("--failure-status", type=int, default=500)
+        parser.add_argument("--reply", default=DEFAULT_REPLY)
+
+    def handle(self, *args, **options):
+        server = FakeOllama(
+            host=options["host"],
+            port=options["port"],
+            reply=options["reply"],
+            latency=options["latency"],
+            tokens_per_second=options["tokens_per_second"],
+            failure_rate=options["failure_rate"],
+            failure_status=options["failure_status"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Fake Ollama listening on {server.url} (Ctrl-C to stop)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server.server_close()
+        self.stdout.write(f"Served {server.requests} requests ({server.failures} injected failures)")
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.llm import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Load LLM models into memory so the first chat turn doesn't pay the model "
+        "load. With --interval, keep pinging so Ollama never unloads them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile", action="append", dest="profiles",
+            help="LLM_PROFILES entry to warm up (repeatable; default: LLM_WARMUP_PROFILES).",
+        )
+        parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds (0 = once).")
+
+    def handle(self, *args, **options):
+        profiles = options["profiles"] or settings.LLM_WARMUP_PROFILES
+        unknown = [name for name in profiles if name not in settings.LLM_PROFILES]
+        if unknown:
+            raise CommandError(f"Unknown LLM profile(s): {', '.join(unknown)}")
+
+        while True:
+            started = time.perf_counter()
+            results = warm_up(profiles)
+            elapsed = time.perf_counter() - started
+            for name in profiles:
+                if name not in results:
+                    self.stdout.write(f"{name}: nothing to load")
+                elif results[name] is None:
+                    self.stdout.write(self.style.SUCCESS(f"{name}: loaded"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"{name}: {results[name]}"))
+            self.stdout.write(f"Warmup took {elapsed:.2f}s")
+            if options["interval"] <= 0:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,72 @@
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from chat.semantic_cache import VectorIndex, normalize
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the semantic cache's NumPy vector index: insert, lookup and "
+        "save/load times for a scope filled with random unit vectors."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=100_000)
+        parser.add_argument("--dim", type=int, default=768, help="Embedding size (nomic-embed-text is 768).")
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        entries, dim = options["entries"], options["dim"]
+        rng = np.random.default_rng(options["seed"])
+        vectors = rng.standard_normal((entries, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        index = VectorIndex(capacity=entries)
+        started = time.perf_counter()
+        for i, vector in enumerate(vectors):
+            index.add(vector, f"question {i}", f"answer {i}")
+        insert_seconds = time.perf_counter() - started
+
+        # Half the queries are near-duplicates of stored questions, half are random.
+        lookups = []
+        hits = 0
+        for q in range(options["queries"]):
+            if q % 2 == 0:
+                target = int(rng.integers(entries))
+                query = normalize(vectors[target] + 0.05 * rng.standard_normal(dim, dtype=np.float32))
+            else:
+                target = None
+                query = normalize(rng.standard_normal(dim, dtype=np.float32))
+            started = time.perf_counter()
+            best, _ = index.search(query, ttl=3600)
+            lookups.append(time.perf_counter() - started)
+            hits += target is not None and best == target
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "scope.npz")
+            started = time.perf_counter()
+            index.save(path)
+            save_seconds = time.perf_counter() - started
+            size_mb = os.path.getsize(path) / 1e6
+            started = time.perf_counter()
+            VectorIndex.load(path, capacity=entries)
+            load_seconds = time.perf_counter() - started
+
+        lookups_ms = sorted(x * 1000 for x in lookups)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"VectorIndex: {entries} entries x {dim} dims"))
+        self.stdout.write(f"  matrix memory: {index.vectors.nbytes / 1e6:.1f} MB")
+        self.stdout.write(f"  insert: {insert_seconds:.2f}s total, {insert_seconds / entries * 1e6:.1f} us/entry")
+        self.stdout.write(
+            f"  lookup: mean {statistics.mean(lookups_ms):.2f} ms  "
+            f"p50 {lookups_ms[len(lookups_ms) // 2]:.2f} ms  "
+            f"p95 {lookups_ms[int(len(lookups_ms) * 0.95) - 1]:.2f} ms  "
+            f"max {lookups_ms[-1]:.2f} ms"
+        )
+        self.stdout.write(f"  near-duplicate recall: {hits}/{(options['queries'] + 1) // 2}")
+        self.stdout.write(f"  save: {save_seconds:.2f}s ({size_mb:.1f} MB)  load: {load_seconds:.2f}s")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_remove_chat_plan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='last_summarized_message_id',
+            field=models.BigIntegerField(blank=True, help_text='Id of the newest message already folded into topic_summary.', null=True),
+        ),
+    ]
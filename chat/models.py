@@ -17,6 +17,12 @@ class Chat(models.Model):
 
     total_chat_duration = models.DurationField(default=timedelta)
 
+    last_summarized_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text='Id of the newest message already folded into topic_summary.'
+    )
+
     def __str__(self):
         usernames = ', '.join(user.username for user in self.participants.all())
         return f"Chat between {usernames}"
@@ -31,3 +37,25 @@ class Message(models.Model):
 
     def __str__(self):
         return f"From {self.sender.username} at {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class ContextSnippet(models.Model):
+    """
+    Embedded text from one of a user's plans or chat summaries, retrieved into
+    prompts by chat/retrieval.py. Exactly one of `plan` and `chat` is set.
+    """
+    user = models.ForeignKey(User, related_name='context_snippets', on_delete=models.CASCADE)
+    plan = models.ForeignKey('plans.Plan', related_name='context_snippets', on_delete=models.CASCADE, null=True, blank=True)
+    chat = models.ForeignKey(Chat, related_name='context_snippets', on_delete=models.CASCADE, null=True, blank=True)
+    text = models.TextField()
+    vector = models.BinaryField(help_text='Unit-length float32 embedding of `text`.')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'plan'], name='unique_plan_snippet'),
+            models.UniqueConstraint(fields=['user', 'chat'], name='unique_chat_snippet'),
+        ]
+
+    def __str__(self):
+        return f"Context for {self.user_id}: {self.text[:40]}"
@@ -0,0 +1,107 @@
+"""
+Prompt building for the chatbot.
+
+The personalized system prompt depends only on the user's About profile, so
+it is rendered once and cached per user. about/signals.py drops the cached
+entry whenever the profile is saved or deleted. Chat history is sent to the
+model as typed LangChain message objects rather than ChatPromptTemplate
+tuples. Nothing is parsed as a template, so braces in user content reach
+the model unchanged.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from about.models import About
+
+# What the chat pipeline needs from About: the scope for the semantic cache,
+# and the rendered system prompt.
+Profile = namedtuple("Profile", ["sport_coach", "system_message"])
+
+_MISSING = "missing"
+
+
+def render_system_message(sport_coach, details):
+    return f"""
+    You are a concise, smart, and context-aware assistant who gives sharp, relevant replies only.
+    This user is a sports coach. They specialize in: **{sport_coach}**.
+    Here’s what the user said about themselves:
+    ---
+    {details}
+    ---
+    Use this info to personalize your tone, advice, examples, and especially team-specific responses.
+    If they ask about "my team", infer from the text above.
+    Do not give general explanations. Focus only on what they ask.
+    Keep answers short and inline unless explicitly asked for depth.
+    """
+
+
+def system_prompt_cache_key(user_id):
+    return f"chat-system-prompt:{user_id}"
+
+
+def invalidate_system_prompt(user_id):
+    cache.delete(system_prompt_cache_key(user_id))
+
+
+def _profile_from_row(row):
+    if row is None:
+        return None
+    sport_coach, details = row
+    return Profile(sport_coach, render_system_message(sport_coach, details))
+
+
+def _from_cached(cached):
+    return None if cached == _MISSING else Profile(*cached)
+
+
+def _to_cached(profile):
+    return _MISSING if profile is None else tuple(profile)
+
+
+def get_profile(user):
+    """Return the user's cached Profile, or None if they have no About section."""
+    key = system_prompt_cache_key(user.id)
+    cached = cache.get(key)
+    if cached is not None:
+        return _from_cached(cached)
+
+    row = About.objects.filter(user_id=user.id).values_list("sport_coach", "details").first()
+    profile = _profile_from_row(row)
+    cache.set(key, _to_cached(profile), settings.CHAT_SYSTEM_PROMPT_CACHE_TTL)
+    return profile
+
+
+async def aget_profile(user):
+    """Async version of get_profile."""
+    key = system_prompt_cache_key(user.id)
+    cached = await cache.aget(key)
+    if cached is not None:
+        return _from_cached(cached)
+
+    row = await About.objects.filter(user_id=user.id).values_list("sport_coach", "details").afirst()
+    profile = _profile_from_row(row)
+    await cache.aset(key, _to_cached(profile), settings.CHAT_SYSTEM_PROMPT_CACHE_TTL)
+    return profile
+
+
+def build_messages(system_message, memory, history, user_input, notes=None):
+    """
+    Build the message list for the model.
+    `history` holds (is_user, content) pairs, oldest first.
+    The order is fixed so consecutive turns share a byte-identical prefix, which
+    Ollama can serve from its KV cache: the static system prompt first, then the
+    summary note, then the history. Anything that changes every turn goes last:
+    the retrieved `notes`, then the user input.
+    """
+    messages = [SystemMessage(content=system_message)]
+    if memory:
+        messages.append(SystemMessage(content=memory))
+    for is_user, content in history:
+        messages.append(HumanMessage(content=content) if is_user else AIMessage(content=content))
+    if notes:
+        messages.append(SystemMessage(content=notes))
+    messages.append(HumanMessage(content=user_input.strip()))
+    return messages
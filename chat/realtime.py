@@ -0,0 +1,152 @@
+"""
+Fan-out of chat events to connected WebSocket clients (see chat/websocket.py).
+
+Every open chat socket subscribes to its chat's group. commit_chat_turn()
+publishes each new Message once the turn commits, and the socket running a
+turn publishes the reply's tokens as they stream, so all of the chat's
+participants see the reply being written.
+
+The broker is picked with CHAT_REALTIME_BROKER. The default, InProcessBroker,
+keeps subscribers in memory and needs no other service, but only reaches
+sockets served by the same process: run a single ASGI worker with it, or plug
+in a broker with the same publish()/subscribe() interface (for example on
+Redis pub/sub) when serving chats from several processes.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from api.metrics import counter
+
+realtime_events_total = counter(
+    "chat_realtime_events_total", "Chat events delivered to sockets, by type (and dropped for slow sockets)."
+)
+
+_broker = None
+_lock = threading.Lock()
+
+
+def chat_group(chat_id):
+    return f"chat-{chat_id}"
+
+
+class Subscription:
+    """
+    Events of one group for one socket, read with `await get()`. get() returns
+    None once the subscription is closed, or when the socket fell more than
+    CHAT_REALTIME_QUEUE_SIZE events behind and was dropped.
+    """
+
+    def __init__(self, broker, group, loop):
+        self.broker = broker
+        self.group = group
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=settings.CHAT_REALTIME_QUEUE_SIZE)
+        self.closed = False
+        self.lagged = False
+
+    def push(self, event):
+        """Queue an event for this socket only. Call from the subscription's event loop."""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            realtime_events_total.inc(type="dropped")
+            self.lagged = True
+            self.close()
+        else:
+            realtime_events_total.inc(type=event.get("type", ""))
+
+    def deliver(self, event):
+        """Queue an event from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self.push, event)
+        except RuntimeError:
+            pass  # the socket's loop is gone
+
+    async def get(self):
+        if self.closed and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.broker.unsubscribe(self)
+        # Wake up a pending get(); a lagging socket loses its backlog.
+        if self.lagged:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+class InProcessBroker:
+    """Delivers events to the subscribers of this process."""
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, group):
+        """Subscribe the running event loop to `group`."""
+        subscription = Subscription(self, group, asyncio.get_running_loop())
+        with self._lock:
+            self._groups.setdefault(group, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._groups.get(subscription.group)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._groups[subscription.group]
+
+    def publish(self, group, event):
+        """Send `event`, a JSON-serializable dict with a "type", to the group. Safe from any thread."""
+        with self._lock:
+            subscribers = list(self._groups.get(group, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribers(self, group):
+        with self._lock:
+            return len(self._groups.get(group, ()))
+
+
+def get_broker():
+    global _broker
+    with _lock:
+        if _broker is None:
+            _broker = import_string(settings.CHAT_REALTIME_BROKER)()
+        return _broker
+
+
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == "CHAT_REALTIME_BROKER":
+        with _lock:
+            _broker = None
+
+
+setting_changed.connect(_reset_broker)
+
+
+def publish_messages(messages):
+    """Broadcast newly saved messages to their chat's sockets."""
+    from chat.serializers import MessageSerializer
+
+    broker = get_broker()
+    for message in messages:
+        broker.publish(
+            chat_group(message.chat_id),
+            {"type": "message", "message": dict(MessageSerializer(message).data)},
+        )
@@ -0,0 +1,94 @@
+"""
+Opt-in exact-match cache for chatbot replies.
+
+Coaches often send the same canned question ("give me a 30 minute warmup") in
+the same context. When CHAT_RESPONSE_CACHE_ENABLED is on, a reply is reused if
+the model parameters and the whole message list sent to the model match: the
+personalized system prompt, any summary or retrieved notes, every history
+message and the user input. Anything less could replay a reply written for a
+different conversation, so in practice hits come from new chats and from
+chats that are identical so far.
+Entries live in the "chat_responses" cache alias, which applies TTL and
+LRU-style eviction (locmem culls the least recently used keys).
+"""
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from api.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = "chat_responses"
+
+# Parameters that change what the model generates.
+MODEL_FIELDS = ("model", "model_name", "base_url", "temperature", "top_k", "top_p",
+                "repeat_penalty", "num_ctx", "num_predict", "seed")
+
+response_cache_requests = counter(
+    "chat_response_cache_requests_total", "Exact-match response cache lookups by result."
+)
+
+
+def enabled():
+    return settings.CHAT_RESPONSE_CACHE_ENABLED
+
+
+def model_fingerprint(llm):
+    return {field: getattr(llm, field) for field in MODEL_FIELDS if getattr(llm, field, None) is not None}
+
+
+def cache_key(llm, chat_history):
+    """
+    Hash the model parameters and `chat_history`, the full message list sent
+    to the model.
+    """
+    payload = json.dumps(
+        {
+            "model": model_fingerprint(llm),
+            "messages": [(msg.type, msg.content) for msg in chat_history],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return "chat-response:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _record(key, response, chat):
+    result = "hit" if response is not None else "miss"
+    response_cache_requests.inc(result=result)
+    if response is not None:
+        logger.info("Chat response cache hit for chat %s (%s)", chat.id, key[-12:])
+
+
+def get_cached_response(llm, chat_history, chat):
+    """Return (key, cached reply or None). The key is None when the cache is off."""
+    if not enabled():
+        return None, None
+    key = cache_key(llm, chat_history)
+    response = caches[CACHE_ALIAS].get(key)
+    _record(key, response, chat)
+    return key, response
+
+
+def store_response(key, response):
+    if key and response and not response.startswith("[AI Error]"):
+        caches[CACHE_ALIAS].set(key, response, settings.CHAT_RESPONSE_CACHE_TTL)
+
+
+async def aget_cached_response(llm, chat_history, chat):
+    """Async version of get_cached_response."""
+    if not enabled():
+        return None, None
+    key = cache_key(llm, chat_history)
+    response = await caches[CACHE_ALIAS].aget(key)
+    _record(key, response, chat)
+    return key, response
+
+
+async def astore_response(key, response):
+    if key and response and not response.startswith("[AI Error]"):
+        await caches[CACHE_ALIAS].aset(key, response, settings.CHAT_RESPONSE_CACHE_TTL)
@@ -0,0 +1,304 @@
+"""
+Retrieval of relevant notes from a coach's plans and earlier chats.
+
+The system prompt only carries the About profile, and the context window
+only the current chat. When CHAT_RETRIEVAL_ENABLED is on, each plan (title,
+date and description) and each chat summary is embedded into a
+ContextSnippet row for its user. At prompt time the user input is embedded
+and the most similar snippets are added to the prompt: at most
+CHAT_RETRIEVAL_TOP_K of them, within CHAT_RETRIEVAL_TOKEN_BUDGET tokens,
+and scoring at least CHAT_RETRIEVAL_MIN_SIMILARITY. The budget is taken out
+of the context window's budget, and the notes go after the chat history so
+the cached prompt prefix stays intact.
+
+Snippets are kept up to date by post_save signals on Plan and Chat, and by
+the summarizer and the plan-titling job, which save with update(). Embedding
+runs in a background thread after the transaction commits. A user's
+snippets are served from the default cache as one NumPy matrix, rebuilt
+whenever a snippet changes. `manage.py ai_jobs context` backfills the index,
+and re-embeds everything when the embedder changes.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+
+from api.metrics import counter
+from chat.context import count_tokens
+from chat.models import Chat, ContextSnippet
+from chat.semantic_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+SNIPPET_MAX_CHARS = 800
+CONTEXT_HEADER = "Notes from this coach's plans and earlier chats that may be relevant:"
+
+retrieval_requests = counter("chat_retrieval_requests_total", "Context retrieval lookups by result (hit, miss, empty).")
+
+_embedder = None
+_executor = None
+_lock = threading.Lock()
+_pending = set()  # (kind, id) queued for indexing
+
+
+def enabled():
+    return settings.CHAT_RETRIEVAL_ENABLED
+
+
+def get_embedder():
+    global _embedder
+    with _lock:
+        if _embedder is None:
+            _embedder = import_string(settings.CHAT_RETRIEVAL_EMBEDDER)()
+        return _embedder
+
+
+def _reset_embedder(setting, **kwargs):
+    global _embedder
+    if setting.startswith("CHAT_RETRIEVAL_EMBEDDER") or setting.startswith("CHAT_SEMANTIC_CACHE_EMBED"):
+        with _lock:
+            _embedder = None
+
+
+setting_changed.connect(_reset_embedder)
+
+
+def embedder_version():
+    """Identifies the embeddings in the index; a new value means they must be rebuilt."""
+    name = f"{settings.CHAT_RETRIEVAL_EMBEDDER}:{settings.CHAT_SEMANTIC_CACHE_EMBED_MODEL}"
+    return hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+
+
+def index_cache_key(user_id):
+    return f"chat-retrieval:{user_id}"
+
+
+def invalidate_index(user_id):
+    cache.delete(index_cache_key(user_id))
+
+
+# Indexing
+
+def plan_text(title, description, date):
+    text = f'Plan "{title}"' if title else "Plan"
+    if date:
+        text += f" on {date:%Y-%m-%d}"
+    if description and description.strip():
+        text += f": {description.strip()}"
+    elif not title:
+        return ""
+    return text[:SNIPPET_MAX_CHARS]
+
+
+def chat_text(topic_summary):
+    summary = (topic_summary or "").strip()
+    if not summary or summary == Chat._meta.get_field("topic_summary").default:
+        return ""
+    return f"Earlier chat: {summary}"[:SNIPPET_MAX_CHARS]
+
+
+def _save_snippets(text, user_ids, **source):
+    """Replace the snippets of one plan or chat with `text` (none if empty)."""
+    stale = ContextSnippet.objects.filter(**source).exclude(user_id__in=user_ids if text else [])
+    dropped = set(stale.values_list("user_id", flat=True))
+    stale.delete()
+    if text:
+        vector = normalize(get_embedder().embed(text)).astype(np.float32).tobytes()
+        for user_id in user_ids:
+            ContextSnippet.objects.update_or_create(
+                user_id=user_id, **source, defaults={"text": text, "vector": vector}
+            )
+    for user_id in dropped | set(user_ids if text else []):
+        invalidate_index(user_id)
+
+
+def index_plan(plan_id):
+    """(Re)embed a plan's snippet."""
+    from plans.models import Plan
+
+    row = Plan.objects.filter(id=plan_id).values_list("user_id", "title", "description", "date").first()
+    if row is None:
+        return
+    user_id, title, description, date = row
+    _save_snippets(plan_text(title, description, date), [user_id], plan_id=plan_id)
+
+
+def index_chat(chat_id):
+    """(Re)embed a chat summary's snippet for each human participant."""
+    from chat.services import BOT_USERNAME
+
+    summary = Chat.objects.filter(id=chat_id).values_list("topic_summary", flat=True).first()
+    if summary is None:
+        return
+    user_ids = list(
+        Chat.participants.through.objects.filter(chat_id=chat_id)
+        .exclude(user__username=BOT_USERNAME)
+        .values_list("user_id", flat=True)
+    )
+    _save_snippets(chat_text(summary), user_ids, chat_id=chat_id)
+
+
+INDEXERS = {"plan": index_plan, "chat": index_chat}
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-retrieval")
+        return _executor
+
+
+def _run_in_worker(kind, object_id):
+    with _lock:
+        _pending.discard((kind, object_id))
+    close_old_connections()
+    try:
+        INDEXERS[kind](object_id)
+    except Exception:
+        logger.exception("Indexing %s %s for retrieval failed", kind, object_id)
+    finally:
+        close_old_connections()
+
+
+def _submit(kind, object_id):
+    with _lock:
+        if (kind, object_id) in _pending:
+            return  # saved several times in one request; index it once
+        _pending.add((kind, object_id))
+    get_executor().submit(_run_in_worker, kind, object_id)
+
+
+def schedule_index(kind, object_id):
+    """
+    Re-embed a plan or chat once the surrounding transaction commits. With
+    CHAT_RETRIEVAL_ASYNC off, indexing runs inline.
+    """
+    if not enabled():
+        return
+    if not settings.CHAT_RETRIEVAL_ASYNC:
+        transaction.on_commit(lambda: INDEXERS[kind](object_id))
+        return
+    transaction.on_commit(lambda: _submit(kind, object_id))
+
+
+# Retrieval
+
+def load_index(user_id):
+    """Return the user's snippets as (chat_ids, texts, matrix), cached until they change."""
+    key = index_cache_key(user_id)
+    index = cache.get(key)
+    if index is None:
+        rows = list(ContextSnippet.objects.filter(user_id=user_id).values_list("chat_id", "text", "vector"))
+        index = _build_index(rows)
+        cache.set(key, index, settings.CHAT_RETRIEVAL_CACHE_TTL)
+    return index
+
+
+async def aload_index(user_id):
+    key = index_cache_key(user_id)
+    index = await cache.aget(key)
+    if index is None:
+        rows = [row async for row in ContextSnippet.objects.filter(user_id=user_id).values_list("chat_id", "text", "vector")]
+        index = _build_index(rows)
+        await cache.aset(key, index, settings.CHAT_RETRIEVAL_CACHE_TTL)
+    return index
+
+
+def _build_index(rows):
+    if not rows:
+        return [], [], None
+    vectors = [np.frombuffer(bytes(vector), dtype=np.float32) for _, _, vector in rows]
+    # Rows embedded by an earlier embedder have another size; skip them until re-embedded.
+    dim = len(vectors[-1])
+    keep = [i for i, vector in enumerate(vectors) if len(vector) == dim]
+    return (
+        [rows[i][0] for i in keep],
+        [rows[i][1] for i in keep],
+        np.stack([vectors[i] for i in keep]),
+    )
+
+
+def select_snippets(index, vector, exclude_chat_id=None):
+    """The best-matching snippet texts that fit the retrieval budget, best first."""
+    chat_ids, texts, matrix = index
+    if matrix is None or matrix.shape[1] != vector.shape[0]:
+        return []
+    scores = matrix @ vector
+    budget = settings.CHAT_RETRIEVAL_TOKEN_BUDGET - count_tokens(CONTEXT_HEADER)
+    picked = []
+    for i in np.argsort(-scores):
+        if scores[i] < settings.CHAT_RETRIEVAL_MIN_SIMILARITY or len(picked) >= settings.CHAT_RETRIEVAL_TOP_K:
+            break
+        # The current chat's own summary is already in the prompt.
+        if exclude_chat_id is not None and chat_ids[i] == exclude_chat_id:
+            continue
+        cost = count_tokens(texts[i])
+        if cost <= budget:
+            budget -= cost
+            picked.append(texts[i])
+    return picked
+
+
+def render_context(snippets):
+    if not snippets:
+        return None
+    return "\n".join([CONTEXT_HEADER] + [f"- {text}" for text in snippets])
+
+
+def _result(snippets):
+    retrieval_requests.inc(result="hit" if snippets else "miss")
+    return render_context(snippets)
+
+
+def retrieve(user, chat, user_input):
+    """
+    Return the note of relevant snippets for a turn, or None. Errors are
+    logged and treated as no context.
+    """
+    if not enabled():
+        return None
+    try:
+        index = load_index(user.id)
+        if not index[1]:
+            retrieval_requests.inc(result="empty")
+            return None
+        vector = normalize(get_embedder().embed(user_input))
+        return _result(select_snippets(index, vector, chat.id))
+    except Exception:
+        logger.exception("Retrieving context for chat %s failed; answering without it", chat.id)
+        return None
+
+
+async def aretrieve(user, chat, user_input):
+    """Async version of retrieve."""
+    if not enabled():
+        return None
+    try:
+        index = await aload_index(user.id)
+        if not index[1]:
+            retrieval_requests.inc(result="empty")
+            return None
+        vector = normalize(await get_embedder().aembed(user_input))
+        return _result(select_snippets(index, vector, chat.id))
+    except Exception:
+        logger.exception("Retrieving context for chat %s failed; answering without it", chat.id)
+        return None
+
+
+def index_user(user_id):
+    """Re-embed all of a user's plans and chat summaries (used by the backfill job)."""
+    from plans.models import Plan
+
+    for plan_id in Plan.objects.filter(user_id=user_id).values_list("id", flat=True):
+        index_plan(plan_id)
+    for chat_id in Chat.objects.filter(participants__id=user_id).values_list("id", flat=True):
+        index_chat(chat_id)
+
@@ -0,0 +1,358 @@
+"""
+Semantic reply cache backed by local embeddings.
+
+Many chat messages are paraphrases of questions already asked. When
+CHAT_SEMANTIC_CACHE_ENABLED is on, the user input is embedded and compared by
+cosine similarity with earlier (question, answer) pairs from the same scope. If
+the best match scores at least CHAT_SEMANTIC_CACHE_THRESHOLD, its answer is
+reused.
+
+A reply depends on the whole prompt, not just the question, so only
+self-contained turns use the cache: the system prompt plus the user input,
+with no summary, no earlier messages and no notes retrieved from the coach's
+plans and chats (scope_for() returns None for anything else, and such replies
+are never stored). The scope is the sport plus a hash of the personalized
+system prompt, so a reply is only reused for the same prompt.
+
+Each scope keeps a float32 NumPy matrix of unit vectors, so a lookup is one
+matrix-vector product. The matrix grows by doubling up to
+CHAT_SEMANTIC_CACHE_MAX_ENTRIES rows; when a scope is full, the least recently
+used entry is overwritten. Entries older than CHAT_SEMANTIC_CACHE_TTL seconds
+never match. At most CHAT_SEMANTIC_CACHE_MAX_SCOPES scopes stay in memory; the
+least recently used one is saved and dropped. Scopes are saved as .npz files
+under CHAT_SEMANTIC_CACHE_DIR.
+"""
+import atexit
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from api.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+semantic_cache_requests = counter(
+    "chat_semantic_cache_requests_total", "Semantic response cache lookups by result."
+)
+semantic_cache_similarity = histogram(
+    "chat_semantic_cache_best_similarity", "Best cosine similarity found per semantic cache lookup.",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 1.0),
+)
+
+
+class OllamaEmbedder:
+    """Embeds text with a local Ollama embedding model."""
+
+    def __init__(self):
+        from langchain_ollama import OllamaEmbeddings
+
+        self.embeddings = OllamaEmbeddings(
+            model=settings.CHAT_SEMANTIC_CACHE_EMBED_MODEL,
+            base_url=settings.CHAT_SEMANTIC_CACHE_EMBED_URL,
+        )
+
+    def embed(self, text):
+        return self.embeddings.embed_query(text)
+
+    async def aembed(self, text):
+        return await self.embeddings.aembed_query(text)
+
+
+class HashingEmbedder:
+    """
+    Dependency-free embedder that hashes word unigrams and bigrams into a fixed
+    vector. It only catches near-verbatim paraphrases, but needs no model.
+    Useful for tests, benchmarks and boxes without an embedding model.
+    """
+    dim = 512
+
+    def embed(self, text):
+        words = text.lower().split()
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for gram in words + [" ".join(pair) for pair in zip(words, words[1:])]:
+            digest = hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        return vector
+
+    async def aembed(self, text):
+        return self.embed(text)
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorIndex:
+    """Bounded cosine-similarity index of (question, answer) pairs."""
+
+    initial_rows = 64
+
+    def __init__(self, capacity, dim=None):
+        self.capacity = capacity
+        self.dim = dim
+        self.size = 0
+        self.vectors = None
+        self.last_used = np.zeros(0, dtype=np.float64)
+        self.created = np.zeros(0, dtype=np.float64)
+        self.questions = []
+        self.answers = []
+        self.lock = threading.Lock()
+
+    def _reserve(self, dim, rows):
+        """Make room for `rows` entries of `dim` floats, doubling the arrays as needed."""
+        if self.vectors is None:
+            self.dim = dim
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        elif dim != self.dim:
+            raise ValueError(f"Embedding size changed from {self.dim} to {dim}; clear the semantic cache.")
+        allocated = len(self.vectors)
+        if rows <= allocated:
+            return
+        grown = min(self.capacity, max(rows, allocated * 2, self.initial_rows))
+        vectors = np.zeros((grown, dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        self.vectors = vectors
+        self.last_used = np.concatenate([self.last_used, np.zeros(grown - allocated)])
+        self.created = np.concatenate([self.created, np.zeros(grown - allocated)])
+        self.questions += [None] * (grown - allocated)
+        self.answers += [None] * (grown - allocated)
+
+    def search(self, vector, ttl=None):
+        """Return (index, similarity) of the best live match, or (None, 0.0)."""
+        with self.lock:
+            if not self.size:
+                return None, 0.0
+            scores = self.vectors[:self.size] @ vector
+            if ttl:
+                scores[self.created[:self.size] < time.time() - ttl] = -1.0
+            best = int(np.argmax(scores))
+            return best, float(scores[best])
+
+    def touch(self, index):
+        with self.lock:
+            self.last_used[index] = time.time()
+
+    def add(self, vector, question, answer):
+        now = time.time()
+        with self.lock:
+            if self.size < self.capacity:
+                self._reserve(vector.shape[0], self.size + 1)
+                index = self.size
+                self.size += 1
+            else:
+                self._reserve(vector.shape[0], self.size)  # only checks the dimension
+                index = int(np.argmin(self.last_used))
+            self.vectors[index] = vector
+            self.last_used[index] = now
+            self.created[index] = now
+            self.questions[index] = question
+            self.answers[index] = answer
+
+    def save(self, path):
+        with self.lock:
+            if not self.size:
+                return
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(
+                tmp_path,
+                vectors=self.vectors[:self.size],
+                last_used=self.last_used[:self.size],
+                created=self.created[:self.size],
+                questions=np.array(self.questions[:self.size], dtype=str),
+                answers=np.array(self.answers[:self.size], dtype=str),
+            )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, capacity):
+        index = cls(capacity)
+        with np.load(path) as data:
+            count = min(len(data["questions"]), capacity)
+            index._reserve(data["vectors"].shape[1], count)
+            index.vectors[:count] = data["vectors"][-count:]
+            index.last_used[:count] = data["last_used"][-count:]
+            index.created[:count] = data["created"][-count:]
+            index.questions[:count] = data["questions"][-count:].tolist()
+            index.answers[:count] = data["answers"][-count:].tolist()
+            index.size = count
+        return index
+
+
+class SemanticCache:
+    """
+    Per-scope VectorIndex instances, loaded lazily, saved every few inserts and
+    dropped (after saving) when more than `max_scopes` are loaded.
+    """
+
+    def __init__(self, embedder, directory, capacity, threshold, ttl, save_every, max_scopes=64):
+        self.embedder = embedder
+        self.directory = directory
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.save_every = save_every
+        self.max_scopes = max_scopes
+        self._indexes = OrderedDict()
+        self._unsaved = {}
+        self._lock = threading.Lock()
+
+    def _path(self, scope):
+        if not self.directory:
+            return None
+        name = hashlib.sha1(scope.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.npz")
+
+    def index_for(self, scope):
+        evicted = []
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is not None:
+                self._indexes.move_to_end(scope)
+                return index
+            path = self._path(scope)
+            if path and os.path.exists(path):
+                index = VectorIndex.load(path, self.capacity)
+            else:
+                index = VectorIndex(self.capacity)
+            self._indexes[scope] = index
+            while len(self._indexes) > self.max_scopes:
+                name, old = self._indexes.popitem(last=False)
+                if self._unsaved.pop(name, 0):
+                    evicted.append((name, old))
+        for name, old in evicted:
+            self._save_index(name, old)
+        return index
+
+    def _match(self, scope, vector):
+        index = self.index_for(scope)
+        best, similarity = index.search(vector, self.ttl)
+        semantic_cache_similarity.observe(max(similarity, 0.0))
+        if best is not None and similarity >= self.threshold:
+            index.touch(best)
+            semantic_cache_requests.inc(result="hit")
+            return index.answers[best]
+        semantic_cache_requests.inc(result="miss")
+        return None
+
+    def lookup(self, scope, question):
+        """Return (vector, cached answer or None). Pass the vector on to store()."""
+        vector = normalize(self.embedder.embed(question))
+        return vector, self._match(scope, vector)
+
+    async def alookup(self, scope, question):
+        vector = normalize(await self.embedder.aembed(question))
+        return vector, self._match(scope, vector)
+
+    def store(self, scope, question, answer, vector=None):
+        if vector is None:
+            vector = normalize(self.embedder.embed(question))
+        self.index_for(scope).add(vector, question, answer)
+
+        with self._lock:
+            self._unsaved[scope] = self._unsaved.get(scope, 0) + 1
+            due = self._unsaved[scope] >= self.save_every
+            if due:
+                self._unsaved[scope] = 0
+        if due:
+            self.save(scope)
+
+    def _save_index(self, scope, index):
+        path = self._path(scope)
+        if path:
+            os.makedirs(self.directory, exist_ok=True)
+            index.save(path)
+
+    def save(self, scope=None):
+        with self._lock:
+            indexes = [(name, index) for name, index in self._indexes.items() if scope in (None, name)]
+        for name, index in indexes:
+            self._save_index(name, index)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def enabled():
+    return settings.CHAT_SEMANTIC_CACHE_ENABLED
+
+
+def get_semantic_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            embedder = import_string(settings.CHAT_SEMANTIC_CACHE_EMBEDDER)()
+            _cache = SemanticCache(
+                embedder=embedder,
+                directory=settings.CHAT_SEMANTIC_CACHE_DIR,
+                capacity=settings.CHAT_SEMANTIC_CACHE_MAX_ENTRIES,
+                threshold=settings.CHAT_SEMANTIC_CACHE_THRESHOLD,
+                ttl=settings.CHAT_SEMANTIC_CACHE_TTL,
+                save_every=settings.CHAT_SEMANTIC_CACHE_SAVE_EVERY,
+                max_scopes=settings.CHAT_SEMANTIC_CACHE_MAX_SCOPES,
+            )
+            atexit.register(_cache.save)
+        return _cache
+
+
+def scope_for(profile, chat_history):
+    """
+    The cache scope for a turn, or None if its reply can't be shared: anything
+    beyond the system prompt and the user input (a summary, earlier messages,
+    retrieved notes) shapes the reply too.
+    """
+    if len(chat_history) != 2 or chat_history[0].content != profile.system_message:
+        return None
+    prompt_hash = hashlib.sha256(profile.system_message.encode("utf-8")).hexdigest()[:16]
+    return f"{(profile.sport_coach or '').strip().lower()}:{prompt_hash}"
+
+
+def lookup(profile, chat_history):
+    """Return (vector, cached answer or None); (None, None) when disabled, not cacheable or on embedder errors."""
+    scope = scope_for(profile, chat_history) if enabled() else None
+    if scope is None:
+        return None, None
+    try:
+        return get_semantic_cache().lookup(scope, chat_history[-1].content)
+    except Exception:
+        logger.exception("Semantic cache lookup failed; generating the reply")
+        return None, None
+
+
+async def alookup(profile, chat_history):
+    scope = scope_for(profile, chat_history) if enabled() else None
+    if scope is None:
+        return None, None
+    try:
+        return await get_semantic_cache().alookup(scope, chat_history[-1].content)
+    except Exception:
+        logger.exception("Semantic cache lookup failed; generating the reply")
+        return None, None
+
+
+def store(profile, chat_history, answer, vector):
+    # `vector` is only set when lookup() found the turn cacheable.
+    if vector is None or not answer or answer.startswith("[AI Error]"):
+        return
+    scope = scope_for(profile, chat_history)
+    if scope is None:
+        return
+    try:
+        get_semantic_cache().store(scope, chat_history[-1].content, answer, vector)
+    except Exception:
+        logger.exception("Storing a reply in the semantic cache failed")
+
+
+async def astore(profile, chat_history, answer, vector):
+    # store() may write the index to disk, so keep it off the event loop.
+    await sync_to_async(store, thread_sensitive=False)(profile, chat_history, answer, vector)
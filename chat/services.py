@@ -0,0 +1,64 @@
+"""
+Persistence for chat turns.
+
+A turn is one user message plus one assistant reply. commit_chat_turn()
+writes both with a single bulk_create inside one transaction, together with
+the bot participant row and the chat duration, and broadcasts both to the
+chat's WebSocket clients once the transaction commits. The chatbot user is
+looked up once and then served from the cache, instead of a get_or_create()
+per turn.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from chat.models import Chat, Message
+from chat.realtime import publish_messages
+from chat.summarizer import schedule_summary
+
+User = get_user_model()
+
+BOT_USERNAME = "chatbot"
+BOT_USER_CACHE_KEY = "chat-bot-user"
+BOT_USER_FIELDS = ["id", "username", "email"]
+
+
+def get_bot_user():
+    """
+    Return the chatbot user, creating it on first use. Only `id`, `username`
+    and `email` are loaded; that is all chat serializers need.
+    """
+    row = cache.get(BOT_USER_CACHE_KEY)
+    if row is None:
+        bot_user, _ = User.objects.get_or_create(username=BOT_USERNAME)
+        row = tuple(getattr(bot_user, field) for field in BOT_USER_FIELDS)
+        cache.set(BOT_USER_CACHE_KEY, row, None)
+    return User.from_db("default", BOT_USER_FIELDS, row)
+
+
+def commit_chat_turn(chat, user, user_input, response):
+    """
+    Save exactly one user message and one assistant message for a turn, in one
+    transaction. Returns (user_message, bot_message).
+    """
+    bot_user = get_bot_user()
+    now = timezone.now()
+    user_message = Message(chat=chat, sender=user, content=user_input.strip())
+    bot_message = Message(chat=chat, sender=bot_user, content=response)
+
+    with transaction.atomic():
+        Message.objects.bulk_create([user_message, bot_message])
+        Chat.participants.through.objects.bulk_create(
+            [Chat.participants.through(chat_id=chat.id, user_id=bot_user.id)],
+            ignore_conflicts=True,
+        )
+        chat.total_chat_duration = now - chat.created_at
+        Chat.objects.filter(id=chat.id).update(total_chat_duration=chat.total_chat_duration)
+
+        # Auto-summary, debounced and run in the background once this commits
+        schedule_summary(chat.id)
+        # Push both messages to the chat's open sockets (chat/realtime.py)
+        transaction.on_commit(lambda: publish_messages([user_message, bot_message]), robust=True)
+
+    return user_message, bot_message
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from chat.models import Chat, ContextSnippet
+from chat.retrieval import invalidate_index, schedule_index
+
+
+@receiver(post_save, sender=Chat)
+def index_chat_for_retrieval(sender, instance, created, **kwargs):
+    # A new chat has no summary yet.
+    if not created:
+        schedule_index("chat", instance.id)
+
+
+@receiver(post_delete, sender=ContextSnippet)
+def drop_cached_index(sender, instance, **kwargs):
+    invalidate_index(instance.user_id)
@@ -0,0 +1,165 @@
+"""
+Background topic summarizer for chats.
+
+Refreshing Chat.topic_summary needs a second LLM call over the conversation,
+so it is kept off the request path: chat turns call schedule_summary() and a
+small thread pool does the work later. Requests are debounced per chat, so a
+chat is only re-summarized once CHAT_SUMMARY_MIN_NEW_MESSAGES messages have
+piled up, or once it has been idle for CHAT_SUMMARY_IDLE_SECONDS.
+
+Summaries are rolling: the model sees the previous summary plus only the
+messages after Chat.last_summarized_message_id, so each update costs the same
+no matter how long the chat is.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from langchain_core.prompts import ChatPromptTemplate
+
+from chat.breaker import breaker_for
+from chat.instrumentation import record_summary
+from chat.limiter import llm_slot
+from chat.llm import get_llm
+from chat.models import Chat, Message
+from chat.retrieval import schedule_index
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    "Summarize this conversation into a single paragraph. Focus on what the user asked, what they were interested in, and what the assistant provided:\n\n{chat}"
+)
+ROLLING_SUMMARY_PROMPT = ChatPromptTemplate.from_template(
+    "Here is a summary of a conversation so far:\n\n{summary}\n\n"
+    "Update it with the new messages below and return a single paragraph. Focus on what the user asked, what they were interested in, and what the assistant provided:\n\n{chat}"
+)
+DEFAULT_TOPIC_SUMMARY = Chat._meta.get_field("topic_summary").default
+TOPIC_SUMMARY_MAX_LENGTH = Chat._meta.get_field("topic_summary").max_length
+
+_executor = None
+_lock = threading.Lock()
+_pending = {}  # chat_id -> number of messages added since the last summary
+_timers = {}   # chat_id -> idle threading.Timer
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CHAT_SUMMARY_WORKERS,
+                thread_name_prefix="chat-summary",
+            )
+        return _executor
+
+
+def fold_summary(chat_id, rebuild=False, llm_profile=None):
+    """
+    Fold up to CHAT_SUMMARY_MAX_NEW_MESSAGES unsummarized messages into the
+    chat's topic_summary and return how many were folded. With `rebuild`, start
+    over from the first message and ignore the current summary. Errors propagate.
+    """
+    # Imported here to avoid a circular import (ai_logic schedules summaries).
+    from chat.ai_logic import output_parser
+
+    llm_profile = llm_profile or settings.CHAT_SUMMARY_LLM_PROFILE or settings.LLM_DEFAULT_PROFILE
+    llm = get_llm(llm_profile)
+
+    chat = Chat.objects.only("topic_summary", "last_summarized_message_id").get(id=chat_id)
+    last_id = 0 if rebuild else chat.last_summarized_message_id or 0
+    rows = list(
+        Message.objects.filter(chat_id=chat_id, id__gt=last_id)
+        .order_by("id")
+        .values_list("id", "sender__username", "content")[:settings.CHAT_SUMMARY_MAX_NEW_MESSAGES]
+    )
+    if not rows:
+        return 0
+
+    new_text = "\n".join(
+        f"{'Assistant' if username == 'chatbot' else 'User'}: {content}"
+        for _, username, content in rows
+    )
+    previous = chat.topic_summary
+    if last_id and previous and previous != DEFAULT_TOPIC_SUMMARY:
+        summary_chain = ROLLING_SUMMARY_PROMPT | llm | output_parser
+        inputs = {"summary": previous, "chat": new_text}
+    else:
+        summary_chain = SUMMARY_PROMPT | llm | output_parser
+        inputs = {"chat": new_text}
+    # Skipped while the LLM circuit is open; the messages stay unsummarized
+    with llm_slot(), breaker_for(llm_profile).call():
+        started = time.perf_counter()
+        summary_text = summary_chain.invoke(inputs).strip()
+    record_summary(chat_id, llm_profile, time.perf_counter() - started)
+
+    # Only store the result if nobody else advanced the summary meanwhile.
+    Chat.objects.filter(
+        id=chat_id, last_summarized_message_id=chat.last_summarized_message_id
+    ).update(
+        topic_summary=summary_text[:TOPIC_SUMMARY_MAX_LENGTH],
+        last_summarized_message_id=rows[-1][0],
+    )
+    schedule_index("chat", chat_id)
+    return len(rows)
+
+
+def summarize_chat(chat_id):
+    """Fold a chat's unsummarized messages into its topic_summary."""
+    try:
+        fold_summary(chat_id)
+    except Chat.DoesNotExist:
+        pass  # deleted before its summary came due
+    except Exception:
+        logger.exception("Summarizing chat %s failed", chat_id)
+
+
+def _run_in_worker(chat_id):
+    # Worker threads hold their own DB connections; keep them from going stale.
+    close_old_connections()
+    try:
+        summarize_chat(chat_id)
+    finally:
+        close_old_connections()
+
+
+def _submit(chat_id):
+    with _lock:
+        _pending.pop(chat_id, None)
+        timer = _timers.pop(chat_id, None)
+    if timer:
+        timer.cancel()
+    get_executor().submit(_run_in_worker, chat_id)
+
+
+def _debounce(chat_id, new_messages):
+    with _lock:
+        count = _pending.get(chat_id, 0) + new_messages
+        _pending[chat_id] = count
+        timer = _timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+
+        if count < settings.CHAT_SUMMARY_MIN_NEW_MESSAGES:
+            # Restart the idle countdown; it fires if no further turns arrive.
+            timer = threading.Timer(settings.CHAT_SUMMARY_IDLE_SECONDS, _submit, args=(chat_id,))
+            timer.daemon = True
+            _timers[chat_id] = timer
+            timer.start()
+            return
+
+    _submit(chat_id)
+
+
+def schedule_summary(chat_id, new_messages=2):
+    """
+    Note that `new_messages` were added to a chat and queue a re-summary when due.
+    Scheduling waits for the surrounding transaction to commit. With
+    CHAT_SUMMARY_ASYNC off the summary runs inline, without debouncing.
+    """
+    if not settings.CHAT_SUMMARY_ASYNC:
+        transaction.on_commit(lambda: summarize_chat(chat_id))
+        return
+    transaction.on_commit(lambda: _debounce(chat_id, new_messages))
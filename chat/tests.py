@@ -1,3 +1,728 @@
-from django.test import TestCase
+import asyncio
+import json
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from about.models import About
+from chat import fallback, response_cache, semantic_cache
+from chat.ai_logic import PROFILE_MISSING_REPLY, build_chat_history, generate_response_from_chat
+from chat.breaker import CircuitBreaker, CircuitOpen, breaker_for
+from chat.context import build_context_window
+from chat.fake_ollama import FakeOllama
+from chat.jobs import clean_title, pending, run_job
+from chat.instrumentation import LLMCallTimer, TurnTimings, chat_turn_stage_seconds, chat_turn_tokens
+from chat.limiter import LLMBusy
+from chat.llm import OllamaTimings, get_llm, llm_for, ollama_prompt_eval_tokens
+from chat.models import Chat, Message
+from chat.prompts import Profile, get_profile, render_system_message
+from chat.retrieval import CONTEXT_HEADER, retrieve
+from chat.services import get_bot_user
+from chat.turns import TurnInProgress, TurnLock, turn_lock
+from chat.websocket import chat_socket_application
+from plans.models import Plan
+from users.models import User
+
+FAKE_LLM_PROFILES = {
+    "fake": {"BACKEND": "chat.llm.FakeBackend", "RESPONSES": ["Start with a dynamic warmup."]},
+    "fast": {"BACKEND": "chat.llm.FakeBackend", "RESPONSES": ["Jog, then stretch."]},
+}
+use_fake_llm = override_settings(LLM_PROFILES=FAKE_LLM_PROFILES, LLM_DEFAULT_PROFILE="fake")
+
+
+@use_fake_llm
+class ChatTurnQueryCountTests(TestCase):
+    """A chat turn must run the same number of queries however long the chat is."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.bot = User.objects.create(email="chatbot@example.com", username="chatbot")
+        get_profile(self.user)  # warm the system prompt cache
+        get_bot_user()  # warm the bot user cache
+
+    def make_chat(self, history_length):
+        chat = Chat.objects.create()
+        chat.participants.add(self.user, self.bot)
+        Message.objects.bulk_create(
+            Message(chat=chat, sender=self.user if i % 2 == 0 else self.bot, content=f"message {i}")
+            for i in range(history_length)
+        )
+        return chat
+
+    def count_queries(self, turn):
+        with CaptureQueriesContext(connection) as queries:
+            turn()
+        return len(queries)
+
+    def test_generate_response_query_count_is_constant(self):
+        short_chat, long_chat = self.make_chat(2), self.make_chat(40)
+
+        short = self.count_queries(lambda: generate_response_from_chat(short_chat, self.user, "Warmup?"))
+        long = self.count_queries(lambda: generate_response_from_chat(long_chat, self.user, "Warmup?"))
+
+        self.assertEqual(short, long)
+
+    def test_chat_endpoint_query_count_is_constant(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        short_chat, long_chat = self.make_chat(2), self.make_chat(40)
+
+        def turn(chat):
+            response = client.post(f"/api/bot/{chat.id}/", {"message": "Warmup?"}, format="json")
+            self.assertEqual(response.status_code, 200)
+
+        short = self.count_queries(lambda: turn(short_chat))
+        long = self.count_queries(lambda: turn(long_chat))
+
+        self.assertEqual(short, long)
+
+
+@use_fake_llm
+class ChatTurnPersistenceTests(TestCase):
+    """Each turn saves exactly one user message and one assistant message."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSavedTurn(self):
+        rows = list(self.chat.messages.order_by("id").values_list("sender__username", "content"))
+        self.assertEqual(rows, [("coach", "Warmup?"), ("chatbot", "Start with a dynamic warmup.")])
+        self.assertTrue(self.chat.participants.filter(username="chatbot").exists())
+
+    def test_chat_respond_endpoint(self):
+        response = self.client.post("/api/chat-respond/", {"chat_id": self.chat.id, "message": "Warmup?"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["bot_response"]["sender"]["username"], "chatbot")
+        self.assertSavedTurn()
+
+    def test_bot_endpoint(self):
+        response = self.client.post(f"/api/bot/{self.chat.id}/", {"message": "Warmup?"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertSavedTurn()
+
+    def test_plan_messages_endpoint(self):
+        plan = Plan.objects.create(user=self.user, chat=self.chat)
+        response = self.client.post(
+            f"/api/plans/{plan.id}/messages/", {"chat": self.chat.id, "content": "Warmup?"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["content"], "Warmup?")
+        self.assertSavedTurn()
+
+    def test_resubmitted_turn_is_answered_once(self):
+        def post():
+            return self.client.post(
+                "/api/chat-respond/", {"chat_id": self.chat.id, "message": "Warmup?"},
+                format="json", headers={"Idempotency-Key": "turn-1"},
+            )
+
+        first, second = post(), post()
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+        self.assertSavedTurn()
+
+    def test_other_message_is_rejected_while_a_turn_runs(self):
+        lock = turn_lock(mock.Mock(headers={}), {}, self.chat, "respond", self.user, "Warmup?")
+        lock.claim()
+
+        response = self.client.post("/api/chat-respond/", {"chat_id": self.chat.id, "message": "Cooldown?"}, format="json")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn("Retry-After", response)
+        self.assertFalse(self.chat.messages.exists())
+
+
+class TurnLockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_different_message_is_rejected_while_a_turn_runs(self):
+        first = TurnLock(1, "respond", "first")
+        self.assertIsNone(first.claim())
+        with self.assertRaises(TurnInProgress):
+            TurnLock(1, "respond", "second").claim()
+        first.release()
+        self.assertIsNone(TurnLock(1, "respond", "second").claim())
+
+    def test_duplicate_gets_the_first_result(self):
+        produce = mock.Mock(return_value={"reply": "Start with a dynamic warmup."})
+        self.assertEqual(TurnLock(1, "bot", "same").run(produce), {"reply": "Start with a dynamic warmup."})
+        self.assertEqual(TurnLock(1, "bot", "same").run(produce), {"reply": "Start with a dynamic warmup."})
+        produce.assert_called_once()
+
+    def test_failed_turn_releases_the_lock(self):
+        with self.assertRaises(RuntimeError):
+            TurnLock(1, "bot", "first").run(mock.Mock(side_effect=RuntimeError))
+        self.assertIsNone(TurnLock(1, "bot", "second").claim())
+
+    def test_keyless_duplicates_only_join_a_running_turn(self):
+        first = TurnLock(1, "bot", "same", explicit=False)
+        self.assertIsNone(first.claim())
+        duplicate = TurnLock(1, "bot", "same", explicit=False)
+        with mock.patch("chat.turns.time.sleep", side_effect=lambda _: first.finish({"reply": "Rondos."})):
+            self.assertEqual(duplicate.claim(), {"reply": "Rondos."})
+
+        produce = mock.Mock(return_value={"reply": "Sprints."})
+        self.assertEqual(TurnLock(1, "bot", "same", explicit=False).run(produce), {"reply": "Sprints."})
+        produce.assert_called_once()
+
+
+@use_fake_llm
+class LLMProfileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_models_are_built_once_per_profile(self):
+        self.assertIs(get_llm(), get_llm("fake"))
+        self.assertIsNot(get_llm("fake"), get_llm("fast"))
+
+    def test_users_are_routed_by_llm_profile(self):
+        self.assertIs(llm_for(User(llm_profile="fast")), get_llm("fast"))
+        self.assertIs(llm_for(User(llm_profile="")), get_llm("fake"))
+        with self.assertLogs("chat.llm", "WARNING"):
+            self.assertIs(llm_for(User(llm_profile="retired")), get_llm("fake"))
+
+    def test_chat_turn_uses_the_users_profile(self):
+        user = User.objects.create_user(email="fast@example.com", username="fast", password="warmup-drills-42")
+        user.llm_profile = "fast"
+        About.objects.create(user=user, sport_coach="Running", details="Track club.")
+        chat = Chat.objects.create()
+        chat.participants.add(user)
+
+        reply, _ = generate_response_from_chat(chat, user, "Warmup?")
+
+        self.assertEqual(reply, "Jog, then stretch.")
+
+
+class CircuitBreakerTests(TestCase):
+    def failed_call(self, breaker):
+        with self.assertRaises(ConnectionError), breaker.call():
+            raise ConnectionError("connection refused")
+
+    def test_opens_after_consecutive_failures_and_fails_fast(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=60)
+        self.failed_call(breaker)
+        self.failed_call(breaker)
+        with self.assertRaises(CircuitOpen), breaker.call():
+            self.fail("the call should not run while the circuit is open")
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, slow_call_seconds=0)
+        with breaker.call():
+            pass
+        self.assertEqual(breaker.state, "open")
+
+    def test_streams_are_timed_to_the_first_token(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, slow_call_seconds=0.05)
+        with breaker.call() as call:
+            call.first_token()
+            time.sleep(0.1)  # a slow reader, not a slow LLM
+        self.assertEqual(breaker.state, "closed")
+
+    def test_busy_limiter_is_not_a_failure(self):
+        breaker = CircuitBreaker("test", failure_threshold=1)
+        with self.assertRaises(LLMBusy), breaker.call():
+            raise LLMBusy()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_probe_closes_or_reopens_the_circuit(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        self.failed_call(breaker)
+        self.failed_call(breaker)  # the probe fails: open again
+        self.assertEqual(breaker.state, "open")
+        with breaker.call():
+            pass
+        self.assertEqual(breaker.state, "closed")
+
+
+@use_fake_llm
+class FallbackReplyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_open_circuit_answers_from_the_fallback_responder(self):
+        breaker = breaker_for("fake")
+        for _ in range(breaker.failure_threshold):
+            with self.assertRaises(ConnectionError), breaker.call():
+                raise ConnectionError("connection refused")
+
+        plan = Plan.objects.create(user=self.user, chat=self.chat)
+        response = self.client.post(
+            f"/api/plans/{plan.id}/messages/", {"chat": self.chat.id, "content": "Warmup ideas?"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        reply = self.chat.messages.get(sender__username="chatbot").content
+        self.assertEqual(reply, fallback.generate_response("Warmup ideas?"))
+
+
+@override_settings(CHAT_CONTEXT_TOKEN_BUDGET=400, CHAT_CONTEXT_MAX_MESSAGES=50, CHAT_CONTEXT_CHARS_PER_TOKEN=4)
+class PromptPrefixTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.chat = Chat.objects.create(topic_summary="They asked about warmups and passing drills.")
+
+    def add_messages(self, start, count):
+        Message.objects.bulk_create(
+            Message(chat=self.chat, sender=self.user, content=f"message {i} " + "x" * 100)
+            for i in range(start, start + count)
+        )
+
+    def test_window_stays_anchored_at_the_summary_checkpoint(self):
+        self.add_messages(0, 30)
+        self.chat.last_summarized_message_id = self.chat.messages.order_by("id")[24].id
+
+        first, memory = build_context_window(self.chat, "You are a coach.", "Next?")
+        self.add_messages(30, 2)
+        second, _ = build_context_window(self.chat, "You are a coach.", "Next?")
+
+        self.assertIsNotNone(memory)
+        self.assertTrue(first[0][1].startswith("message 25 "))
+        self.assertEqual(second[:len(first)], first)  # same prefix, new turns appended
+
+
+class OllamaTimingsTests(TestCase):
+    def test_records_prompt_eval_and_eval(self):
+        info = {
+            "load_duration": 2_000_000, "prompt_eval_count": 12, "prompt_eval_duration": 30_000_000,
+            "eval_count": 80, "eval_duration": 1_500_000_000,
+        }
+        result = LLMResult(generations=[[ChatGeneration(message=AIMessage(content="Hi"), generation_info=info)]])
+        OllamaTimings("timing-test").on_llm_end(result)
+
+        counts, total, count = ollama_prompt_eval_tokens._values[(("profile", "timing-test"),)]
+        self.assertEqual((total, count), (12, 1))
+
+
+@use_fake_llm
+class TurnInstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stage_count(self, stage):
+        return chat_turn_stage_seconds._values.get((("profile", "fake"), ("stage", stage)), (None, 0, 0))[2]
+
+    def test_turn_stages_are_recorded_and_logged(self):
+        stages = ("history", "prompt", "llm_ttft", "llm", "persist")
+        before = {stage: self.stage_count(stage) for stage in stages}
+        with self.assertLogs("chat.instrumentation", "INFO") as logs:
+            response = self.client.post(
+                "/api/chat-respond/", {"chat_id": self.chat.id, "message": "Warmup?"}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        for stage in stages:
+            self.assertEqual(self.stage_count(stage), before[stage] + 1, stage)
+        self.assertIn(f"chat turn chat={self.chat.id} profile=fake outcome=ok", logs.output[0])
+
+        metrics = self.client.get("/metrics")
+        self.assertIn('chat_turn_stage_seconds_count{profile="fake",stage="llm_ttft"}', metrics.content.decode())
+
+    def test_token_counts_come_from_usage_metadata(self):
+        timings = TurnTimings()
+        timings.profile = "token-test"
+        timer = LLMCallTimer(timings)
+        timer.on_chat_model_start({}, [])
+        message = AIMessage(content="Hi", usage_metadata={"input_tokens": 812, "output_tokens": 64, "total_tokens": 876})
+        timer.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+        with self.assertLogs("chat.instrumentation", "INFO") as logs:
+            timings.finish()
+
+        self.assertIn("tokens=812/64", logs.output[0])
+        _, total, count = chat_turn_tokens._values[(("kind", "prompt"), ("profile", "token-test"))]
+        self.assertEqual((total, count), (812, 1))
+
+
+class FakeOllamaTests(TestCase):
+    """Chat turns against the fake Ollama server, through the real Ollama client."""
+
+    def setUp(self):
+        cache.clear()
+        self.server = FakeOllama(reply="Jog for ten minutes.").start()
+        self.addCleanup(self.server.stop)
+        profiles = {"local": {"BACKEND": "chat.llm.OllamaBackend", "MODEL": "fake", "BASE_URL": self.server.url}}
+        settings_override = override_settings(LLM_PROFILES=profiles, LLM_DEFAULT_PROFILE="local")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+
+    def test_turn_is_answered_by_the_server(self):
+        with self.assertLogs("chat.instrumentation", "INFO") as logs:
+            reply, _ = generate_response_from_chat(self.chat, self.user, "Warmup?")
+        self.assertEqual(reply, "Jog for ten minutes.")
+        self.assertEqual(self.server.requests, 1)
+        self.assertRegex(logs.output[0], r"outcome=ok .* tokens=\d+/4$")
+
+    def test_injected_failure_is_answered_from_the_fallback(self):
+        self.server.failure_rate = 1
+        reply, _ = generate_response_from_chat(self.chat, self.user, "How do I warm up?")
+        self.assertEqual(reply, fallback.generate_response("How do I warm up?"))
+        self.assertEqual(self.server.failures, 1)
+
+
+@use_fake_llm
+class AIJobsTests(TransactionTestCase):
+    """Batched jobs run on a thread pool, so the data must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        settings_override = override_settings(AI_JOBS_STATE_DIR=state_dir, AI_JOBS_RATE=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.chats = []
+        for _ in range(3):
+            chat = Chat.objects.create()
+            chat.participants.add(self.user)
+            Message.objects.create(chat=chat, sender=self.user, content="Sprint drills for U12?")
+            self.chats.append(chat)
+
+    def test_summaries_resume_after_a_limit_and_skip_unchanged_chats(self):
+        result = run_job("summaries", batch_size=1, limit=2)
+        self.assertEqual((result["processed"], result["stopped"]), (2, "limit"))
+
+        result = run_job("summaries", batch_size=1)
+        self.assertEqual((result["processed"], result["resumed"]), (1, True))
+        self.assertEqual(pending("summaries"), 0)
+        for chat in self.chats:
+            chat.refresh_from_db()
+            self.assertEqual(chat.topic_summary, "Start with a dynamic warmup.")
+
+        Message.objects.create(chat=self.chats[1], sender=self.user, content="And for U14?")
+        self.assertEqual(pending("summaries"), 1)
+
+    def test_titles_only_untitled_plans(self):
+        untitled = Plan.objects.create(user=self.user, chat=self.chats[0], title="")
+        named = Plan.objects.create(user=self.user, chat=self.chats[1], title="My sprint plan")
+
+        self.assertEqual(run_job("titles")["processed"], 1)
+        untitled.refresh_from_db()
+        named.refresh_from_db()
+        self.assertEqual(untitled.title, "Start with a dynamic warmup")
+        self.assertIsNotNone(untitled.auto_title_message_id)
+        self.assertEqual(named.title, "My sprint plan")
+        self.assertEqual(pending("titles"), 0)
+
+    def test_clean_title(self):
+        self.assertEqual(clean_title('Title: "Sprint Drills Plan."\nExtra text'), "Sprint Drills Plan")
+
+
+@use_fake_llm
+@override_settings(
+    CHAT_RETRIEVAL_ENABLED=True,
+    CHAT_RETRIEVAL_EMBEDDER="chat.semantic_cache.HashingEmbedder",
+    CHAT_RETRIEVAL_ASYNC=False,
+    CHAT_RETRIEVAL_MIN_SIMILARITY=0.2,
+)
+class ContextRetrievalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            Plan.objects.create(
+                user=self.user, title="Sprint drills",
+                description="Sprint drills for the U12 team: 6 x 30m sprints with full recovery.",
+            )
+            Plan.objects.create(user=self.user, title="Goalkeeping", description="Diving saves and footwork.")
+
+    def prompt_for(self, user_input):
+        return build_chat_history(self.chat, self.user, user_input, TurnTimings(self.chat.id))[0]
+
+    def test_relevant_plan_goes_after_the_history(self):
+        Message.objects.create(chat=self.chat, sender=self.user, content="Hi coach bot")
+        messages = self.prompt_for("What sprint drills for the U12 team?")
+
+        notes = messages[-2].content
+        self.assertTrue(notes.startswith(CONTEXT_HEADER))
+        self.assertIn("6 x 30m sprints", notes)
+        self.assertNotIn("Goalkeeping", notes)
+        self.assertEqual(messages[-3].content, "Hi coach bot")
+        self.assertEqual(messages[-1].content, "What sprint drills for the U12 team?")
+
+    def test_current_chat_summary_is_not_retrieved(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.topic_summary = "Sprint drills for the U12 team and recovery."
+            self.chat.save()
+        other = Chat.objects.create()
+        other.participants.add(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            other.topic_summary = "Sprint drills for the U12 team before matches."
+            other.save()
+
+        notes = self.prompt_for("Sprint drills for the U12 team?")[-2].content
+        self.assertIn("before matches", notes)
+        self.assertNotIn("and recovery", notes)
+
+    @override_settings(CHAT_RETRIEVAL_TOKEN_BUDGET=20)
+    def test_notes_fit_the_token_budget(self):
+        self.assertIsNone(retrieve(self.user, self.chat, "Sprint drills for the U12 team?"))
+
+    def test_deleting_a_plan_drops_its_snippet(self):
+        self.assertIsNotNone(retrieve(self.user, self.chat, "Sprint drills for the U12 team?"))
+        Plan.objects.filter(title="Sprint drills").delete()
+        self.assertIsNone(retrieve(self.user, self.chat, "Sprint drills for the U12 team?"))
+
+
+class ResponseCacheTests(TestCase):
+    def test_key_covers_the_whole_history(self):
+        llm = mock.Mock(model="llama3", temperature=0.2)
+        system = SystemMessage(content="You are a football coaching assistant.")
+        question = HumanMessage(content="Warmup ideas?")
+        key = response_cache.cache_key(llm, [system, question])
+        variants = [
+            [system, SystemMessage(content="Summary: the team plays Saturday."), question],
+            [system, SystemMessage(content="From your plans: ..."), question],
+            [system, HumanMessage(content="Plan today"), AIMessage(content="..."),
+             HumanMessage(content="Plan tomorrow"), AIMessage(content="..."), question],
+        ]
+        keys = {response_cache.cache_key(llm, history) for history in variants}
+        self.assertEqual(len(keys), len(variants))
+        self.assertNotIn(key, keys)
+        self.assertEqual(response_cache.cache_key(llm, [system, question]), key)
+
+
+@override_settings(
+    CHAT_SEMANTIC_CACHE_ENABLED=True,
+    CHAT_SEMANTIC_CACHE_EMBEDDER="chat.semantic_cache.HashingEmbedder",
+    CHAT_SEMANTIC_CACHE_DIR="",
+)
+class SemanticCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(semantic_cache, "_cache", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.profile = Profile("Football", render_system_message("Football", "I coach an U12 team."))
+
+    def turn(self, question, profile=None, history=(), notes=None):
+        profile = profile or self.profile
+        return [SystemMessage(content=profile.system_message), *history,
+                *([SystemMessage(content=notes)] if notes else []), HumanMessage(content=question)]
+
+    def test_only_self_contained_turns_are_cached(self):
+        self.assertIsNotNone(semantic_cache.scope_for(self.profile, self.turn("Warmup ideas?")))
+        follow_up = self.turn("What about tomorrow?", history=[HumanMessage(content="Plan today"), AIMessage(content="...")])
+        self.assertIsNone(semantic_cache.scope_for(self.profile, follow_up))
+        with_notes = self.turn("Warmup ideas?", notes="From your plans: ...")
+        self.assertIsNone(semantic_cache.scope_for(self.profile, with_notes))
+        vector, _ = semantic_cache.lookup(self.profile, with_notes)
+        self.assertIsNone(vector)
+
+    def test_replies_are_not_shared_across_prompts(self):
+        question = "Give me a 30 minute warmup for my team"
+        vector, answer = semantic_cache.lookup(self.profile, self.turn(question))
+        self.assertIsNone(answer)
+        semantic_cache.store(self.profile, self.turn(question), "Jog, then rondos.", vector)
+        self.assertEqual(semantic_cache.lookup(self.profile, self.turn(question))[1], "Jog, then rondos.")
+
+        other = Profile("Football", render_system_message("Football", "I coach a senior women's team."))
+        self.assertIsNone(semantic_cache.lookup(other, self.turn(question, other))[1])
+
+    def test_indexes_grow_and_scopes_are_capped(self):
+        index = semantic_cache.VectorIndex(capacity=1000)
+        for i in range(70):
+            index.add(semantic_cache.normalize(semantic_cache.HashingEmbedder().embed(f"q {i}")), f"q {i}", "a")
+        self.assertEqual(len(index.vectors), 128)
+        self.assertEqual(index.search(semantic_cache.normalize(semantic_cache.HashingEmbedder().embed("q 3")))[0], 3)
+
+        cache_ = semantic_cache.SemanticCache(
+            semantic_cache.HashingEmbedder(), "", capacity=10, threshold=0.9, ttl=None, save_every=1, max_scopes=2
+        )
+        for scope in ["a", "b", "c"]:
+            cache_.index_for(scope)
+        self.assertEqual(list(cache_._indexes), ["b", "c"])
+
+
+@use_fake_llm
+class RespondViewParityTests(TestCase):
+    """The sync and async chat-respond endpoints answer the same way."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        self.auth = f"JWT {RefreshToken.for_user(self.user).access_token}"
+
+    async def test_missing_profile_is_saved_as_the_reply(self):
+        sync = await sync_to_async(lambda: APIClient().post(
+            "/api/chat-respond/", {"chat_id": self.chat.id, "message": "Warmup ideas?"},
+            format="json", HTTP_AUTHORIZATION=self.auth,
+        ))()
+        # A different message, so the turn lock doesn't replay the first response
+        async_ = await AsyncClient().post(
+            "/api/chat-respond/async/", {"chat_id": self.chat.id, "message": "Cooldown ideas?"},
+            content_type="application/json", headers={"Authorization": self.auth},
+        )
+        for response in (sync, async_):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["bot_response"]["content"], PROFILE_MISSING_REPLY)
+        self.assertEqual(await Message.objects.filter(chat=self.chat).acount(), 4)
+
+
+class SocketClient:
+    """Drives chat_socket_application in-process, as an ASGI server would."""
+
+    def __init__(self, chat_id, token=None):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        scope = {
+            "type": "websocket",
+            "path": f"/ws/chats/{chat_id}/",
+            "query_string": f"token={token}".encode() if token else b"",
+            "headers": [],
+        }
+        self.task = asyncio.create_task(chat_socket_application(scope, self.inbox.get, self.outbox.put))
+        self.inbox.put_nowait({"type": "websocket.connect"})
+
+    async def handshake(self):
+        return (await asyncio.wait_for(self.outbox.get(), 5))["type"]
+
+    def send(self, data):
+        self.inbox.put_nowait({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive(self):
+        return json.loads((await asyncio.wait_for(self.outbox.get(), 5))["text"])
+
+    async def receive_until(self, kind):
+        events = []
+        while not events or events[-1]["type"] != kind:
+            events.append(await self.receive())
+        return events
+
+    async def close(self):
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+@use_fake_llm
+class ChatSocketTests(TransactionTestCase):
+    """The socket saves turns through on_commit hooks, so the data must be committed."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        About.objects.create(user=self.user, sport_coach="Football", details="I coach an U12 team.")
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user)
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def test_rejects_missing_token_and_non_participants(self):
+        other = await sync_to_async(User.objects.create_user)(
+            email="other@example.com", username="other", password="warmup-drills-42"
+        )
+        other_token = await sync_to_async(lambda: str(RefreshToken.for_user(other).access_token))()
+        for token in (None, "not-a-token", other_token):
+            client = SocketClient(self.chat.id, token)
+            self.assertEqual(await client.handshake(), "websocket.close")
+            await asyncio.wait_for(client.task, 5)
+
+    async def test_turn_streams_tokens_and_broadcasts_messages(self):
+        sender = SocketClient(self.chat.id, self.token)
+        watcher = SocketClient(self.chat.id, self.token)
+        self.assertEqual(await sender.handshake(), "websocket.accept")
+        self.assertEqual(await watcher.handshake(), "websocket.accept")
+
+        sender.send({"type": "message", "message": "Warmup ideas?"})
+        events = await sender.receive_until("done")
+        seen = await watcher.receive_until("message")
+        seen.append(await watcher.receive())
+
+        tokens = "".join(event["token"] for event in events if event["type"] == "token")
+        self.assertEqual(tokens, "Start with a dynamic warmup.")
+        self.assertEqual(
+            [event["message"]["content"] for event in events if event["type"] == "message"],
+            ["Warmup ideas?", "Start with a dynamic warmup."],
+        )
+        self.assertEqual(events[-1]["bot_response"]["content"], "Start with a dynamic warmup.")
+        self.assertEqual([event["type"] for event in seen if event["type"] != "token"], ["message", "message"])
+        self.assertEqual(await Message.objects.filter(chat=self.chat).acount(), 2)
+
+        await sender.close()
+        await watcher.close()
+
+    async def test_each_turn_reads_the_current_chat(self):
+        client = SocketClient(self.chat.id, self.token)
+        self.assertEqual(await client.handshake(), "websocket.accept")
+        await Chat.objects.filter(id=self.chat.id).aupdate(topic_summary="Works on pressing.")
+
+        seen = []
+
+        async def fake_stream(chat, user, message):
+            seen.append(chat.topic_summary)
+            yield "error", "stop here"
+
+        with mock.patch("chat.websocket.astream_response_from_chat", fake_stream):
+            client.send({"type": "message", "message": "Warmup ideas?"})
+            await client.receive_until("error")
+        self.assertEqual(seen, ["Works on pressing."])
+        await client.close()
+
+    async def test_bad_frames_get_errors(self):
+        client = SocketClient(self.chat.id, self.token)
+        self.assertEqual(await client.handshake(), "websocket.accept")
+        client.send({"type": "ping"})
+        self.assertEqual(await client.receive(), {"type": "pong"})
+        client.send({"type": "message", "message": "  "})
+        self.assertEqual((await client.receive())["type"], "error")
+        await client.close()
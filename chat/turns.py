@@ -0,0 +1,201 @@
+"""
+One chatbot turn at a time per chat.
+
+If a client double-submits a message, both requests read the same history,
+both pay for a full LLM generation, and their writes interleave. To prevent
+this, every chatbot endpoint first claims the chat's turn lock, a cache.add()
+key, before generating:
+
+- A resubmission of the same turn waits for the first request and returns
+  its response. "Same turn" means the same Idempotency-Key header (or
+  `idempotency_key` field); without a key, it means the same user sending
+  the same text while the first request is still running. Responses for
+  explicit keys are replayed for CHAT_TURN_RESULT_TTL seconds; a keyless
+  message sent again after the first one finished is a new turn.
+- A different message waits up to CHAT_TURN_QUEUE_TIMEOUT seconds (0 by
+  default, i.e. fail fast) for the running turn. After that it is rejected
+  with TurnInProgress, which the API returns as a 409 with Retry-After.
+
+The lock lives in the default cache. With several worker processes, use a
+shared backend (Redis, Memcached); locmem only serializes within one process.
+"""
+import asyncio
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from api.metrics import counter
+
+POLL_INTERVAL = 0.1
+
+# Keyless duplicates only get the result of the run they waited on, stored
+# per run; the short TTL just covers those waiters picking it up.
+IMPLICIT_RESULT_TTL = 5
+
+chat_turns_total = counter(
+    "chat_turns_total", "Chat turn submissions by outcome (claimed, replayed, rejected)."
+)
+
+
+class TurnInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The assistant is still answering another message in this chat."
+    default_code = "turn_in_progress"
+
+    def __init__(self, detail=None, wait=None):
+        super().__init__(detail)
+        # DRF's exception handler turns `wait` into a Retry-After header.
+        self.wait = wait if wait is not None else settings.LLM_RETRY_AFTER_SECONDS
+
+
+class TurnLock:
+    """
+    The turn lock for one submission to one chat.
+    claim() the turn, then finish(result) on success or release() on failure.
+    `scope` keeps replayed results apart for endpoints with different response shapes.
+    """
+
+    def __init__(self, chat_id, scope, key, explicit=True):
+        self.key = key
+        self.explicit = explicit
+        self.lock_key = f"chat-turn:{chat_id}"
+        self.result_key = f"chat-turn-result:{chat_id}:{scope}:{key}"
+        self.result_ttl = settings.CHAT_TURN_RESULT_TTL if explicit else IMPLICIT_RESULT_TTL
+        self.token = (key, uuid.uuid4().hex)
+
+    def _result_key(self, holder):
+        """
+        Where a duplicate's result is found: one key per Idempotency-Key, or,
+        for keyless submissions, per run of `holder` (None until we wait on one).
+        """
+        if self.explicit:
+            return self.result_key
+        return f"{self.result_key}:{holder[1]}" if holder else None
+
+    def _awaited(self, holder, awaited):
+        """The running duplicate to take the result of, if `holder` is one."""
+        return holder if holder is not None and holder[0] == self.key else awaited
+
+    def _replayed(self, result):
+        chat_turns_total.inc(outcome="replayed")
+        return result
+
+    def _check_wait(self, holder, started):
+        if holder is None:
+            return  # released in the meantime; try again straight away
+        duplicate = holder[0] == self.key
+        limit = settings.CHAT_TURN_LOCK_TTL if duplicate else settings.CHAT_TURN_QUEUE_TIMEOUT
+        if time.monotonic() - started >= limit:
+            chat_turns_total.inc(outcome="rejected")
+            raise TurnInProgress()
+
+    def claim(self):
+        """
+        Claim the chat's turn. Returns None once claimed, or the stored result
+        of an identical submission. Raises TurnInProgress.
+        """
+        started = time.monotonic()
+        awaited = None
+        while True:
+            result_key = self._result_key(awaited)
+            result = cache.get(result_key) if result_key else None
+            if result is not None:
+                return self._replayed(result)
+            if cache.add(self.lock_key, self.token, settings.CHAT_TURN_LOCK_TTL):
+                # The duplicate may have finished between the two calls above.
+                result = cache.get(result_key) if result_key else None
+                if result is not None:
+                    self.release()
+                    return self._replayed(result)
+                chat_turns_total.inc(outcome="claimed")
+                return None
+            holder = cache.get(self.lock_key)
+            awaited = self._awaited(holder, awaited)
+            self._check_wait(holder, started)
+            time.sleep(POLL_INTERVAL)
+
+    def finish(self, result):
+        """Store the turn's result for duplicates, then release the lock."""
+        cache.set(self._result_key(self.token), result, self.result_ttl)
+        self.release()
+
+    def release(self):
+        # Only drop the lock if it is still ours (it may have expired and been re-claimed).
+        if cache.get(self.lock_key) == self.token:
+            cache.delete(self.lock_key)
+
+    def run(self, produce):
+        """Run produce() as the chat's turn and return its result, or a duplicate's."""
+        result = self.claim()
+        if result is not None:
+            return result
+        try:
+            result = produce()
+        except BaseException:
+            self.release()
+            raise
+        self.finish(result)
+        return result
+
+    async def aclaim(self):
+        """Async version of claim."""
+        started = time.monotonic()
+        awaited = None
+        while True:
+            result_key = self._result_key(awaited)
+            result = await cache.aget(result_key) if result_key else None
+            if result is not None:
+                return self._replayed(result)
+            if await cache.aadd(self.lock_key, self.token, settings.CHAT_TURN_LOCK_TTL):
+                result = await cache.aget(result_key) if result_key else None
+                if result is not None:
+                    await self.arelease()
+                    return self._replayed(result)
+                chat_turns_total.inc(outcome="claimed")
+                return None
+            holder = await cache.aget(self.lock_key)
+            awaited = self._awaited(holder, awaited)
+            self._check_wait(holder, started)
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def afinish(self, result):
+        await cache.aset(self._result_key(self.token), result, self.result_ttl)
+        await self.arelease()
+
+    async def arelease(self):
+        if await cache.aget(self.lock_key) == self.token:
+            await cache.adelete(self.lock_key)
+
+    async def arun(self, produce):
+        """Async version of run; `produce` is a coroutine function."""
+        result = await self.aclaim()
+        if result is not None:
+            return result
+        try:
+            result = await produce()
+        except BaseException:
+            await self.arelease()
+            raise
+        await self.afinish(result)
+        return result
+
+
+def turn_lock(request, data, chat, scope, user, message):
+    """Build the TurnLock for a chatbot request; `data` is the parsed request body."""
+    client_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    return make_turn_lock(chat, scope, user, message, client_key)
+
+
+def make_turn_lock(chat, scope, user, message, client_key=None):
+    """Build the TurnLock for a submission, keyed by `client_key` if the client sent one."""
+    if client_key:
+        raw = f"{user.id}:key:{client_key}"
+    else:
+        raw = f"{user.id}:text:{message.strip()}"
+    key = hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+    return TurnLock(chat.id, scope, key, explicit=bool(client_key))
@@ -1,4 +1,9 @@
+import itertools
+import json
+import logging
+
 from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 
@@ -12,10 +17,15 @@ from drf_yasg.utils import swagger_auto_schema
 
 from .models import Chat, Message
 from .serializers import ChatSerializer, MessageSerializer, ChatBotResponseSerializer, UserSerializer
-from chat.ai_logic import generate_response_from_chat
-from Game_plan_chatbot.lama import demo_chatbot
+from chat.ai_logic import generate_reply, generate_response_from_chat, stream_response_from_chat
+from chat import fallback
+from chat.limiter import LLMBusy
+from chat.services import commit_chat_turn
+from chat.instrumentation import TurnTimings
+from chat.turns import TurnInProgress, turn_lock
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 # List and create chats for logged-in user
@@ -52,7 +62,7 @@ class MessageListCreateView(generics.ListCreateAPIView):
         plan_id = self.kwargs.get('plan_id')
         if plan_id:
             return Message.objects.filter(
-                chat__plan_id=plan_id,
+                chat__plan__id=plan_id,
                 chat__participants=self.request.user
             ).order_by('timestamp')
         return Message.objects.none()
@@ -61,24 +71,25 @@ class MessageListCreateView(generics.ListCreateAPIView):
         plan_id = self.kwargs.get('plan_id')
         chat_id = self.request.data.get('chat')
 
-        chat = get_object_or_404(Chat, id=chat_id, plan_id=plan_id)
-
-        user_message = serializer.save(sender=self.request.user, chat=chat)
-        self.generate_ai_reply(chat, user_message)
+        chat = get_object_or_404(Chat, id=chat_id, plan__id=plan_id)
 
-    def generate_ai_reply(self, chat, user_message):
-        user = self.request.user
-        user_input = user_message.content
+        # The user message is saved together with the reply, in one transaction
+        user_input = serializer.validated_data['content']
+        with TurnTimings(chat.id) as timings:
+            reply = self.generate_ai_reply(chat, user_input, timings)
+            with timings.stage("persist"):
+                serializer.instance, _ = commit_chat_turn(chat, self.request.user, user_input, reply)
 
+    def generate_ai_reply(self, chat, user_input, timings):
         try:
-            reply, _ = generate_response_from_chat(chat, user, user_input)
-        except Exception as e:
-            print(f"[AI LOGIC ERROR] {e}")
-            reply = demo_chatbot.generate_response(user_input)
-
-        bot_user, _ = User.objects.get_or_create(username="chatbot")
-        chat.participants.add(bot_user)
-        Message.objects.create(chat=chat, sender=bot_user, content=reply)
+            reply, _, _ = generate_reply(chat, self.request.user, user_input, timings)
+        except LLMBusy:
+            raise
+        except Exception:
+            logger.exception("Chat %s: generating the AI reply failed; answering from the fallback responder", chat.id)
+            timings.outcome = "fallback"
+            reply = fallback.generate_response(user_input)
+        return reply
 
 # Retrieve, update, or delete individual message
 class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -89,7 +100,7 @@ class MessageDetailView(generics.RetrieveUpdateDestroyAPIView):
         plan_id = self.kwargs.get('plan_id')
         if plan_id:
             return Message.objects.filter(
-                chat__plan_id=plan_id,
+                chat__plan__id=plan_id,
                 chat__participants=self.request.user
             )
         return Message.objects.none()
@@ -116,26 +127,119 @@ class ChatRespondAPIView(generics.CreateAPIView):
         user = request.user
 
         try:
-            chat = Chat.objects.prefetch_related('participants').get(id=chat_id)
+            chat = Chat.objects.get(id=chat_id)
         except Chat.DoesNotExist:
             return Response({"error": "Chat not found."}, status=404)
 
-        user_msg = Message.objects.create(chat=chat, sender=user, content=message)
+        # One turn at a time per chat; a resubmitted turn gets the first response
+        lock = turn_lock(request, request.data, chat, "respond", user, message)
+        data = lock.run(lambda: self.respond(chat, user, message))
+        return Response(data, status=200)
+
+    def respond(self, chat, user, message):
+        with TurnTimings(chat.id) as timings:
+            try:
+                reply_text, _, _ = generate_reply(chat, user, message, timings)
+            except LLMBusy:
+                raise
+            except Exception as e:
+                timings.outcome = "error"
+                reply_text = f"[Error generating response]: {e}"
+
+            with timings.stage("persist"):
+                _, bot_msg = commit_chat_turn(chat, user, message, reply_text)
+        return respond_payload(user, message, bot_msg)
+
+
+
+def respond_payload(user, message, bot_msg):
+    """Response body of the chat-respond endpoints, and of their `done` event."""
+    return {
+        "user": dict(UserSerializer(user).data),
+        "user_message": message,
+        "bot_response": dict(MessageSerializer(bot_msg).data),
+    }
+
+
+def sse_event(event, data):
+    """Format a single Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(stream):
+    response = StreamingHttpResponse(stream, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # stop nginx from buffering the stream
+    return response
+
+
+def replayed_events(data):
+    """SSE frames replaying a turn that already completed: the whole reply, then `done`."""
+    yield sse_event("token", {"token": data["bot_response"]["content"]})
+    yield sse_event("done", data)
+
+
+def prime_events(events):
+    """
+    Run a chat event generator up to its first event before the response starts,
+    so LLMBusy still becomes a 503 instead of failing mid-stream.
+    """
+    first = next(events, None)
+    return events if first is None else itertools.chain([first], events)
+
+
+class ChatRespondStreamAPIView(generics.CreateAPIView):
+    """
+    Streaming variant of ChatRespondAPIView.
+    Sends the reply as Server-Sent Events: one `token` event per generated chunk,
+    then a `done` event carrying the saved bot message (or an `error` event).
+    """
+    serializer_class = ChatRespondSerializer
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        request_body=ChatRespondSerializer,
+        responses={200: 'text/event-stream of token, done and error events'}
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        chat_id = serializer.validated_data['chat_id']
+        message = serializer.validated_data['message']
+        user = request.user
 
         try:
-            reply_text, _ = generate_response_from_chat(chat, user, message)
-        except Exception as e:
-            reply_text = f"[Error generating response]: {e}"
+            chat = Chat.objects.get(id=chat_id, participants=user)
+        except Chat.DoesNotExist:
+            return Response({"error": "Chat not found."}, status=404)
 
-        bot_user, _ = User.objects.get_or_create(username='chatbot')
-        chat.participants.add(bot_user)
-        bot_msg = Message.objects.create(chat=chat, sender=bot_user, content=reply_text)
+        # Held until the stream ends; shares replayed results with ChatRespondAPIView
+        lock = turn_lock(request, request.data, chat, "respond", user, message)
+        replayed = lock.claim()
+        if replayed is not None:
+            return sse_response(replayed_events(replayed))
 
-        return Response({
-            "user": UserSerializer(user).data,
-            "user_message": message,
-            "bot_response": MessageSerializer(bot_msg).data
-        }, status=200)
+        try:
+            events = prime_events(stream_response_from_chat(chat, user, message))
+        except BaseException:
+            lock.release()
+            raise
+
+        def event_stream():
+            try:
+                for event, payload in events:
+                    if event == "token":
+                        yield sse_event("token", {"token": payload})
+                    elif event == "done":
+                        data = respond_payload(user, message, payload)
+                        lock.finish(data)
+                        yield sse_event("done", data)
+                    else:
+                        yield sse_event("error", {"error": payload})
+            finally:
+                lock.release()
+
+        return sse_response(event_stream())
 
 
 # # Smart AI chat logic endpoint
@@ -182,20 +286,21 @@ def chat_with_assistant(request, chat_id):
     # Get the chat ensuring user is a participant
     chat = get_object_or_404(Chat, id=chat_id, participants=user)
 
-    try:
-        # Call your AI logic function (returns reply and updated chat text)
+    def respond():
+        # Call your AI logic function (saves the turn, returns reply and updated chat text)
         reply, chat_log = generate_response_from_chat(chat, user, user_input)
-
-        # Ensure chatbot user is participant and save messages (already done in ai_logic)
-        bot_user, _ = User.objects.get_or_create(username="chatbot")
-        if bot_user not in chat.participants.all():
-            chat.participants.add(bot_user)
-
-        # Return AI reply and chat log
-        return Response({
+        return {
             "reply": reply,
             "chat_log": chat_log,
-        }, status=status.HTTP_200_OK)
+        }
+
+    # One turn at a time per chat; a resubmitted turn gets the first response
+    lock = turn_lock(request, request.data, chat, "bot", user, user_input)
+    try:
+        # Return AI reply and chat log
+        return Response(lock.run(respond), status=status.HTTP_200_OK)
+    except (LLMBusy, TurnInProgress):
+        raise
     except Exception as e:
         return Response({"error": f"AI logic error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
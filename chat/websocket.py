@@ -0,0 +1,190 @@
+"""
+WebSocket endpoint for chats, served by the ASGI application (myproject/asgi.py).
+
+Clients connect to /ws/chats/<chat_id>/ with a SimpleJWT access token, either
+in an `Authorization: JWT <token>` header or, since browsers can't set
+headers on a WebSocket, as `?token=<token>`. Only the chat's participants are
+accepted; other connections are rejected during the handshake (HTTP 403).
+
+Frames are JSON objects with a "type". The client sends:
+
+    {"type": "message", "message": "...", "idempotency_key": "..."}   a chat turn
+    {"type": "ping"}
+
+and receives:
+
+    {"type": "token", "token": "..."}     reply tokens as they stream (every participant)
+    {"type": "message", "message": {...}} each new Message, as MessageSerializer (every participant)
+    {"type": "done", ...}                 the sender's turn was saved; same body as /api/chat-respond/
+    {"type": "error", "error": "..."}
+    {"type": "busy", "detail": "...", "retry_after": 5}
+    {"type": "pong"}
+
+Turns take the chat's turn lock like the HTTP endpoints (chat/turns.py), so a
+message sent while the assistant is still answering gets "busy". Closing the
+socket cancels its running turn, as closing an SSE stream does. Events reach
+the chat's other sockets through the broker in chat/realtime.py.
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from api.metrics import gauge
+from chat.ai_logic import astream_response_from_chat
+from chat.limiter import LLMBusy
+from chat.models import Chat
+from chat.realtime import chat_group, get_broker
+from chat.turns import TurnInProgress, make_turn_lock
+from chat.views import respond_payload
+from users.authentication import StatelessJWTAuthentication
+
+CHAT_SOCKET_PATH = re.compile(r"^/ws/chats/(?P<chat_id>\d+)/?$")
+
+jwt_authentication = StatelessJWTAuthentication()
+
+open_sockets = gauge("chat_websockets_open", "Open chat WebSocket connections.")
+
+
+def raw_token(scope):
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            return jwt_authentication.get_raw_token(value)
+    token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+    return token[0].encode("utf-8") if token else None
+
+
+def authenticate(scope):
+    """Return the user for the connection's JWT access token, or None."""
+    token = raw_token(scope)
+    if token is None:
+        return None
+    try:
+        return jwt_authentication.get_user(jwt_authentication.get_validated_token(token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def busy_event(exc):
+    return {"type": "busy", "detail": str(exc.detail), "retry_after": int(exc.wait)}
+
+
+class ChatSocket:
+    """One accepted connection to one chat."""
+
+    def __init__(self, send, user, chat):
+        self.send = send
+        self.user = user
+        self.chat = chat
+        self.subscription = None
+        self.turns = set()
+
+    def push(self, event):
+        # Queued behind the broker's events, so the socket sees them in order.
+        self.subscription.deliver(event)
+
+    async def serve(self, receive):
+        self.subscription = get_broker().subscribe(chat_group(self.chat.id))
+        writer = asyncio.create_task(self.forward())
+        open_sockets.inc()
+        try:
+            while True:
+                event = await receive()
+                if event["type"] == "websocket.disconnect":
+                    return
+                if event["type"] == "websocket.receive":
+                    self.handle(event.get("text") or event.get("bytes") or "")
+        finally:
+            for turn in self.turns:
+                turn.cancel()
+            self.subscription.close()
+            await asyncio.gather(writer, *self.turns, return_exceptions=True)
+            open_sockets.dec()
+
+    async def forward(self):
+        """The socket's only writer: sends queued events until the subscription closes."""
+        while (event := await self.subscription.get()) is not None:
+            await self.send({"type": "websocket.send", "text": json.dumps(event)})
+        if self.subscription.lagged:
+            await self.send({"type": "websocket.close", "code": 1013})  # try again later
+
+    def handle(self, text):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            self.push({"type": "error", "error": "Frames must be JSON objects."})
+            return
+
+        if data.get("type") == "ping":
+            self.push({"type": "pong"})
+        elif data.get("type") == "message":
+            message = data.get("message")
+            if not isinstance(message, str) or not message.strip():
+                self.push({"type": "error", "error": "No message provided."})
+                return
+            turn = asyncio.create_task(self.run_turn(message.strip(), data.get("idempotency_key")))
+            self.turns.add(turn)
+            turn.add_done_callback(self.turns.discard)
+        else:
+            self.push({"type": "error", "error": f"Unknown frame type {data.get('type')!r}."})
+
+    async def run_turn(self, message, client_key):
+        # The summary and its checkpoint move on between turns; don't use the connect-time copy.
+        chat = await Chat.objects.filter(id=self.chat.id).afirst()
+        if chat is None:
+            self.push({"type": "error", "error": "Chat not found."})
+            return
+        lock = make_turn_lock(chat, "respond", self.user, message, client_key)
+        try:
+            replayed = await lock.aclaim()
+        except TurnInProgress as exc:
+            self.push(busy_event(exc))
+            return
+        if replayed is not None:
+            self.push({"type": "done", **replayed})
+            return
+
+        broker = get_broker()
+        group = chat_group(self.chat.id)
+        try:
+            async for event, payload in astream_response_from_chat(chat, self.user, message):
+                if event == "token":
+                    broker.publish(group, {"type": "token", "token": payload})
+                elif event == "done":
+                    data = respond_payload(self.user, message, payload)
+                    await lock.afinish(data)
+                    self.push({"type": "done", **data})
+                else:
+                    self.push({"type": "error", "error": payload})
+        except LLMBusy as exc:
+            self.push(busy_event(exc))
+        finally:
+            await lock.arelease()
+            await sync_to_async(close_old_connections)()
+
+
+async def chat_socket_application(scope, receive, send):
+    """Raw ASGI application for chat WebSockets."""
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    match = CHAT_SOCKET_PATH.match(scope["path"])
+    user = chat = None
+    if match is not None:
+        user = await sync_to_async(authenticate)(scope)
+        if user is not None:
+            chat = await Chat.objects.filter(id=int(match["chat_id"]), participants=user).afirst()
+        await sync_to_async(close_old_connections)()
+    if chat is None:
+        await send({"type": "websocket.close", "code": 1008})
+        return
+
+    await send({"type": "websocket.accept"})
+    await ChatSocket(send, user, chat).serve(receive)
@@ -5,6 +5,30 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Running under ASGI
+------------------
+The async chatbot endpoints (/api/chat-respond/async/,
+/api/chat-respond/stream/async/ and /api/bot/<chat_id>/async/) only pay off
+when served by an ASGI server. A single uvicorn worker can keep hundreds of LLM
+calls in flight:
+
+    uvicorn myproject.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers 1 --timeout-keep-alive 75
+
+Add workers (one per core) for CPU-bound work such as password hashing. The
+sync endpoints still work under ASGI, but each one runs in a thread and holds
+it for the whole request. Serve static files with whitenoise as under WSGI.
+
+The same application serves the chat WebSockets at /ws/chats/<chat_id>/
+(see chat/websocket.py); uvicorn needs the `websockets` package for them.
+Their fan-out is in-process by default, so keep to one worker while
+CHAT_REALTIME_BROKER is chat.realtime.InProcessBroker.
+
+Compare both modes with:
+
+    python manage.py chat_loadtest --email coach@example.com \
+        --concurrency 50 --requests 200 --mode both
 """
 
 import os
@@ -13,4 +37,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from chat.llm import start_warmup  # noqa: E402  (needs the app registry)
+from chat.websocket import chat_socket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """Chat WebSockets go to chat/websocket.py, everything else to Django."""
+    if scope["type"] == "websocket":
+        return await chat_socket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
+
+
+start_warmup()
@@ -1,8 +1,10 @@
 import os
+import sys
 from pathlib import Path
 from decouple import config, Csv
 from dotenv import load_dotenv
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,6 +32,7 @@ CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', default=FRONTEND_URL, cast
 # SECURITY
 SECRET_KEY = config('SECRET_KEY')
 DEBUG = config('DEBUG', default=False, cast=bool)
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
 # ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='127.0.0.1,localhost,.vercel.app', cast=Csv())
 ALLOWED_HOSTS = ['*']
 
@@ -49,6 +52,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',  # BLACKLIST_AFTER_ROTATION; rotation needs it
     'corsheaders',
     'drf_yasg',
 
@@ -125,10 +129,203 @@ DJOSER = {
 
 
 # AI Configurations
-AI_API_URL = "http://localhost:11434/api/generate"
-AI_MODEL_NAME = "llama3"
+# Ollama server and model for the default LLM profile
+AI_API_URL = config('AI_API_URL', default='http://localhost:11434')
+AI_MODEL_NAME = config('AI_MODEL_NAME', default='llama3.2:3b')
 AI_STREAMING = False
 
+# LLM backends (see chat/llm.py). A profile names a backend class, a model and
+# HTTP options. Users are routed by User.llm_profile, or LLM_DEFAULT_PROFILE.
+OLLAMA_OPTIONS = {
+    'temperature': 0.7,
+    'top_k': 40,
+    'top_p': 0.9,
+    'repeat_penalty': 1.1,
+    'num_ctx': 4096,
+    # How long Ollama keeps the model loaded after a request (e.g. 30m, 2h)
+    'keep_alive': config('OLLAMA_KEEP_ALIVE', default='30m'),
+}
+LLM_PROFILES = {
+    'default': {
+        'BACKEND': 'chat.llm.OllamaBackend',
+        'BASE_URL': AI_API_URL,
+        'MODEL': AI_MODEL_NAME,
+        'TIMEOUT': config('LLM_TIMEOUT', default=120, cast=float),
+        'OPTIONS': OLLAMA_OPTIONS,
+    },
+    'fast': {
+        'BACKEND': 'chat.llm.OllamaBackend',
+        'BASE_URL': AI_API_URL,
+        'MODEL': config('LLM_FAST_MODEL', default='llama3.2:1b'),
+        'TIMEOUT': config('LLM_FAST_TIMEOUT', default=60, cast=float),
+        'OPTIONS': OLLAMA_OPTIONS,
+    },
+    'openai': {
+        'BACKEND': 'chat.llm.OpenAIBackend',
+        'BASE_URL': config('OPENAI_BASE_URL', default='https://api.openai.com/v1'),
+        'API_KEY': OPENAI_API_KEY,
+        'MODEL': config('OPENAI_MODEL', default='gpt-4o-mini'),
+        'TIMEOUT': config('OPENAI_TIMEOUT', default=60, cast=float),
+        'OPTIONS': {'temperature': 0.7},
+    },
+    'fake': {
+        'BACKEND': 'chat.llm.FakeBackend',
+        'RESPONSES': ['This is a canned reply from the fake LLM backend.'],
+    },
+}
+LLM_DEFAULT_PROFILE = config('LLM_DEFAULT_PROFILE', default='default')
+
+# Load these profiles' models when the server starts, and again every
+# LLM_WARMUP_INTERVAL seconds (0 = only at start). See `manage.py llm_warmup`.
+LLM_WARMUP_ON_START = config('LLM_WARMUP_ON_START', default=False, cast=bool)
+LLM_WARMUP_INTERVAL = config('LLM_WARMUP_INTERVAL', default=0, cast=float)
+LLM_WARMUP_PROFILES = config('LLM_WARMUP_PROFILES', default='default', cast=Csv())
+
+# LLM concurrency limit (see chat/limiter.py). Requests beyond the queue get a
+# 503 with Retry-After. Set LLM_LIMIT_LOCK_DIR to share the cap across processes.
+LLM_MAX_IN_FLIGHT = config('LLM_MAX_IN_FLIGHT', default=4, cast=int)
+LLM_MAX_QUEUE = config('LLM_MAX_QUEUE', default=16, cast=int)
+LLM_QUEUE_TIMEOUT = config('LLM_QUEUE_TIMEOUT', default=30, cast=float)
+LLM_RETRY_AFTER_SECONDS = config('LLM_RETRY_AFTER_SECONDS', default=10, cast=int)
+LLM_LIMIT_LOCK_DIR = config('LLM_LIMIT_LOCK_DIR', default='')
+
+# LLM circuit breaker (see chat/breaker.py). While open, chat turns are answered
+# by chat/fallback.py instead of waiting on a dead backend.
+LLM_BREAKER_FAILURES = config('LLM_BREAKER_FAILURES', default=5, cast=int)
+LLM_BREAKER_SLOW_CALL_SECONDS = config('LLM_BREAKER_SLOW_CALL_SECONDS', default=60, cast=float)
+LLM_BREAKER_RESET_SECONDS = config('LLM_BREAKER_RESET_SECONDS', default=30, cast=float)
+LLM_BREAKER_HALF_OPEN_PROBES = config('LLM_BREAKER_HALF_OPEN_PROBES', default=1, cast=int)
+
+# Token required to scrape /metrics (empty = open)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Logging. The chat app logs one line per chat turn with its stage timings and
+# token counts (chat/instrumentation.py); set CHAT_LOG_LEVEL=WARNING to silence them.
+# The users app logs email outbox failures (users/outbox.py).
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['console'],
+            'level': config('CHAT_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+        'users': {
+            'handlers': ['console'],
+            'level': config('USERS_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Caches. "chat_responses" holds the opt-in chatbot reply cache
+# (see chat/response_cache.py); locmem evicts least recently used entries.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+    },
+    # OTP codes and request counts (see users/otp.py). The database cache is
+    # shared by all workers on one box; use Redis/Memcached across boxes.
+    'otp': {
+        'BACKEND': config('OTP_CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('OTP_CACHE_LOCATION', default='otp_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('OTP_CACHE_MAX_ENTRIES', default=100000, cast=int),
+        },
+    },
+    # Login and OTP throttle windows (see users/throttling.py). In memory, so a
+    # rejected attempt costs no query; counts are per worker process unless
+    # this points at Redis/Memcached.
+    'throttle': {
+        'BACKEND': config('THROTTLE_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('THROTTLE_CACHE_LOCATION', default='auth-throttle'),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('THROTTLE_CACHE_MAX_ENTRIES', default=100000, cast=int),
+        },
+    },
+    'chat_responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chat-responses',
+        'TIMEOUT': config('CHAT_RESPONSE_CACHE_TTL', default=3600, cast=int),
+        'OPTIONS': {
+            'MAX_ENTRIES': config('CHAT_RESPONSE_CACHE_MAX_ENTRIES', default=1000, cast=int),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+CHAT_RESPONSE_CACHE_ENABLED = config('CHAT_RESPONSE_CACHE_ENABLED', default=False, cast=bool)
+CHAT_RESPONSE_CACHE_TTL = config('CHAT_RESPONSE_CACHE_TTL', default=3600, cast=int)
+
+# Semantic reply cache (see chat/semantic_cache.py)
+CHAT_SEMANTIC_CACHE_ENABLED = config('CHAT_SEMANTIC_CACHE_ENABLED', default=False, cast=bool)
+CHAT_SEMANTIC_CACHE_EMBEDDER = config('CHAT_SEMANTIC_CACHE_EMBEDDER', default='chat.semantic_cache.OllamaEmbedder')
+CHAT_SEMANTIC_CACHE_EMBED_MODEL = config('CHAT_SEMANTIC_CACHE_EMBED_MODEL', default='nomic-embed-text')
+CHAT_SEMANTIC_CACHE_EMBED_URL = config('CHAT_SEMANTIC_CACHE_EMBED_URL', default='http://localhost:11434')
+CHAT_SEMANTIC_CACHE_THRESHOLD = config('CHAT_SEMANTIC_CACHE_THRESHOLD', default=0.92, cast=float)
+CHAT_SEMANTIC_CACHE_MAX_ENTRIES = config('CHAT_SEMANTIC_CACHE_MAX_ENTRIES', default=20000, cast=int)
+CHAT_SEMANTIC_CACHE_TTL = config('CHAT_SEMANTIC_CACHE_TTL', default=7 * 24 * 3600, cast=int)
+CHAT_SEMANTIC_CACHE_DIR = config('CHAT_SEMANTIC_CACHE_DIR', default=os.path.join(BASE_DIR, 'var', 'semantic_cache'))
+CHAT_SEMANTIC_CACHE_SAVE_EVERY = config('CHAT_SEMANTIC_CACHE_SAVE_EVERY', default=20, cast=int)
+CHAT_SEMANTIC_CACHE_MAX_SCOPES = config('CHAT_SEMANTIC_CACHE_MAX_SCOPES', default=64, cast=int)
+
+# Retrieval of notes from the coach's plans and earlier chats into the prompt
+# (see chat/retrieval.py). Backfill with `manage.py ai_jobs context`.
+CHAT_RETRIEVAL_ENABLED = config('CHAT_RETRIEVAL_ENABLED', default=False, cast=bool)
+CHAT_RETRIEVAL_EMBEDDER = config('CHAT_RETRIEVAL_EMBEDDER', default=CHAT_SEMANTIC_CACHE_EMBEDDER)
+CHAT_RETRIEVAL_TOP_K = config('CHAT_RETRIEVAL_TOP_K', default=4, cast=int)
+CHAT_RETRIEVAL_TOKEN_BUDGET = config('CHAT_RETRIEVAL_TOKEN_BUDGET', default=400, cast=int)
+CHAT_RETRIEVAL_MIN_SIMILARITY = config('CHAT_RETRIEVAL_MIN_SIMILARITY', default=0.35, cast=float)
+CHAT_RETRIEVAL_CACHE_TTL = config('CHAT_RETRIEVAL_CACHE_TTL', default=3600, cast=int)
+CHAT_RETRIEVAL_ASYNC = config('CHAT_RETRIEVAL_ASYNC', default=True, cast=bool)
+
+# Chat WebSockets (see chat/websocket.py and chat/realtime.py). The default
+# broker only fans out within one process; events beyond QUEUE_SIZE waiting
+# for a slow socket get it disconnected.
+CHAT_REALTIME_BROKER = config('CHAT_REALTIME_BROKER', default='chat.realtime.InProcessBroker')
+CHAT_REALTIME_QUEUE_SIZE = config('CHAT_REALTIME_QUEUE_SIZE', default=1000, cast=int)
+
+# Per-user system prompt cache (see chat/prompts.py). About saves invalidate it
+# in the saving process; the TTL bounds staleness for other workers on locmem.
+CHAT_SYSTEM_PROMPT_CACHE_TTL = config('CHAT_SYSTEM_PROMPT_CACHE_TTL', default=300, cast=int)
+
+# Chat prompt context window (see chat/context.py); keep the budget below num_ctx
+# so there is room left for the reply.
+CHAT_CONTEXT_TOKEN_BUDGET = config('CHAT_CONTEXT_TOKEN_BUDGET', default=3072, cast=int)
+CHAT_CONTEXT_MAX_MESSAGES = config('CHAT_CONTEXT_MAX_MESSAGES', default=50, cast=int)
+CHAT_CONTEXT_CHARS_PER_TOKEN = config('CHAT_CONTEXT_CHARS_PER_TOKEN', default=4, cast=int)
+CHAT_CONTEXT_INCLUDE_SUMMARY = config('CHAT_CONTEXT_INCLUDE_SUMMARY', default=True, cast=bool)
+
+# Background topic summaries (see chat/summarizer.py)
+CHAT_SUMMARY_ASYNC = config('CHAT_SUMMARY_ASYNC', default=True, cast=bool)
+CHAT_SUMMARY_WORKERS = config('CHAT_SUMMARY_WORKERS', default=2, cast=int)
+CHAT_SUMMARY_MIN_NEW_MESSAGES = config('CHAT_SUMMARY_MIN_NEW_MESSAGES', default=6, cast=int)
+CHAT_SUMMARY_IDLE_SECONDS = config('CHAT_SUMMARY_IDLE_SECONDS', default=60, cast=float)
+CHAT_SUMMARY_MAX_NEW_MESSAGES = config('CHAT_SUMMARY_MAX_NEW_MESSAGES', default=20, cast=int)
+CHAT_SUMMARY_LLM_PROFILE = config('CHAT_SUMMARY_LLM_PROFILE', default='')  # empty = LLM_DEFAULT_PROFILE
+
+# Batched background AI jobs (chat/jobs.py, `manage.py ai_jobs`): summary
+# backfills and plan titles. AI_JOBS_RATE caps LLM calls per second (0 = no cap).
+AI_JOBS_CONCURRENCY = config('AI_JOBS_CONCURRENCY', default=2, cast=int)
+AI_JOBS_BATCH_SIZE = config('AI_JOBS_BATCH_SIZE', default=20, cast=int)
+AI_JOBS_RATE = config('AI_JOBS_RATE', default=1.0, cast=float)
+AI_JOBS_LLM_PROFILE = config('AI_JOBS_LLM_PROFILE', default='')  # empty = CHAT_SUMMARY_LLM_PROFILE
+AI_JOBS_STATE_DIR = config('AI_JOBS_STATE_DIR', default=os.path.join(BASE_DIR, 'var', 'ai_jobs'))
+
+# One turn at a time per chat (see chat/turns.py). A different message waits up
+# to CHAT_TURN_QUEUE_TIMEOUT seconds (0 = reject with 409 straight away).
+CHAT_TURN_LOCK_TTL = config('CHAT_TURN_LOCK_TTL', default=300, cast=int)
+CHAT_TURN_QUEUE_TIMEOUT = config('CHAT_TURN_QUEUE_TIMEOUT', default=0, cast=float)
+CHAT_TURN_RESULT_TTL = config('CHAT_TURN_RESULT_TTL', default=600, cast=int)
+
 
 # JWT settings
 REST_USE_JWT = True
@@ -139,20 +336,45 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=5),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Refreshed tokens get the user's current claims (see users/authentication.py)
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.ClaimsTokenRefreshSerializer',
 }
 
+# Access tokens carry the user's claims (see users/authentication.py). Every
+# JWT_USER_CHECK_TTL seconds, per user, the DB is checked for deactivated or
+# deleted users and changed claims; 0 trusts tokens until they expire.
+JWT_USER_CHECK_TTL = config('JWT_USER_CHECK_TTL', default=60, cast=int)
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.StatelessJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',
     ),
 }
 
+# Login and OTP throttles (see users/throttling.py), checked before any
+# password hashing or DB access. Rates are "<count>/<s|min|hour|day>"; an empty
+# rate turns that throttle off. ip_email resets after a successful attempt.
+AUTH_THROTTLE_RATES = {
+    'ip': config('AUTH_THROTTLE_IP_RATE', default='120/min'),
+    'email': config('AUTH_THROTTLE_EMAIL_RATE', default='50/hour'),
+    'ip_email': config('AUTH_THROTTLE_IP_EMAIL_RATE', default='10/hour'),
+}
+AUTH_THROTTLE_CACHE_ALIAS = config('AUTH_THROTTLE_CACHE_ALIAS', default='throttle')
+
+# One-time passwords (see users/otp.py): codes last OTP_TTL seconds and allow
+# OTP_MAX_ATTEMPTS guesses; OTP_RATE_LIMIT requests per email per OTP_RATE_WINDOW.
+OTP_STORE = config('OTP_STORE', default='users.otp.CacheOTPStore')
+OTP_CACHE_ALIAS = config('OTP_CACHE_ALIAS', default='otp')
+OTP_TTL = config('OTP_TTL', default=60, cast=int)
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+OTP_RATE_LIMIT = config('OTP_RATE_LIMIT', default=5, cast=int)
+OTP_RATE_WINDOW = config('OTP_RATE_WINDOW', default=3600, cast=int)
+
 # Email settings
 EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
 EMAIL_HOST = config('EMAIL_HOST', default='')
@@ -161,6 +383,16 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 
+# Email outbox (see users/outbox.py). With EMAIL_OUTBOX_THREAD off, run
+# `manage.py send_emails` as a worker instead.
+EMAIL_OUTBOX_THREAD = config('EMAIL_OUTBOX_THREAD', default=True, cast=bool)
+EMAIL_OUTBOX_BATCH_SIZE = config('EMAIL_OUTBOX_BATCH_SIZE', default=50, cast=int)
+EMAIL_OUTBOX_POLL_INTERVAL = config('EMAIL_OUTBOX_POLL_INTERVAL', default=5, cast=float)
+EMAIL_OUTBOX_LEASE = config('EMAIL_OUTBOX_LEASE', default=120, cast=int)
+EMAIL_OUTBOX_BACKOFF = config('EMAIL_OUTBOX_BACKOFF', default=10, cast=float)
+EMAIL_OUTBOX_MAX_BACKOFF = config('EMAIL_OUTBOX_MAX_BACKOFF', default=3600, cast=float)
+EMAIL_OUTBOX_MAX_ATTEMPTS = config('EMAIL_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+
 # Site and WSGI
 SITE_ID = 1
 ROOT_URLCONF = 'myproject.urls'
@@ -213,6 +445,37 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',},
 ]
 
+# Password hashing (see users/hashers.py). PASSWORD_HASH_POLICY picks the
+# hasher for new passwords; the others still verify existing hashes, which are
+# rehashed with the policy's hasher and cost on the next successful login.
+# "fast" (MD5, for tests and local development) is refused outside DEBUG/tests.
+# `manage.py password_bench` times each hasher on this box.
+PASSWORD_HASH_POLICY = config('PASSWORD_HASH_POLICY', default='fast' if TESTING else 'pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=1_000_000, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=102400, cast=int)  # KiB
+PASSWORD_ARGON2_PARALLELISM = config('PASSWORD_ARGON2_PARALLELISM', default=8, cast=int)
+_PASSWORD_VERIFIERS = [
+    'users.hashers.PBKDF2PasswordHasher',
+    'users.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_POLICIES = {
+    'pbkdf2': _PASSWORD_VERIFIERS,
+    'argon2': [  # needs argon2-cffi
+        'users.hashers.Argon2PasswordHasher',
+        *[hasher for hasher in _PASSWORD_VERIFIERS if hasher != 'users.hashers.Argon2PasswordHasher'],
+    ],
+    'fast': ['django.contrib.auth.hashers.MD5PasswordHasher', *_PASSWORD_VERIFIERS],
+}
+if PASSWORD_HASH_POLICY not in PASSWORD_HASH_POLICIES:
+    raise ImproperlyConfigured(f"Unknown PASSWORD_HASH_POLICY {PASSWORD_HASH_POLICY!r}")
+if PASSWORD_HASH_POLICY == 'fast' and not (DEBUG or TESTING):
+    raise ImproperlyConfigured("PASSWORD_HASH_POLICY 'fast' is only for DEBUG and tests")
+PASSWORD_HASHERS = PASSWORD_HASH_POLICIES[PASSWORD_HASH_POLICY]
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Asia/Dhaka'
@@ -5,6 +5,7 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from django.conf import settings 
 from django.conf.urls.static import static  
+from api.views import metrics_view
 
 schema_view = get_schema_view(
    openapi.Info(
@@ -26,6 +27,9 @@ urlpatterns = [
     # API App
     path('api/', include('api.urls')),
 
+    # Prometheus metrics
+    path('metrics', metrics_view, name='metrics'),
+
     # Auth using Djoser with JWT
     path('api/', include('djoser.urls')),
     path('api/jwt/', include('djoser.urls.jwt')),  # OR use .authtoken if not using JWT
@@ -7,4 +7,8 @@ os.environ.setdefault(
     config('DJANGO_SETTINGS_MODULE', default='myproject.settings')
 )
 
-app = get_wsgi_application()
\ No newline at end of file
+app = get_wsgi_application()
+
+from chat.llm import start_warmup  # noqa: E402  (needs the app registry)
+
+start_warmup()
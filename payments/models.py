@@ -2,6 +2,8 @@
 from django.db import models
 from django.conf import settings
 
+FREE_MAX_PLANS = 10
+
 class Subscription(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
@@ -12,7 +14,29 @@ class Subscription(models.Model):
     stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
     is_active = models.BooleanField(default=False)
     current_period_end = models.DateTimeField(blank=True, null=True)
-    max_plans = models.IntegerField(default=10)
+    max_plans = models.IntegerField(default=FREE_MAX_PLANS)
 
     def __str__(self):
         return f"Subscription for {self.user.email}"
+
+
+def plan_limit_from(max_plans):
+    """(tier, max_plans) given the max_plans of the user's active subscription, or None without one."""
+    if max_plans is None:
+        return "free", FREE_MAX_PLANS
+    return "pro", max_plans
+
+
+def plan_limit_for(user_id):
+    """(tier, max_plans) for a user: "pro" with an active subscription, else "free"."""
+    return plan_limit_from(
+        Subscription.objects.filter(user_id=user_id, is_active=True).values_list("max_plans", flat=True).first()
+    )
+
+
+def plan_limit(user):
+    """How many plans `user` may have, from its access token's claims when it has them."""
+    claims = getattr(user, "token_claims", None)
+    if claims and claims.get("max_plans") is not None:
+        return claims["max_plans"]
+    return plan_limit_for(user.id)[1]
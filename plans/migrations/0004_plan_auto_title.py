@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0003_plan_chat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='auto_title_message_id',
+            field=models.BigIntegerField(blank=True, help_text='Id of the newest chat message the generated title reflects; empty once the user sets a title.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='plan',
+            name='title',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -15,7 +15,12 @@ class Plan(models.Model):
     )
     chat = models.OneToOneField(Chat, on_delete=models.CASCADE, null=True, blank=True, related_name='plan')
 
-    title = models.CharField(max_length=100)
+    title = models.CharField(max_length=100, blank=True)
+    auto_title_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text='Id of the newest chat message the generated title reflects; empty once the user sets a title.'
+    )
     description = models.TextField(blank=True, null=True)
     plan_type = models.CharField(max_length=10, choices=PLAN_TYPE_CHOICES, default='chat')
     date = models.DateField(blank=True, null=True)
@@ -18,16 +18,11 @@ class PlanSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'chat']
 
-    def validate(self, data):
-        user = self.context['request'].user
-        current_plan_count = Plan.objects.filter(user=user).count()
-        subscription = getattr(user, 'subscription', None)
-
-        max_allowed = subscription.max_plans if subscription and subscription.is_active else 10
-        if current_plan_count >= max_allowed:
-            raise serializers.ValidationError("You have reached your plan limit. Upgrade your subscription to create more.")
-
-        return data
+    def update(self, instance, validated_data):
+        # A title the user picks is never replaced by a generated one.
+        if 'title' in validated_data and validated_data['title'] != instance.title:
+            instance.auto_title_message_id = None
+        return super().update(instance, validated_data)
 
     def create(self, validated_data):
         user = self.context['request'].user
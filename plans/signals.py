@@ -2,6 +2,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import Plan
 from chat.models import Chat
+from chat.retrieval import schedule_index
 
 @receiver(post_save, sender=Plan)
 def create_chat_for_plan(sender, instance, created, **kwargs):
@@ -9,3 +10,8 @@ def create_chat_for_plan(sender, instance, created, **kwargs):
         chat = Chat.objects.create()
         instance.chat = chat
         instance.save()
+
+
+@receiver(post_save, sender=Plan)
+def index_plan_for_retrieval(sender, instance, **kwargs):
+    schedule_index("plan", instance.id)
@@ -5,6 +5,7 @@ from django.db import transaction
 from .models import Plan
 from .serializers import PlanSerializer
 from chat.models import Chat
+from payments.models import plan_limit
 
 class PlanListCreateView(generics.ListCreateAPIView):
     serializer_class = PlanSerializer
@@ -27,8 +28,7 @@ class PlanListCreateView(generics.ListCreateAPIView):
     def perform_create(self, serializer):
         user = self.request.user
         plan_count = Plan.objects.filter(user=user).count()
-        subscription = getattr(user, 'subscription', None)
-        max_plans = subscription.max_plans if subscription and subscription.is_active else 10
+        max_plans = plan_limit(user)
 
         if plan_count >= max_plans:
             raise ValidationError("Plan limit reached. Please upgrade your subscription.")
@@ -1,5 +1,15 @@
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
 
 User = get_user_model()
 
@@ -13,3 +23,116 @@ class EmailBackend(ModelBackend):
         if user.check_password(password):
             return user
         return None
+
+
+# Stateless JWT authentication
+#
+# Access tokens from CustomTokenObtainPairSerializer (and LoginView) carry the
+# user fields below as claims. StatelessJWTAuthentication builds request.user
+# from them with User.from_db(), so authenticating runs no user query; any
+# other field is loaded on first access, as for a deferred field. Claims are
+# read from the DB at login and again whenever the refresh token is used
+# (ClaimsTokenRefreshSerializer), and tokens carry a hash of them.
+#
+# Revocation: with JWT_USER_CHECK_TTL > 0, the user's state (whether it still
+# exists and is active, its password for SIMPLE_JWT CHECK_REVOKE_TOKEN, and a
+# hash of its current claims) is read from the default cache, refreshed from the DB at
+# most every JWT_USER_CHECK_TTL seconds per user. Saving a user or its
+# subscription drops its entry. A token whose claims no longer match, e.g.
+# after a demotion, a lapsed subscription or a new llm_profile, is rejected
+# and the client has to refresh it.
+
+CLAIM_FIELDS = ["email", "username", "is_staff", "is_superuser", "is_verified", "llm_profile"]
+USER_STATE_CACHE_KEY = "jwt-user-state:{}"
+
+
+def claims_hash(claims):
+    return hashlib.sha256(json.dumps(claims, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def add_user_claims(token, user):
+    """Embed the user's fields and plan limit into a (refresh or access) token."""
+    from payments.models import plan_limit_for
+
+    claims = {field: getattr(user, field) for field in CLAIM_FIELDS}
+    claims["tier"], claims["max_plans"] = plan_limit_for(user.id)
+    for name, value in claims.items():
+        token[name] = value
+    token["claims_hash"] = claims_hash(claims)
+    return token
+
+
+def invalidate_user_state(user_id):
+    cache.delete(USER_STATE_CACHE_KEY.format(user_id))
+
+
+def user_state(user_id):
+    """
+    (is_active, password hash, is_staff, is_superuser, claims hash) of the
+    user, or None if it was deleted; cached for JWT_USER_CHECK_TTL.
+    """
+    from payments.models import plan_limit_from
+
+    key = USER_STATE_CACHE_KEY.format(user_id)
+    state = cache.get(key)
+    if state is None:
+        row = (
+            User.objects.filter(id=user_id)
+            .values("is_active", "password", *CLAIM_FIELDS, "subscription__is_active", "subscription__max_plans")
+            .first()
+        )
+        if row is None:
+            state = ()
+        else:
+            claims = {field: row[field] for field in CLAIM_FIELDS}
+            claims["tier"], claims["max_plans"] = plan_limit_from(
+                row["subscription__max_plans"] if row["subscription__is_active"] else None
+            )
+            state = (
+                row["is_active"], get_md5_hash_password(row["password"]),
+                row["is_staff"], row["is_superuser"], claims_hash(claims),
+            )
+        cache.set(key, state, settings.JWT_USER_CHECK_TTL)
+    return state or None
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that trusts the user claims in the token instead of
+    loading the user. Tokens without them (issued before, or by djoser's
+    /api/jwt/create/) fall back to the DB lookup.
+    """
+
+    def get_user(self, validated_token):
+        if any(field not in validated_token for field in [*CLAIM_FIELDS, "claims_hash"]):
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        if settings.JWT_USER_CHECK_TTL:
+            self.check_revoked(user_id, validated_token)
+
+        values = {"id": user_id, "is_active": True, **{field: validated_token[field] for field in CLAIM_FIELDS}}
+        # from_db() takes the values in model field order.
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+        user = User.from_db("default", fields, [values[field] for field in fields])
+        user.token_claims = {"tier": validated_token.get("tier"), "max_plans": validated_token.get("max_plans")}
+        return user
+
+    def check_revoked(self, user_id, validated_token):
+        state = user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        is_active, password_hash, is_staff, is_superuser, current_claims_hash = state
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if jwt_settings.CHECK_REVOKE_TOKEN and validated_token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != password_hash:
+            raise AuthenticationFailed("The user's password has been changed.", code="password_changed")
+        if (
+            validated_token["is_staff"] != is_staff
+            or validated_token["is_superuser"] != is_superuser
+            or validated_token["claims_hash"] != current_claims_hash
+        ):
+            raise AuthenticationFailed("The user's details have changed; refresh the token.", code="claims_changed")
@@ -0,0 +1,55 @@
+"""
+Password hashers whose cost comes from settings.
+
+Hashing is most of a login's CPU time, so its cost is a per-environment
+setting (PASSWORD_HASH_POLICY and friends in settings.py) rather than
+whatever Django's release picked. These hashers keep Django's algorithm
+names, so existing hashes still verify, and report hashes made with another
+cost as needing an update. Django's check_password() then rehashes the
+password on the next successful login (ModelBackend, through
+User.check_password), which is how a cost change or a policy change reaches
+existing users.
+
+time_hasher() is what `manage.py password_bench` uses to size the cost.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with PASSWORD_PBKDF2_ITERATIONS iterations."""
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2id with the PASSWORD_ARGON2_* costs."""
+
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
+
+
+def time_hasher(hasher, rounds=5, password="correct horse battery staple"):
+    """Median seconds to hash `password` with `hasher`. Raises ValueError if its library is missing."""
+    if hasher.library:
+        hasher._load_library()  # fail before timing anything
+    timings = []
+    for _ in range(rounds):
+        salt = hasher.salt()
+        started = time.perf_counter()
+        hasher.encode(password, salt)
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
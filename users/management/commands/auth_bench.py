@@ -0,0 +1,76 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+User = get_user_model()
+
+ENDPOINTS = {
+    "login": "/api/login/",
+    "token": "/api/api/token/",
+    "verify-otp": "/api/verify-otp/",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU and DB cost of a failed login or OTP attempt, with the "
+        "throttles off and when a throttle rejects it. Uses (and then deletes) a "
+        "throwaway user in the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoint", action="append", dest="endpoints", choices=sorted(ENDPOINTS),
+            help="Endpoint to attack (repeatable; default: all).",
+        )
+        parser.add_argument("--attempts", type=int, default=50, help="Failed attempts per endpoint and mode.")
+
+    def handle(self, *args, **options):
+        name = f"auth-bench-{uuid.uuid4().hex[:8]}"
+        user = User.objects.create_user(email=f"{name}@example.invalid", username=name, password=uuid.uuid4().hex)
+        try:
+            for endpoint in options["endpoints"] or list(ENDPOINTS):
+                self.stdout.write(self.style.MIGRATE_HEADING(f"{endpoint} ({ENDPOINTS[endpoint]})"))
+                # Throttles off, then a 1/hour ip_email window with its one
+                # attempt spent, so every measured attempt is rejected.
+                with override_settings(AUTH_THROTTLE_RATES={}):
+                    unthrottled = self.attack(endpoint, user, options["attempts"])
+                with override_settings(AUTH_THROTTLE_RATES={"ip_email": "1/hour"}):
+                    self.attack(endpoint, user, 1)
+                    rejected = self.attack(endpoint, user, options["attempts"])
+                if set(rejected["statuses"]) != {429}:
+                    raise CommandError(f"{endpoint}: expected only 429s, got {sorted(set(rejected['statuses']))}")
+                self.report("not throttled", unthrottled)
+                self.report("rejected", rejected)
+                if rejected["cpu"]:
+                    self.stdout.write(f"  rejecting is {unthrottled['cpu'] / rejected['cpu']:.1f}x cheaper in CPU")
+        finally:
+            user.delete()
+
+    def attack(self, endpoint, user, attempts):
+        client = APIClient()
+        if endpoint == "verify-otp":
+            data = {"email": user.email, "otp": "000000"}
+        else:
+            data = {"email": user.email, "password": "not-the-password"}
+        cpu, queries, statuses = [], [], []
+        for _ in range(attempts):
+            started = time.process_time()
+            with CaptureQueriesContext(connection) as captured:
+                response = client.post(ENDPOINTS[endpoint], data, format="json")
+            cpu.append(time.process_time() - started)
+            queries.append(len(captured))
+            statuses.append(response.status_code)
+        return {"cpu": statistics.mean(cpu), "queries": statistics.mean(queries), "statuses": statuses}
+
+    def report(self, mode, stats):
+        self.stdout.write(
+            f"  {mode}: {stats['cpu'] * 1000:.3f} ms CPU per attempt, "
+            f"{stats['queries']:.1f} DB queries, statuses {sorted(set(stats['statuses']))}"
+        )
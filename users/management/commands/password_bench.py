@@ -0,0 +1,56 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from users.hashers import PBKDF2PasswordHasher, time_hasher
+
+
+def describe_cost(hasher):
+    if hasattr(hasher, "iterations"):
+        return f"{hasher.iterations} iterations"
+    if hasattr(hasher, "time_cost"):
+        return f"time {hasher.time_cost}, memory {hasher.memory_cost} KiB, parallelism {hasher.parallelism}"
+    if hasattr(hasher, "rounds"):
+        return f"{hasher.rounds} rounds"
+    if hasattr(hasher, "work_factor"):
+        return f"work factor {hasher.work_factor}"
+    return "-"
+
+
+class Command(BaseCommand):
+    help = (
+        "Time one password hash with each of PASSWORD_HASHERS on this box and "
+        "estimate how many logins per second it can verify. The first hasher is "
+        "the one new and rehashed passwords use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=5, help="Hashes per hasher; the median is reported.")
+        parser.add_argument("--cores", type=int, default=os.cpu_count(), help="Cores serving logins (default: all).")
+        parser.add_argument(
+            "--target-ms", type=float, default=250,
+            help="Suggest the PBKDF2 iterations for a hash of about this many milliseconds.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Policy {settings.PASSWORD_HASH_POLICY!r}, {options['cores']} cores")
+        for n, path in enumerate(dict.fromkeys(settings.PASSWORD_HASHERS)):
+            hasher = import_string(path)()
+            name = f"{hasher.algorithm}{' (preferred)' if n == 0 else ''}"
+            try:
+                seconds = time_hasher(hasher, rounds=options["rounds"])
+            except ValueError:
+                library = hasher.library[0] if isinstance(hasher.library, tuple) else hasher.library
+                self.stdout.write(self.style.WARNING(f"  {name}: library {library!r} not installed"))
+                continue
+            self.stdout.write(
+                f"  {name}: {seconds * 1000:.1f} ms per hash ({describe_cost(hasher)}), "
+                f"{1 / seconds:.1f} logins/s per core, {options['cores'] / seconds:.0f} logins/s in all"
+            )
+            if isinstance(hasher, PBKDF2PasswordHasher):
+                iterations = round(hasher.iterations * options["target_ms"] / 1000 / seconds, -4)
+                self.stdout.write(
+                    f"    PASSWORD_PBKDF2_ITERATIONS={iterations:.0f} for about {options['target_ms']:.0f} ms per hash"
+                )
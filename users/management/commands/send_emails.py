@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from users.models import OutboundEmail
+from users.outbox import flush
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued emails from the outbox, in batches over one SMTP connection, "
+        "retrying failures with backoff. Runs until stopped, or once with --once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Send the emails that are due, then exit.")
+        parser.add_argument(
+            "--interval", type=float, help="Seconds between polls (default: EMAIL_OUTBOX_POLL_INTERVAL)."
+        )
+        parser.add_argument("--limit", type=int, help="Stop after attempting this many emails.")
+
+    def handle(self, *args, **options):
+        interval = options["interval"] or settings.EMAIL_OUTBOX_POLL_INTERVAL
+        limit = options["limit"]
+        attempted = 0
+        try:
+            while True:
+                attempted += flush(limit=None if limit is None else limit - attempted)
+                if options["once"] or (limit is not None and attempted >= limit):
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+        counts = dict(
+            OutboundEmail.objects.exclude(status=OutboundEmail.SENT)
+            .values_list("status").annotate(count=Count("id")).order_by()
+        )
+        line = (
+            f"{attempted} attempted; {counts.get(OutboundEmail.PENDING, 0)} pending, "
+            f"{counts.get(OutboundEmail.FAILED, 0)} failed"
+        )
+        self.stdout.write(self.style.WARNING(line) if counts.get(OutboundEmail.FAILED) else self.style.SUCCESS(line))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='llm_profile',
+            field=models.CharField(blank=True, default='', help_text="LLM_PROFILES entry this user's chats run on (blank = default profile).", max_length=50),
+        ),
+    ]
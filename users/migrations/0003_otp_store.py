@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:15
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_tables(apps, schema_editor):
+    # OTP state moves to the `otp` cache, a database cache by default.
+    call_command("createcachetable", database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_llm_profile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_tables, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp_created_at',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp_request_count',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp_request_reset_time',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_outbound_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text='Not sent after this, e.g. when the OTP expires.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='body',
+            field=models.TextField(help_text='Cleared once sent or failed; it may hold one-time codes.'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 20:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_outbound_email_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='has_secrets',
+            field=models.BooleanField(default=False, help_text='The body is filled in at send time from the cache.'),
+        ),
+        migrations.AlterField(
+            model_name='outboundemail',
+            name='body',
+            field=models.TextField(help_text='Cleared once sent or failed. One-time codes are kept out of it, see has_secrets.'),
+        ),
+    ]
@@ -13,11 +13,13 @@ class User(AbstractUser):
     last_name = models.CharField(max_length=10, blank=True, null=True)
 
     email = models.EmailField(unique=True, blank=False)
-    otp = models.CharField(max_length=6, blank=True, null=True)
     is_verified = models.BooleanField(default=False)
-    otp_created_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
-    otp_request_count = models.IntegerField(default=0)
-    otp_request_reset_time = models.DateTimeField(blank=True, null=True)
+    llm_profile = models.CharField(
+        max_length=50,
+        blank=True,
+        default="",
+        help_text="LLM_PROFILES entry this user's chats run on (blank = default profile).",
+    )
 
     profile_picture = models.ImageField(
         upload_to=user_profile_upload_path,
@@ -30,3 +32,32 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.email
+
+
+class OutboundEmail(models.Model):
+    """An email waiting in, or sent from, the outbox (see users/outbox.py)."""
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField(help_text="Cleared once sent or failed. One-time codes are kept out of it, see has_secrets.")
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(null=True, blank=True, help_text="Not sent after this, e.g. when the OTP expires.")
+    has_secrets = models.BooleanField(default=False, help_text="The body is filled in at send time from the cache.")
+    claim = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='outbox_due')]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,117 @@
+"""
+One-time passwords for email verification.
+
+OTP state is kept out of the users table, in an OTP store picked with
+OTP_STORE. The default, CacheOTPStore, keeps it in the OTP_CACHE_ALIAS cache,
+where it expires on its own:
+
+- a code is stored only as an HMAC of the email and the code, for OTP_TTL
+  seconds, and is good for OTP_MAX_ATTEMPTS guesses;
+- requests are limited to OTP_RATE_LIMIT per email in a sliding window of
+  OTP_RATE_WINDOW seconds (see api/ratelimit.py).
+
+The `otp` cache is Django's database cache by default, which every worker
+on a box shares and which needs no other service. Point OTP_CACHE_BACKEND at
+Redis or Memcached when serving from several boxes, or for atomic counters.
+"""
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from api.ratelimit import SlidingWindow
+
+OTP_DIGITS = 6
+
+
+def generate_otp():
+    return f"{secrets.randbelow(10 ** OTP_DIGITS):0{OTP_DIGITS}d}"
+
+
+def hash_otp(email, code):
+    return salted_hmac("users.otp", f"{email.lower()}:{code}", algorithm="sha256").hexdigest()
+
+
+def email_key(email):
+    # Cache keys must stay short and safe for Memcached.
+    return hashlib.sha256(email.lower().encode("utf-8")).hexdigest()[:32]
+
+
+class OTPRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many OTP requests. Try again in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class CacheOTPStore:
+    """Keeps OTP hashes, guess counts and request counts in a Django cache."""
+
+    def __init__(self):
+        self.alias = settings.OTP_CACHE_ALIAS
+        self.requests = SlidingWindow(
+            "otp-requests", settings.OTP_RATE_LIMIT, settings.OTP_RATE_WINDOW, self.alias
+        )
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def allow_request(self, email):
+        """Count an OTP request; raises OTPRateLimited over the limit."""
+        allowed, retry_after = self.requests.hit(email_key(email))
+        if not allowed:
+            raise OTPRateLimited(retry_after)
+
+    def save(self, email, code_hash):
+        key = email_key(email)
+        # A new code replaces the old one and gets a fresh set of guesses.
+        self.cache.set_many({f"otp:{key}": code_hash, f"otp-attempts:{key}": 0}, settings.OTP_TTL)
+
+    def check(self, email, code_hash):
+        """Whether `code_hash` matches the stored code. A match, or the last allowed guess, uses the code up."""
+        key = email_key(email)
+        try:
+            attempts = self.cache.incr(f"otp-attempts:{key}")
+        except ValueError:
+            return False  # no code, or it expired
+        stored = self.cache.get(f"otp:{key}")
+        matched = stored is not None and attempts <= settings.OTP_MAX_ATTEMPTS and constant_time_compare(stored, code_hash)
+        if matched or attempts >= settings.OTP_MAX_ATTEMPTS:
+            self.cache.delete_many([f"otp:{key}", f"otp-attempts:{key}"])
+        return matched
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = import_string(settings.OTP_STORE)()
+    return _store
+
+
+def _reset_store(setting, **kwargs):
+    global _store
+    if setting.startswith("OTP_"):
+        _store = None
+
+
+setting_changed.connect(_reset_store)
+
+
+def issue_otp(email):
+    """Create and store a new OTP for `email` and return it. Raises OTPRateLimited."""
+    store = get_store()
+    store.allow_request(email)
+    code = generate_otp()
+    store.save(email, hash_otp(email, code))
+    return code
+
+
+def verify_otp(email, code):
+    return get_store().check(email, hash_otp(email, code))
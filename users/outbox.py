@@ -0,0 +1,255 @@
+"""
+Durable outbox for account emails (OTP codes and the like).
+
+Views don't talk to SMTP. enqueue_email() adds an OutboundEmail row in the
+caller's transaction, and the outbox worker sends it once that commits:
+
+- Due rows are claimed in batches of EMAIL_OUTBOX_BATCH_SIZE, with a lease of
+  EMAIL_OUTBOX_LEASE seconds, so several workers (threads or processes) can
+  share the outbox and rows of a crashed worker come back after the lease.
+- A batch is sent over one SMTP connection (get_connection()).
+- Failed sends are retried with exponential backoff, starting at
+  EMAIL_OUTBOX_BACKOFF seconds and capped at EMAIL_OUTBOX_MAX_BACKOFF, and are
+  marked failed after EMAIL_OUTBOX_MAX_ATTEMPTS attempts.
+- Emails enqueued with an `expires_at` (OTP emails expire with the code) are
+  marked failed instead of being sent or retried after it.
+- Sent and failed rows keep their metadata but not their body.
+- `secrets` (the OTP code) never reach the table: they are kept in the
+  OTP_CACHE_ALIAS cache until `expires_at`, filled into the body's {name}
+  placeholders at send time and deleted once the email is sent or given up.
+  An email whose secrets are gone is marked failed. The `otp` cache is shared
+  by default, so a separate `manage.py send_emails` process can read them; a
+  per-process cache only works with the EMAIL_OUTBOX_THREAD worker.
+
+With EMAIL_OUTBOX_THREAD on, a process starts a worker thread when it first
+enqueues an email; the thread wakes up on every enqueue and every
+EMAIL_OUTBOX_POLL_INTERVAL seconds for retries. `manage.py send_emails` runs
+the same loop as a separate process, and also picks up emails left behind by
+processes that have exited.
+
+The worker publishes email_outbox_pending and email_outbox_oldest_seconds on
+/metrics, and counts sends in email_outbox_sends_total.
+"""
+import logging
+import random
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from api.metrics import counter, gauge
+from users.models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+email_outbox_pending = gauge("email_outbox_pending", "Emails waiting in the outbox.")
+email_outbox_oldest_seconds = gauge("email_outbox_oldest_seconds", "Age of the oldest email waiting in the outbox.")
+email_outbox_sends_total = counter(
+    "email_outbox_sends_total", "Outbox send attempts, by outcome (sent, retry, failed, expired)."
+)
+
+_worker = None
+_lock = threading.Lock()
+
+
+def secrets_key(email_id):
+    return f"outbox-secrets:{email_id}"
+
+
+def enqueue_email(subject, body, to, from_email=None, expires_at=None, secrets=None):
+    """
+    Queue an email; it is sent once the surrounding transaction commits, and
+    not after `expires_at`. `secrets` are filled into `body` at send time and
+    need an `expires_at`.
+    """
+    if secrets and expires_at is None:
+        raise ValueError("Emails with secrets need an expires_at.")
+    email = OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        expires_at=expires_at,
+        has_secrets=bool(secrets),
+    )
+    if secrets:
+        timeout = max(1, (expires_at - timezone.now()).total_seconds())
+        caches[settings.OTP_CACHE_ALIAS].set(secrets_key(email.id), secrets, timeout)
+    if settings.EMAIL_OUTBOX_THREAD:
+        transaction.on_commit(wake_worker)
+    return email
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, after `attempts` failed ones."""
+    delay = min(settings.EMAIL_OUTBOX_MAX_BACKOFF, settings.EMAIL_OUTBOX_BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def expire_due(now):
+    """Give up on pending emails whose expires_at has passed."""
+    expired = OutboundEmail.objects.filter(status=OutboundEmail.PENDING, expires_at__lte=now).update(
+        status=OutboundEmail.FAILED, body="", claim="", last_error="Expired before it could be sent."
+    )
+    if expired:
+        email_outbox_sends_total.inc(expired, outcome="expired")
+
+
+def claim_batch(size=None):
+    """Claim up to `size` due emails for this worker and return them."""
+    now = timezone.now()
+    expire_due(now)
+    due = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.PENDING, next_attempt_at__lte=now)
+        .order_by("next_attempt_at", "id")
+        .values_list("id", flat=True)[:size or settings.EMAIL_OUTBOX_BATCH_SIZE]
+    )
+    if not due:
+        return []
+    claim = uuid.uuid4().hex
+    # Only rows no other worker claimed in the meantime change hands.
+    OutboundEmail.objects.filter(
+        id__in=due, status=OutboundEmail.PENDING, next_attempt_at__lte=now
+    ).update(claim=claim, next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE))
+    return list(OutboundEmail.objects.filter(claim=claim, status=OutboundEmail.PENDING).order_by("id"))
+
+
+def render_bodies(emails):
+    """{email id: body to send}, with secrets filled in. Emails whose secrets are gone are left out."""
+    secret_cache = caches[settings.OTP_CACHE_ALIAS]
+    keys = [secrets_key(email.id) for email in emails if email.has_secrets]
+    found = secret_cache.get_many(keys) if keys else {}
+    bodies = {}
+    for email in emails:
+        if not email.has_secrets:
+            bodies[email.id] = email.body
+        elif secrets_key(email.id) in found:
+            bodies[email.id] = email.body.format(**found[secrets_key(email.id)])
+    return bodies
+
+
+def send_batch(size=None):
+    """Send one batch of due emails. Returns the number of emails attempted."""
+    emails = claim_batch(size)
+    if not emails:
+        return 0
+
+    bodies = render_bodies(emails)
+    lost = [email.id for email in emails if email.id not in bodies]
+    if lost:
+        OutboundEmail.objects.filter(id__in=lost).update(
+            status=OutboundEmail.FAILED, body="", claim="", last_error="Its secrets expired before it could be sent."
+        )
+        email_outbox_sends_total.inc(len(lost), outcome="expired")
+        emails = [email for email in emails if email.id in bodies]
+        if not emails:
+            return len(lost)
+
+    sent, failed = [], []
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for email in emails:
+                message = EmailMessage(email.subject, bodies[email.id], email.from_email, email.to, connection=connection)
+                try:
+                    connection.send_messages([message])
+                except Exception as e:
+                    failed.append((email, e))
+                else:
+                    sent.append(email)
+    except Exception as e:
+        # Connecting (or closing) failed; retry whatever wasn't sent.
+        done = {email.id for email in sent} | {email.id for email, _ in failed}
+        failed += [(email, e) for email in emails if email.id not in done]
+
+    now = timezone.now()
+    if sent:
+        OutboundEmail.objects.filter(id__in=[email.id for email in sent]).update(
+            status=OutboundEmail.SENT, sent_at=now, body="", claim="", attempts=F("attempts") + 1
+        )
+        email_outbox_sends_total.inc(len(sent), outcome="sent")
+    for email, error in failed:
+        email.attempts += 1
+        email.claim = ""
+        email.last_error = str(error)[:1000]
+        email.next_attempt_at = now + timedelta(seconds=backoff(email.attempts))
+        if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            email.status, email.body = OutboundEmail.FAILED, ""
+            email_outbox_sends_total.inc(outcome="failed")
+            logger.error("Giving up on email %s after %d attempts: %s", email.id, email.attempts, error)
+        elif email.expires_at and email.next_attempt_at >= email.expires_at:
+            # The retry would deliver an expired code.
+            email.status, email.body = OutboundEmail.FAILED, ""
+            email_outbox_sends_total.inc(outcome="expired")
+        else:
+            email_outbox_sends_total.inc(outcome="retry")
+    if failed:
+        OutboundEmail.objects.bulk_update(
+            [email for email, _ in failed], ["attempts", "claim", "last_error", "status", "next_attempt_at", "body"]
+        )
+    done = sent + [email for email, _ in failed if email.status == OutboundEmail.FAILED]
+    if any(email.has_secrets for email in done):
+        caches[settings.OTP_CACHE_ALIAS].delete_many([secrets_key(email.id) for email in done if email.has_secrets])
+    return len(emails) + len(lost)
+
+
+def flush(limit=None):
+    """Send due emails until none are left (or `limit` were attempted). Returns the number attempted."""
+    total = 0
+    while limit is None or total < limit:
+        count = send_batch(None if limit is None else min(settings.EMAIL_OUTBOX_BATCH_SIZE, limit - total))
+        if not count:
+            break
+        total += count
+    update_metrics()
+    return total
+
+
+def update_metrics():
+    stats = OutboundEmail.objects.filter(status=OutboundEmail.PENDING).aggregate(
+        pending=Count("id"), oldest=Min("created_at")
+    )
+    email_outbox_pending.set(stats["pending"])
+    oldest = stats["oldest"]
+    email_outbox_oldest_seconds.set((timezone.now() - oldest).total_seconds() if oldest else 0)
+
+
+class OutboxWorker(threading.Thread):
+    """Flushes the outbox when woken up, and every EMAIL_OUTBOX_POLL_INTERVAL seconds."""
+
+    def __init__(self):
+        super().__init__(name="email-outbox", daemon=True)
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(settings.EMAIL_OUTBOX_POLL_INTERVAL)
+            self.wakeup.clear()
+            # The thread holds its own DB connection; keep it from going stale.
+            close_old_connections()
+            try:
+                flush()
+            except Exception:
+                logger.exception("Flushing the email outbox failed")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+
+
+def wake_worker():
+    """Start this process's outbox thread if needed and have it flush now."""
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+        _worker.wakeup.set()
@@ -2,6 +2,10 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from users.authentication import add_user_claims
 from users.models import User
 from dj_rest_auth.registration.serializers import RegisterSerializer
 
@@ -85,14 +89,10 @@ class LoginResponseSerializer(serializers.Serializer):
 class OTPSerializer(serializers.Serializer):
     """
     Serializer for requesting OTP via email.
+    The view looks the user up itself.
     """
     email = serializers.EmailField()
 
-    def validate_email(self, value):
-        if not User.objects.filter(email=value).exists():
-            raise serializers.ValidationError("User with this email does not exist.")
-        return value
-
 
 class SendOTPResponseSerializer(serializers.Serializer):
     message = serializers.CharField()
@@ -158,3 +158,18 @@ class UserDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = User  # or get_user_model()
         fields = ['id', 'username', 'email']  # adjust as needed
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that re-reads the user's claims (see users/authentication.py)
+    from the DB, so refreshed and rotated tokens carry the current ones.
+    """
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        user = User.objects.filter(**{jwt_settings.USER_ID_FIELD: refresh.get(jwt_settings.USER_ID_CLAIM)}).first()
+        if user is None or not jwt_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        add_user_claims(refresh, user)
+        return super().validate({**attrs, "refresh": str(refresh)})
@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from payments.models import Subscription
+from .authentication import invalidate_user_state
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user_state(sender, instance, **kwargs):
+    invalidate_user_state(instance.id)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def drop_cached_plan_limit(sender, instance, **kwargs):
+    # The tier and max_plans claims come from the subscription.
+    invalidate_user_state(instance.user_id)
@@ -1,3 +1,355 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from api.ratelimit import SlidingWindow
+from payments.models import FREE_MAX_PLANS, Subscription
+from plans.models import Plan
+from users.models import OutboundEmail, User
+from users.outbox import claim_batch, enqueue_email, flush
+
+
+class StatelessJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["throttle"].clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42", llm_profile="fast"
+        )
+        Plan.objects.create(user=self.user, title="Sprint drills")
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post(
+            "/api/api/token/", {"email": "coach@example.com", "password": "warmup-drills-42"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.refresh = response.data["refresh"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['access']}")
+
+    def refresh_token(self):
+        response = APIClient().post("/api/jwt/jwt/refresh/", {"refresh": self.refresh}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.refresh = response.data["refresh"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['access']}")
+        return AccessToken(response.data["access"])
+
+    def get_plans(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/plans/")
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in queries]
+
+    @override_settings(JWT_USER_CHECK_TTL=0)
+    def test_requests_run_no_user_query(self):
+        self.login()
+        queries = self.get_plans()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"users_user"', queries[0])
+
+    def test_user_state_is_checked_once_per_ttl(self):
+        self.login()
+        self.assertEqual(len(self.get_plans()), 2)
+        self.assertEqual(len(self.get_plans()), 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.login()
+        self.get_plans()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/plans/").status_code, 401)
+
+    def test_user_is_built_from_claims(self):
+        Subscription.objects.create(user=self.user, stripe_customer_id="cus_1", is_active=True, max_plans=1)
+        self.login()
+        response = self.client.post("/api/plans/", {"title": "Another", "plan_type": "chat"}, format="json")
+        self.assertEqual(response.status_code, 400)  # the pro tier's limit of 1, read from the token
+
+        response = self.client.get("/api/profile/")
+        self.assertEqual(response.data["email"], "coach@example.com")
+
+    def test_demoted_staff_must_refresh(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.login()
+        self.get_plans()
+        self.user.is_staff = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/plans/").status_code, 401)
+        self.assertFalse(self.refresh_token()["is_staff"])
+        self.assertEqual(self.client.get("/api/plans/").status_code, 200)
+
+    def test_lapsed_subscription_must_refresh(self):
+        subscription = Subscription.objects.create(
+            user=self.user, stripe_customer_id="cus_1", is_active=True, max_plans=1
+        )
+        self.login()
+        self.get_plans()
+        subscription.is_active = False
+        subscription.save()
+        self.assertEqual(self.client.get("/api/plans/").status_code, 401)
+        token = self.refresh_token()
+        self.assertEqual((token["tier"], token["max_plans"]), ("free", FREE_MAX_PLANS))
+
+    @override_settings(JWT_USER_CHECK_TTL=0)
+    def test_refresh_reads_current_claims(self):
+        self.login()
+        User.objects.filter(id=self.user.id).update(llm_profile="careful", is_verified=True)
+        token = self.refresh_token()
+        self.assertEqual((token["llm_profile"], token["is_verified"]), ("careful", True))
+
+    def test_tokens_without_claims_still_work(self):
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f"JWT {token}")
+        self.assertEqual(self.client.get("/api/plans/").status_code, 200)
+
+
+@override_settings(OTP_CACHE_ALIAS="default", EMAIL_OUTBOX_THREAD=False)
+class OTPTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["throttle"].clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.client = APIClient()
+
+    def send_otp(self, email="coach@example.com"):
+        return self.client.post("/api/send-otp/", {"email": email}, format="json")
+
+    def sent_otp(self):
+        flush()
+        return mail.outbox[-1].body.rsplit(" ", 1)[-1]
+
+    def verify(self, otp):
+        return self.client.post("/api/verify-otp/", {"email": "coach@example.com", "otp": otp}, format="json")
+
+    def test_otp_is_hashed_and_verifies_once(self):
+        response = self.send_otp()
+        self.assertEqual(response.status_code, 200)
+        otp = self.sent_otp()
+        self.assertNotIn(otp, [str(value) for value in cache._cache.values()])
+
+        self.assertEqual(self.verify(otp).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_verified)
+        self.assertEqual(self.verify(otp).status_code, 400)
+
+    @override_settings(OTP_MAX_ATTEMPTS=2)
+    def test_guesses_are_limited(self):
+        self.send_otp()
+        otp = self.sent_otp()
+        wrong = f"{(int(otp) + 1) % 1000000:06d}"
+        self.assertEqual(self.verify(wrong).status_code, 400)
+        self.assertEqual(self.verify(wrong).status_code, 400)
+        self.assertEqual(self.verify(otp).status_code, 400)  # used up
+
+    @override_settings(OTP_RATE_LIMIT=2)
+    def test_requests_are_rate_limited(self):
+        self.assertEqual(self.send_otp().status_code, 200)
+        self.assertEqual(self.send_otp().status_code, 200)
+        response = self.send_otp()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+    def test_send_only_queues_the_email(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.send_otp().status_code, 200)
+        self.assertEqual(len(queries), 2)  # the user lookup and the outbox insert
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(self.send_otp("nobody@example.com").status_code, 404)
+
+
+@override_settings(AUTH_THROTTLE_RATES={"ip": "10/min", "email": "5/min", "ip_email": "3/min"})
+class AuthThrottleTests(TestCase):
+    def setUp(self):
+        caches["throttle"].clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.client = APIClient()
+
+    def login(self, password="wrong", email="coach@example.com", ip="10.0.0.1", url="/api/login/"):
+        return self.client.post(url, {"email": email, "password": password}, format="json", REMOTE_ADDR=ip)
+
+    def test_rejected_before_any_query(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 400)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(len(queries), 0)
+
+    def test_login_views_share_counters(self):
+        for _ in range(3):
+            self.login(url="/api/api/token/")
+        self.assertEqual(self.login().status_code, 429)
+
+    def test_email_is_limited_across_addresses(self):
+        for n in range(5):
+            self.assertEqual(self.login(ip=f"10.0.0.{n}").status_code, 400)
+        self.assertEqual(self.login(ip="10.0.0.9").status_code, 429)
+        self.assertEqual(self.login(email="other@example.com", ip="10.0.0.9").status_code, 400)
+
+    def test_ip_is_limited_across_emails(self):
+        for n in range(10):
+            self.login(email=f"user{n}@example.com")
+        self.assertEqual(self.login(email="fresh@example.com").status_code, 429)
+
+    def test_success_resets_ip_email(self):
+        for _ in range(2):
+            self.login()
+        self.assertEqual(self.login("warmup-drills-42").status_code, 200)
+        for _ in range(2):  # 5 in a row, over the ip_email limit of 3
+            self.assertEqual(self.login().status_code, 400)
+
+    def test_otp_views_are_throttled(self):
+        for _ in range(3):
+            self.client.post("/api/verify-otp/", {"email": "coach@example.com", "otp": "000000"}, format="json")
+        response = self.client.post("/api/verify-otp/", {"email": "coach@example.com", "otp": "000000"}, format="json")
+        self.assertEqual(response.status_code, 429)
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        caches["throttle"].clear()
+        self.user = User.objects.create_user(
+            email="coach@example.com", username="coach", password="warmup-drills-42"
+        )
+        self.client = APIClient()
+
+    def login(self, password="warmup-drills-42", url="/api/login/"):
+        return self.client.post(url, {"email": "coach@example.com", "password": password}, format="json")
+
+    def stored_hash(self):
+        self.user.refresh_from_db()
+        return self.user.password
+
+    def test_tests_use_the_fast_policy(self):
+        self.assertTrue(self.stored_hash().startswith("md5$"))
+
+    @override_settings(PASSWORD_HASHERS=settings.PASSWORD_HASH_POLICIES["pbkdf2"], PASSWORD_PBKDF2_ITERATIONS=1000)
+    def test_login_rehashes_with_the_new_cost(self):
+        self.user.set_password("warmup-drills-42")
+        self.user.save()
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login("wrong").status_code, 400)
+            self.assertTrue(self.stored_hash().startswith("pbkdf2_sha256$1000$"))
+            self.assertEqual(self.login().status_code, 200)
+            self.assertTrue(self.stored_hash().startswith("pbkdf2_sha256$2000$"))
+
+    def test_login_rehashes_with_the_new_hasher(self):
+        with override_settings(PASSWORD_HASHERS=settings.PASSWORD_HASH_POLICIES["pbkdf2"], PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.user.set_password("warmup-drills-42")
+            self.user.save()
+        self.assertEqual(self.login(url="/api/api/token/").status_code, 200)
+        self.assertTrue(self.stored_hash().startswith("md5$"))
+
+class FlakyBackend(EmailBackend):
+    """Fails the sends whose subject says so."""
+
+    connections = 0
+
+    def open(self):
+        FlakyBackend.connections += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any("fail" in message.subject for message in messages):
+            raise ConnectionError("421 Service not available")
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND="users.tests.FlakyBackend", EMAIL_OUTBOX_THREAD=False, EMAIL_OUTBOX_MAX_ATTEMPTS=2
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        FlakyBackend.connections = 0
+
+    def test_batch_is_sent_over_one_connection(self):
+        for n in range(3):
+            enqueue_email(f"Code {n}", "Your OTP code is 123456", ["coach@example.com"])
+        self.assertEqual(flush(), 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(FlakyBackend.connections, 1)
+        self.assertEqual(set(OutboundEmail.objects.values_list("status", "body")), {("sent", "")})
+
+    def test_failures_are_retried_then_given_up(self):
+        email = enqueue_email("Please fail", "body", ["coach@example.com"])
+        enqueue_email("Hello", "body", ["coach@example.com"])
+        self.assertEqual(flush(), 2)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ("pending", 1))
+        self.assertIn("421", email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(flush(), 0)  # backing off
+
+        OutboundEmail.objects.filter(id=email.id).update(next_attempt_at=timezone.now())
+        with self.assertLogs("users.outbox", "ERROR") as logs:
+            self.assertEqual(flush(), 1)
+        self.assertIn(f"email {email.id}", logs.output[0])
+        self.assertNotIn("coach@example.com", logs.output[0])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.body), ("failed", 2, ""))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_secrets_stay_out_of_the_table(self):
+        expires_at = timezone.now() + timedelta(minutes=1)
+        email = enqueue_email("Code", "Your OTP code is {otp}", ["coach@example.com"],
+                              expires_at=expires_at, secrets={"otp": "123456"})
+        lost = enqueue_email("Code", "Your OTP code is {otp}", ["coach@example.com"],
+                             expires_at=expires_at, secrets={"otp": "654321"})
+        self.assertNotIn("123456", OutboundEmail.objects.get(id=email.id).body)
+        caches[settings.OTP_CACHE_ALIAS].delete(f"outbox-secrets:{lost.id}")
+
+        self.assertEqual(flush(), 2)
+        self.assertEqual([message.body for message in mail.outbox], ["Your OTP code is 123456"])
+        self.assertIsNone(caches[settings.OTP_CACHE_ALIAS].get(f"outbox-secrets:{email.id}"))
+        lost.refresh_from_db()
+        self.assertEqual(lost.status, "failed")
+
+    def test_expired_emails_are_dropped(self):
+        soon = timezone.now() + timedelta(seconds=5)
+        retried = enqueue_email("Please fail", "Your OTP code is 123456", ["coach@example.com"], expires_at=soon)
+        late = enqueue_email("Code", "Your OTP code is 654321", ["coach@example.com"], expires_at=timezone.now())
+        flush()
+        self.assertEqual(mail.outbox, [])
+        for email in (retried, late):
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.body), ("failed", ""))
+
+    def test_claimed_rows_are_leased(self):
+        enqueue_email("Hello", "body", ["coach@example.com"])
+        self.assertEqual(len(claim_batch()), 1)
+        self.assertEqual(claim_batch(), [])
+        # A worker that died holding the claim loses it when the lease runs out.
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(claim_batch()), 1)
+
+
+class SlidingWindowTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caches["throttle"].clear()
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        limiter = SlidingWindow("test", limit=4, window=100)
+        for _ in range(4):
+            self.assertTrue(limiter.hit("k", now=1050)[0])
+        self.assertFalse(limiter.hit("k", now=1099)[0])
+        # A quarter into the next window, 3/4 of the previous 5 hits still count.
+        allowed, retry_after = limiter.hit("k", now=1125)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertTrue(limiter.hit("k", now=1190)[0])
@@ -0,0 +1,117 @@
+"""
+Throttles for the login and OTP endpoints.
+
+Guessing passwords or OTP codes is cheap for a client and expensive for us:
+every login attempt runs the password hasher. These DRF throttles run in
+APIView.initial(), before the view touches the database or hashes anything,
+and reject with a 429 and a Retry-After header.
+
+Each view gets three sliding windows (api/ratelimit.py), with the rates in
+AUTH_THROTTLE_RATES:
+
+- "ip": attempts from one client address, whatever the account;
+- "email": attempts against one account, from anywhere;
+- "ip_email": attempts against one account from one address. This one is the
+  tightest, and a successful login or OTP check resets it (forget_attempts),
+  so the account's owner isn't held to it.
+
+Views name their counters with `auth_throttle_scope`: LoginView and the token
+view share "login", the OTP views use "otp". The windows live in the
+AUTH_THROTTLE_CACHE_ALIAS cache, in memory by default, so nothing but the
+cache is touched to reject a request. A local-memory cache counts per worker
+process; point THROTTLE_CACHE_BACKEND at Redis or Memcached to share the
+counts between workers.
+"""
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from api.metrics import counter
+from api.ratelimit import SlidingWindow
+from .otp import email_key
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+auth_throttled_total = counter(
+    "auth_throttled_total", "Login and OTP attempts rejected by a throttle, by scope and kind."
+)
+
+
+def parse_rate(rate):
+    """'10/min' -> (10, 60), as DRF writes rates. An empty rate is None (no throttle)."""
+    if not rate:
+        return None
+    count, period = rate.split("/")
+    return int(count), PERIODS[period[0]]
+
+
+def request_email(request):
+    """The email the request is about, from the body, or None."""
+    try:
+        email = request.data.get("email")
+    except AttributeError:  # a body that isn't an object
+        return None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+class AuthThrottle(BaseThrottle):
+    kind = None
+
+    def get_key(self, request):
+        raise NotImplementedError
+
+    def window(self, view):
+        rate = parse_rate(settings.AUTH_THROTTLE_RATES.get(self.kind))
+        if rate is None:
+            return None
+        scope = getattr(view, "auth_throttle_scope", "login")
+        return SlidingWindow(f"auth:{scope}:{self.kind}", *rate, cache_alias=settings.AUTH_THROTTLE_CACHE_ALIAS)
+
+    def allow_request(self, request, view):
+        self.retry_after = None
+        window = self.window(view)
+        key = self.get_key(request)
+        if window is None or key is None:
+            return True
+        allowed, retry_after = window.hit(key)
+        if not allowed:
+            self.retry_after = retry_after
+            auth_throttled_total.inc(scope=getattr(view, "auth_throttle_scope", "login"), kind=self.kind)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPThrottle(AuthThrottle):
+    kind = "ip"
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailThrottle(AuthThrottle):
+    kind = "email"
+
+    def get_key(self, request):
+        email = request_email(request)
+        return email_key(email) if email else None
+
+
+class IPEmailThrottle(AuthThrottle):
+    kind = "ip_email"
+
+    def get_key(self, request):
+        email = request_email(request)
+        return f"{self.get_ident(request)}:{email_key(email)}" if email else None
+
+
+AUTH_THROTTLES = [IPThrottle, EmailThrottle, IPEmailThrottle]
+
+
+def forget_attempts(request, view):
+    """Reset the ip_email window after a successful login or OTP check."""
+    throttle = IPEmailThrottle()
+    window = throttle.window(view)
+    key = throttle.get_key(request)
+    if window is not None and key is not None:
+        window.reset(key)
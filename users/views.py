@@ -11,18 +11,19 @@ from rest_framework.exceptions import ValidationError
 from django.contrib.auth import get_user_model, authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.utils import timezone
-from django.core.mail import send_mail
 from django.conf import settings
-import random
+from django.utils import timezone
 from datetime import timedelta
 from rest_framework import viewsets
-from rest_framework_simplejwt.tokens import RefreshToken
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import serializers
 from dj_rest_auth.registration.views import RegisterView
+from .authentication import add_user_claims, invalidate_user_state
+from .otp import OTPRateLimited, issue_otp, verify_otp
+from .outbox import enqueue_email
+from .throttling import AUTH_THROTTLES, forget_attempts
 from .serializers import CustomRegisterSerializer
 from .serializers import (
     UserSerializer,
@@ -76,27 +77,32 @@ class MyProfileView(RetrieveUpdateAPIView):
     def get_object(self):
         """
         Returns the user object associated with the current request.
+        request.user may come from token claims; the profile needs every field.
         """
-        return self.request.user
+        return User.objects.get(pk=self.request.user.pk)
 
 
 class LoginView(APIView):
     """
     API endpoint for user login.
     Returns JWT access and refresh tokens upon successful authentication.
+    Throttled per IP, email and IP+email before the password is checked.
     """
     permission_classes = [AllowAny]
+    throttle_classes = AUTH_THROTTLES
+    auth_throttle_scope = 'login'
 
     @swagger_auto_schema(
         request_body=LoginSerializer,
-        responses={200: LoginResponseSerializer}
+        responses={200: LoginResponseSerializer, 429: 'Too many login attempts (see Retry-After).'}
     )
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
         user = serializer.validated_data['user']
-        refresh = RefreshToken.for_user(user)
+        forget_attempts(request, self)
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
 
         return Response({
             "message": "Login successful",
@@ -113,14 +119,15 @@ class SendOTPView(GenericAPIView):
     """
     serializer_class = OTPSerializer
     permission_classes = [AllowAny]
+    throttle_classes = AUTH_THROTTLES
+    auth_throttle_scope = 'otp'
 
     @swagger_auto_schema(
         request_body=OTPSerializer,
         responses={
             200: SendOTPResponseSerializer,
             404: ErrorResponseSerializer,
-            429: 'Too many OTP requests. Try again after 1 hour.',
-            500: ErrorResponseSerializer,
+            429: 'Too many OTP requests. Try again later (see Retry-After).',
         }
     )
     def post(self, request, *args, **kwargs):
@@ -128,59 +135,48 @@ class SendOTPView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data['email']
 
-        try:
-            user = User.objects.only(
-                'id', 'email', 'otp', 'otp_created_at',
-                'otp_request_count', 'otp_request_reset_time'
-            ).get(email=email)
-
-            now = timezone.now()
-            # Reset OTP request count if more than 1 hour has passed since last reset time
-            if not user.otp_request_reset_time or now > user.otp_request_reset_time + timedelta(hours=1):
-                user.otp_request_count = 0
-                user.otp_request_reset_time = now
-
-            # Enforce OTP request limit (e.g., 5 requests per hour)
-            if user.otp_request_count >= 5:
-                return Response({'error': 'Too many OTP requests. Try again after 1 hour.'}, status=429)
-
-            # Generate and save OTP
-            otp = str(random.randint(100000, 999999))
-            user.otp = otp
-            user.otp_created_at = now
-            user.otp_request_count += 1
-            user.save(update_fields=['otp', 'otp_created_at', 'otp_request_count', 'otp_request_reset_time'])
-
-            # Send OTP email
-            try:
-                send_mail(
-                    subject='Your OTP Code',
-                    message=f'Your OTP code is {otp}',
-                    from_email=settings.EMAIL_HOST_USER,
-                    recipient_list=[email],
-                    fail_silently=False
-                )
-            except Exception as e:
-                return Response({'error': 'Email sending failed', 'detail': str(e)}, status=500)
-
-            return Response({'message': 'OTP sent successfully', 'email': email}, status=200)
-
-        except User.DoesNotExist:
+        if not User.objects.filter(email=email).exists():
             return Response({'error': 'User not found'}, status=404)
 
+        # Rate limited per email; the OTP is kept (hashed) in the OTP store, see users/otp.py
+        try:
+            otp = issue_otp(email)
+        except OTPRateLimited as e:
+            response = Response({'error': str(e)}, status=429)
+            response['Retry-After'] = str(e.retry_after)
+            return response
+
+        # Queued in the outbox and sent in the background, see users/outbox.py
+        enqueue_email(
+            subject='Your OTP Code',
+            # The code is kept in the cache, not the outbox table, and filled in at send time
+            body='Your OTP code is {otp}',
+            secrets={'otp': otp},
+            to=[email],
+            from_email=settings.EMAIL_HOST_USER,
+            # An email arriving after the code expired is of no use.
+            expires_at=timezone.now() + timedelta(seconds=settings.OTP_TTL),
+        )
+
+        return Response({'message': 'OTP sent successfully', 'email': email}, status=200)
+
 
 class VerifyOTPView(GenericAPIView):
     """
     API endpoint to verify an OTP sent to a user's email.
+    Throttled per IP, email and IP+email, on top of the per-code guess limit.
     """
     serializer_class = VerifyOTPSerializer
     permission_classes = [AllowAny]
+    throttle_classes = AUTH_THROTTLES
+    auth_throttle_scope = 'otp'
 
     @swagger_auto_schema(
         request_body=VerifyOTPSerializer,
         responses={
             200: VerifyOTPResponseSerializer,
-            400: 'Invalid OTP or email / OTP expired'
+            400: 'Invalid or expired OTP, or unknown email',
+            429: 'Too many attempts (see Retry-After).',
         }
     )
     def post(self, request, *args, **kwargs):
@@ -189,21 +185,16 @@ class VerifyOTPView(GenericAPIView):
         email = serializer.validated_data['email']
         otp = serializer.validated_data['otp']
 
-        try:
-            user = User.objects.only('id', 'email', 'otp', 'otp_created_at', 'is_verified').get(email=email, otp=otp)
-            # Check if OTP has expired (e.g., 1 minute validity)
-            if not user.otp_created_at or timezone.now() > user.otp_created_at + timedelta(minutes=1):
-                return Response({'error': 'OTP has expired'}, status=400)
-
-            user.is_verified = True
-            user.otp = ''  # Clear OTP after successful verification
-            user.otp_created_at = None
-            user.save(update_fields=['is_verified', 'otp', 'otp_created_at'])
-
-            return Response({'message': 'OTP Verified successfully', 'email': email}, status=200)
-
-        except User.DoesNotExist:
+        # Expired, used-up and wrong codes all fail the same way
+        user_id = User.objects.filter(email=email).values_list('id', flat=True).first() if verify_otp(email, otp) else None
+        if user_id is None:
             return Response({'error': 'Invalid OTP or email'}, status=400)
+        User.objects.filter(id=user_id).update(is_verified=True)
+        # Tokens carry is_verified; they have to be refreshed (see users/authentication.py)
+        invalidate_user_state(user_id)
+
+        forget_attempts(request, self)
+        return Response({'message': 'OTP Verified successfully', 'email': email}, status=200)
 
 
 class ChangePasswordView(GenericAPIView):
@@ -258,6 +249,11 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     class Meta:
         fields = ['email', 'password'] # Explicitly define fields for clarity, though not strictly necessary here
 
+    @classmethod
+    def get_token(cls, user):
+        # Claims read by StatelessJWTAuthentication instead of a user query
+        return add_user_claims(super().get_token(user), user)
+
     def validate(self, attrs):
         email = attrs.get('email')
         password = attrs.get('password')
@@ -286,8 +282,17 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     """
     Custom JWT token obtain view that uses CustomTokenObtainPairSerializer.
     This allows logging in with email and password.
+    Throttled like LoginView, with which it shares its counters.
     """
     serializer_class = CustomTokenObtainPairSerializer
+    throttle_classes = AUTH_THROTTLES
+    auth_throttle_scope = 'login'
+
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            forget_attempts(request, self)
+        return response
 
 
 class CustomRegisterView(RegisterView):